@@ -0,0 +1,151 @@
+"""
+• Контроль доступа к боту
+  - Allow-list: владелец (TG_ID), ACCESS["allow"] и users из маршрутов уведомлений;
+    проверка — поиск во frozenset, без обращений к Telegram.
+  - Отказавшие пользователи хранятся в LRU/TTL-кэше (ACCESS["deny_cache_size"], ["deny_ttl"]).
+  - Ответ «⛔ ДОСТУП ЗАБЛОКИРОВАН ⛔» и запись в access.log ограничены token bucket'ами на
+    пользователя (ACCESS["reply_per_min"], ["log_per_min"]): спамер не расходует квоту API и диск.
+  - Подавленные отказы сводятся в периодические записи access.log (ACCESS["summary_interval"]).
+"""
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Union
+from aiogram.types import Message, CallbackQuery, InlineQuery
+import config
+from config import TG_ID
+import alerts
+
+logger = logging.getLogger("access")
+
+# Настройки читаются при каждом обращении: ACCESS перезагружается вместе с конфигом
+def _cfg() -> dict:
+    return getattr(config, "ACCESS", None) or {}
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    # rate — токенов в секунду, capacity — максимальный запас
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+_ALLOWED: frozenset[int] = frozenset()
+
+# uid → запись об отказах (порядок — от давно активных к недавним)
+DENY_CACHE: "OrderedDict[int, dict]" = OrderedDict()
+
+def refresh():
+    global _ALLOWED
+    _ALLOWED = frozenset({TG_ID, *(_cfg().get("allow") or []), *alerts.authorized_users()})
+    for uid in [uid for uid in DENY_CACHE if uid in _ALLOWED]:
+        del DENY_CACHE[uid]
+
+refresh()
+
+def is_allowed(uid) -> bool:
+    return uid in _ALLOWED
+
+def _bucket(per_min_key: str, default: float) -> TokenBucket:
+    per_min = float(_cfg().get(per_min_key, default))
+    return TokenBucket(per_min / 60.0, max(1.0, per_min))
+
+def _flush_entry(uid: int, entry: dict):
+    if entry["suppressed"]:
+        logger.warning(
+            "DENY summary: uid=%s user=%s denied=%d suppressed=%d last_action=%r",
+            uid, entry["user"], entry["denied"], entry["suppressed"], entry["last_action"],
+        )
+    entry["denied"] = 0
+    entry["suppressed"] = 0
+
+def _entry(uid: int, user_label: str) -> dict:
+    now = time.monotonic()
+    ttl = float(_cfg().get("deny_ttl", 3600))
+    entry = DENY_CACHE.get(uid)
+    if entry is not None and now - entry["seen"] > ttl:
+        _flush_entry(uid, entry)
+        entry = None
+    if entry is None:
+        entry = {
+            "user": user_label,
+            "seen": now,
+            "denied": 0,
+            "suppressed": 0,
+            "last_action": "",
+            "reply": _bucket("reply_per_min", 2),
+            "log": _bucket("log_per_min", 5),
+        }
+        DENY_CACHE[uid] = entry
+        # текущий uid не вытесняем: 0 в конфиге — «хранить только последнего»
+        limit = max(1, int(_cfg().get("deny_cache_size", 1024)))
+        while len(DENY_CACHE) > limit:
+            old_uid, old_entry = DENY_CACHE.popitem(last=False)
+            _flush_entry(old_uid, old_entry)
+    DENY_CACHE.move_to_end(uid)
+    entry["seen"] = now
+    return entry
+
+# Проверка доступа. True — пользователь отклонён (хэндлер дальше не работает)
+async def deny_if_unauthorized(obj: Union[Message, CallbackQuery, InlineQuery]) -> bool:
+    user = obj.from_user
+    uid = getattr(user, "id", None)
+    if uid in _ALLOWED:
+        return False
+
+    uname = f"@{getattr(user, 'username', '')}" if getattr(user, "username", None) else "-"
+    fname = getattr(user, "first_name", "-")
+
+    # --- что именно сделал пользователь ---
+    if isinstance(obj, Message):
+        action = obj.text or "<non-text message>"
+    elif isinstance(obj, CallbackQuery):
+        action = obj.data or "<no callback data>"
+    else:
+        action = f"inline:{obj.query}"
+
+    entry = _entry(uid, f"{uname} {fname}")
+    entry["denied"] += 1
+    entry["last_action"] = action
+
+    if entry["log"].take():
+        logger.warning("DENY: uid=%s user=%s %s action=%r", uid, uname, fname, action)
+    else:
+        entry["suppressed"] += 1
+
+    if not entry["reply"].take():
+        return True
+    try:
+        if isinstance(obj, Message):
+            await obj.answer("⛔ ДОСТУП ЗАБЛОКИРОВАН ⛔")
+        elif isinstance(obj, CallbackQuery):
+            await obj.answer("⛔ ДОСТУП ЗАБЛОКИРОВАН ⛔", show_alert=True)
+        else:
+            await obj.answer([], cache_time=60, is_personal=True)
+    except Exception as e:
+        logger.error("deny_if_unauthorized: notify failed: %s", e)
+    return True
+
+# Периодические сводки по подавленным отказам
+async def summary_loop():
+    while True:
+        await asyncio.sleep(max(10.0, float(_cfg().get("summary_interval", 300))))
+        ttl = float(_cfg().get("deny_ttl", 3600))
+        now = time.monotonic()
+        for uid, entry in list(DENY_CACHE.items()):
+            _flush_entry(uid, entry)
+            if now - entry["seen"] > ttl:
+                del DENY_CACHE[uid]
@@ -0,0 +1,143 @@
+"""
+• Клиент API агентов на серверах
+  - Общая сессия-фабрика и запрос JSON по пути эндпоинта (/cpu_ram, /updates, ...).
+  - Согласование сжатия: gzip/deflate всегда, zstd — если установлен zstandard.
+  - Опционально компактное тело msgpack (если установлен msgpack и включено в конфиге).
+  - Крупные ответы распаковываются и разбираются в отдельном потоке, чтобы не тормозить event loop.
+  - По каждому эндпоинту запоминаются размер ответа и время декодирования.
+  - Условные запросы (If-None-Match/ETag) для редко меняющихся эндпоинтов: на 304 отдаётся закэшированное тело.
+"""
+
+import json
+import time
+import zlib
+import asyncio
+import logging
+import aiohttp
+import config
+from config import SERVERS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# ===== Настройки =====
+AGENT_API = getattr(config, "AGENT_API", {})
+
+# Порог (в байтах ответа), начиная с которого декодирование уходит в поток
+DECODE_THREAD_BYTES = int(AGENT_API.get("decode_thread_bytes", 64 * 1024))
+USE_MSGPACK = bool(AGENT_API.get("msgpack", True)) and msgpack is not None
+
+# Статистика декодирования: (server_id, path) → последние размеры и время
+PAYLOAD_STATS: dict[tuple[str, str], dict] = {}
+
+# Кэш условных запросов: (server_id, path) → (etag, разобранное тело)
+ETAG_CACHE: dict[tuple[str, str], tuple[str, object]] = {}
+
+# Момент (perf_counter) первого успешного ответа агента — для профиля старта
+FIRST_RESPONSE_AT: float | None = None
+
+# Маркер «данные не изменились с прошлого опроса» — анализатор можно не запускать
+NOT_MODIFIED = object()
+
+def accept_encoding() -> str:
+    encodings = ["gzip", "deflate"]
+    if zstandard is not None:
+        encodings.insert(0, "zstd")
+    return ", ".join(encodings)
+
+def accept_type() -> str:
+    if USE_MSGPACK:
+        return "application/msgpack, application/json;q=0.9"
+    return "application/json"
+
+# Сессия для агентов: распаковку делаем сами, чтобы управлять тем, где она выполняется
+def session(timeout: aiohttp.ClientTimeout | None = None) -> aiohttp.ClientSession:
+    if timeout is None:
+        timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
+    return aiohttp.ClientSession(timeout=timeout, auto_decompress=False)
+
+# Распаковка и разбор тела ответа (синхронно — может выполняться в потоке)
+def decode_payload(raw: bytes, encoding: str, content_type: str):
+    encoding = (encoding or "").strip().lower()
+    if encoding == "gzip":
+        raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        try:
+            raw = zlib.decompress(raw)
+        except zlib.error:
+            raw = zlib.decompress(raw, -zlib.MAX_WBITS)
+    elif encoding == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd payload received but zstandard is not installed")
+        raw = zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    elif encoding not in ("", "identity"):
+        raise ValueError(f"unsupported Content-Encoding: {encoding}")
+
+    if "msgpack" in (content_type or "").lower():
+        if msgpack is None:
+            raise ValueError("msgpack payload received but msgpack is not installed")
+        return len(raw), msgpack.unpackb(raw, raw=False)
+    return len(raw), json.loads(raw)
+
+# GET-запрос к агенту. Возвращает (status, data); data = None при статусе не 200/304.
+# При conditional=True отправляется If-None-Match, и на 304 возвращается закэшированное тело.
+async def get_json(session: aiohttp.ClientSession, server_id: str, path: str, query: str = "", conditional: bool = False):
+    logger = logging.getLogger(server_id)
+    srv = SERVERS[server_id]
+    url = f"http://{srv['ip']}:{srv['monitoring_port']}{path}?token={srv['token']}"
+    if query:
+        url += f"&{query}"
+    headers = {"Accept-Encoding": accept_encoding(), "Accept": accept_type()}
+
+    cache_key = (server_id, path)
+    cached = ETAG_CACHE.get(cache_key) if conditional else None
+    if cached:
+        headers["If-None-Match"] = cached[0]
+
+    global FIRST_RESPONSE_AT
+    async with session.get(url, headers=headers) as resp:
+        if FIRST_RESPONSE_AT is None:
+            FIRST_RESPONSE_AT = time.perf_counter()
+        if resp.status == 304 and cached:
+            return 304, cached[1]
+        if resp.status != 200:
+            return resp.status, None
+        raw = await resp.read()
+        encoding = resp.headers.get("Content-Encoding", "")
+        content_type = resp.headers.get("Content-Type", "")
+        etag = resp.headers.get("ETag")
+
+    threaded = len(raw) >= DECODE_THREAD_BYTES
+    t0 = time.perf_counter()
+    if threaded:
+        size, data = await asyncio.to_thread(decode_payload, raw, encoding, content_type)
+    else:
+        size, data = decode_payload(raw, encoding, content_type)
+    decode_ms = (time.perf_counter() - t0) * 1000
+
+    if conditional:
+        if etag:
+            ETAG_CACHE[cache_key] = (etag, data)
+        else:
+            ETAG_CACHE.pop(cache_key, None)
+
+    PAYLOAD_STATS[cache_key] = {
+        "wire_bytes": len(raw),
+        "bytes": size,
+        "encoding": encoding or "identity",
+        "decode_ms": decode_ms,
+        "threaded": threaded,
+    }
+    if threaded:
+        logger.info(
+            f"[{server_id}] {path}: {len(raw)} B ({encoding or 'identity'}) → {size} B, "
+            f"декодирование {decode_ms:.1f} мс в потоке"
+        )
+    return 200, data
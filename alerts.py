@@ -0,0 +1,113 @@
+"""
+• Маршрутизация автоуведомлений по получателям
+  - ALERT_ROUTES — список получателей:
+      {"name": "backup team", "chat_id": -100123, "thread_id": 7,
+       "categories": ["backups"], "servers": ["srv1"], "min_severity": "warning",
+       "mute": [{"from": "23:00", "to": "08:00", "tz": "Europe/Moscow", "min_severity": "critical"}],
+       "users": [111, 222]}
+    categories/servers не заданы — подходят любые; thread_id — тема форума;
+    mute — окна тишины, в которые проходят только уведомления не ниже mute.min_severity
+    (если не задано — в окно не проходит ничего); users — кто из чата может нажимать кнопки.
+  - Без ALERT_ROUTES все уведомления идут владельцу (TG_ID), как раньше.
+  - Важность: info < warning < critical.
+  - Рассылка идёт параллельно с ограничением ALERT_DELIVERY["concurrency"], при 429 —
+    повтор после retry_after.
+"""
+
+import asyncio
+import logging
+import datetime
+from zoneinfo import ZoneInfo
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+import config
+from config import TG_ID
+
+logger = logging.getLogger("global_monitoring")
+
+SEVERITY = {"info": 0, "warning": 1, "critical": 2}
+
+ALERT_DELIVERY = getattr(config, "ALERT_DELIVERY", {})
+
+def routes() -> list[dict]:
+    return getattr(config, "ALERT_ROUTES", None) or [{"name": "owner", "chat_id": TG_ID}]
+
+# Пользователи, которым разрешено управлять ботом: владелец и users из маршрутов
+def authorized_users() -> set[int]:
+    users = {TG_ID}
+    for route in routes():
+        users.update(route.get("users") or [])
+    return users
+
+def _in_window(window: dict, now: datetime.datetime) -> bool:
+    tz = ZoneInfo(window["tz"]) if window.get("tz") else None
+    local = now.astimezone(tz).time() if tz else now.astimezone().time()
+    start = datetime.time.fromisoformat(window["from"])
+    end = datetime.time.fromisoformat(window["to"])
+    if start <= end:
+        return start <= local < end
+    # окно через полночь
+    return local >= start or local < end
+
+def _muted(route: dict, level: int, now: datetime.datetime) -> bool:
+    for window in route.get("mute") or []:
+        if _in_window(window, now) and level < SEVERITY.get(window.get("min_severity"), 99):
+            return True
+    return False
+
+# Получатели уведомления: [(chat_id, thread_id)] без повторов
+def recipients(category: str, server_id: str | None = None, severity: str = "warning") -> list[tuple[int, int | None]]:
+    level = SEVERITY.get(severity, 1)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    found = []
+    for route in routes():
+        categories = route.get("categories")
+        if categories and category not in categories:
+            continue
+        servers = route.get("servers")
+        if servers and server_id not in (None, "ALL") and server_id not in servers:
+            continue
+        if level < SEVERITY.get(route.get("min_severity", "info"), 0):
+            continue
+        if _muted(route, level, now):
+            continue
+        target = (route["chat_id"], route.get("thread_id"))
+        if target not in found:
+            found.append(target)
+    return found
+
+async def _send(bot: Bot, sem: asyncio.Semaphore, chat_id: int, thread_id: int | None, text: str, parse_mode: str):
+    async with sem:
+        for attempt in range(2):
+            try:
+                return await bot.send_message(
+                    chat_id=chat_id,
+                    message_thread_id=thread_id,
+                    text=text,
+                    parse_mode=parse_mode,
+                )
+            except TelegramRetryAfter as e:
+                if attempt:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+# Рассылка уведомления. Возвращает [(chat_id, message_id)] успешно отправленных сообщений
+async def deliver(bot: Bot, text: str, category: str, server_id: str | None = None,
+                  severity: str = "warning", parse_mode: str = "MarkdownV2") -> list[tuple[int, int]]:
+    targets = recipients(category, server_id, severity)
+    if not targets:
+        logger.info(f"alerts: {category}/{server_id}/{severity} — получателей нет (маршруты или окна тишины)")
+        return []
+
+    sem = asyncio.Semaphore(max(1, int(ALERT_DELIVERY.get("concurrency", 8))))
+    results = await asyncio.gather(
+        *(_send(bot, sem, chat_id, thread_id, text, parse_mode) for chat_id, thread_id in targets),
+        return_exceptions=True,
+    )
+    sent = []
+    for (chat_id, _), result in zip(targets, results):
+        if isinstance(result, BaseException):
+            logger.error(f"alerts: send to {chat_id} failed -> {result}")
+        else:
+            sent.append((result.chat.id, result.message_id))
+    return sent
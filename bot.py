@@ -6,126 +6,52 @@
   - Ведёт собственный лог (bot.log) и access-лог (access.log).
 """
 
-import os
 import time
+_IMPORT_STARTED = time.perf_counter()
+
 import asyncio
 import logging
-from typing import Union
-from logging.handlers import TimedRotatingFileHandler
 from aiogram import Bot, Dispatcher
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineQuery
 from aiogram.filters import Command
 from aiogram.client.default import DefaultBotProperties
 from contextlib import suppress
+import config
+import agent_api
+import access
 from config import BOT_TOKEN, SERVERS, TG_ID
-from monitoring import monitor, monitor_sites, set_bot
-from handlers import handle_command_servers, handle_callback_server
+from monitoring import start_all_monitors, start_sites_monitor, start_digest_monitor, stop_all_monitors, set_bot
+from config_reload import reload_config, watch_config
+import dashboard
+import webhook
+import sharding
+import ha
+from handlers import handle_command_servers, handle_callback_server, handle_package_command, handle_inline_query
 from logs_report import handle_logs_command
+from utils import setup_file_logger, setup_server_logger, escape_markdown
 
 BOT_VERSION = "2.2.0"
 start_time = time.time()
 
+# Окно (сек.), по которому разносятся первые опросы серверов при старте
+STARTUP = getattr(config, "STARTUP", {})
+WARMUP_SPREAD = float(STARTUP.get("warmup_spread", 30))
+
+# Профиль старта: секунды от начала импорта bot.py
+STARTUP_PROFILE: dict[str, float | None] = {
+    "import": time.perf_counter() - _IMPORT_STARTED,
+    "polling_ready": None,
+}
+
 # ===== 🔧 Логирование =====
-# Создание папок для логов
-os.makedirs("logs/bot", exist_ok=True)
-os.makedirs("logs/monitoring", exist_ok=True)
-
-log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-
-# Общий консольный вывод
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_formatter)
-
-# --- Логгер бота ---
-bot_logger = logging.getLogger("bot")
-bot_logger.setLevel(logging.INFO)
-bot_logger.propagate = False
-_bot_path = os.path.abspath("logs/bot/bot.log")
-if not any(getattr(h, "baseFilename", None) == _bot_path for h in bot_logger.handlers):
-    bot_file_handler = TimedRotatingFileHandler(
-        filename=_bot_path,
-        when="midnight",
-        interval=1,
-        backupCount=7,
-        encoding="utf-8",
-    )
-    bot_file_handler.setFormatter(log_formatter)
-    bot_logger.addHandler(bot_file_handler)
-if console_handler not in bot_logger.handlers:
-    bot_logger.addHandler(console_handler)
-
-# --- Логгер доступа ---
-access_logger = logging.getLogger("access")
-access_logger.setLevel(logging.WARNING)
-access_logger.propagate = False
-_access_path = os.path.abspath("logs/bot/access.log")
-if not any(getattr(h, "baseFilename", None) == _access_path for h in access_logger.handlers):
-    access_file_handler = TimedRotatingFileHandler(
-        filename=_access_path,
-        when="midnight",
-        interval=1,
-        backupCount=7,
-        encoding="utf-8",
-    )
-    access_file_handler.setFormatter(log_formatter)
-    access_logger.addHandler(access_file_handler)
-if console_handler not in access_logger.handlers:
-    access_logger.addHandler(console_handler)
-
-# --- Логгер глобального мониторинга ---
-global_logger = logging.getLogger("global_monitoring")
-global_logger.setLevel(logging.INFO)
-global_logger.propagate = False
-_global_path = os.path.abspath("logs/monitoring/global_monitoring.log")
-if not any(getattr(h, "baseFilename", None) == _global_path for h in global_logger.handlers):
-    global_file_handler = TimedRotatingFileHandler(
-        filename=_global_path,
-        when="midnight",
-        interval=1,
-        backupCount=7,
-        encoding="utf-8",
-    )
-    global_file_handler.setFormatter(log_formatter)
-    global_logger.addHandler(global_file_handler)
-if console_handler not in global_logger.handlers:
-    global_logger.addHandler(console_handler)
-
-# --- Логгер сайтов ---
-sites_logger = logging.getLogger("sites_monitoring")
-sites_logger.setLevel(logging.INFO)
-sites_logger.propagate = False
-_sites_path = os.path.abspath("logs/monitoring/sites_monitoring.log")
-if not any(getattr(h, "baseFilename", None) == _sites_path for h in sites_logger.handlers):
-    sites_file_handler = TimedRotatingFileHandler(
-        filename=_sites_path,
-        when="midnight",
-        interval=1,
-        backupCount=7,
-        encoding="utf-8",
-    )
-    sites_file_handler.setFormatter(log_formatter)
-    sites_logger.addHandler(sites_file_handler)
-if console_handler not in sites_logger.handlers:
-    sites_logger.addHandler(console_handler)
+bot_logger = setup_file_logger("bot", "logs/bot/bot.log")
+access_logger = setup_file_logger("access", "logs/bot/access.log", logging.WARNING)
+global_logger = setup_file_logger("global_monitoring", "logs/monitoring/global_monitoring.log")
+sites_logger = setup_file_logger("sites_monitoring", "logs/monitoring/sites_monitoring.log")
 
 # --- Логгеры серверов из конфига ---
-for sid, cfg in SERVERS.items():
-    srv_logger = logging.getLogger(sid)
-    srv_logger.setLevel(logging.INFO)
-    srv_logger.propagate = False
-    _srv_path = os.path.abspath(f"logs/monitoring/{sid}.log")
-    if not any(getattr(h, "baseFilename", None) == _srv_path for h in srv_logger.handlers):
-        srv_file_handler = TimedRotatingFileHandler(
-            filename=_srv_path,
-            when="midnight",
-            interval=1,
-            backupCount=7,
-            encoding="utf-8",
-        )
-        srv_file_handler.setFormatter(log_formatter)
-        srv_logger.addHandler(srv_file_handler)
-    if console_handler not in srv_logger.handlers:
-        srv_logger.addHandler(console_handler)
+for sid in SERVERS:
+    setup_server_logger(sid)
 
 # ===== 🛠️ Функции и хэндлеры =====
 # Форматирование времени работы бота
@@ -137,31 +63,7 @@ def format_uptime(seconds: int) -> str:
     return f"{months}м. {days}д. {hours:02}:{minutes:02}:{seconds:02}"
 
 # --- Проверка доступа ---
-async def deny_if_unauthorized(obj: Union[Message, CallbackQuery]) -> bool:
-    user = obj.from_user
-    uid = getattr(user, "id", None)
-    if uid == TG_ID:
-        return False
-
-    uname = f"@{getattr(user, 'username', '')}" if getattr(user, "username", None) else "-"
-    fname = getattr(user, "first_name", "-")
-
-    # --- что именно сделал пользователь ---
-    if isinstance(obj, Message):
-        action = obj.text or "<non-text message>"
-    else:  # CallbackQuery
-        action = obj.data or "<no callback data>"
-
-    access_logger.warning("DENY: uid=%s user=%s %s action=%r", uid, uname, fname, action)
-
-    try:
-        if isinstance(obj, Message):
-            await obj.answer("⛔ ДОСТУП ЗАБЛОКИРОВАН ⛔")
-        else:
-            await obj.answer("⛔ ДОСТУП ЗАБЛОКИРОВАН ⛔", show_alert=True)
-    except Exception as e:
-        access_logger.error("deny_if_unauthorized: notify failed: %s", e)
-    return True
+deny_if_unauthorized = access.deny_if_unauthorized
 
 # Хэндлер команд
 async def handle_version(message: Message):
@@ -174,16 +76,60 @@ async def handle_version(message: Message):
     uptime = format_uptime(time.time() - start_time)
     safe_version = BOT_VERSION.replace('.', '\\.')
     safe_uptime = uptime.replace('.', '\\.')
+
+    def fmt(value):
+        return "—" if value is None else f"{value:.2f} s"
+
+    first_poll = None
+    if agent_api.FIRST_RESPONSE_AT is not None:
+        first_poll = agent_api.FIRST_RESPONSE_AT - _IMPORT_STARTED
+    profile = (
+        f"import {fmt(STARTUP_PROFILE['import'])}, "
+        f"first poll {fmt(first_poll)}, "
+        f"polling ready {fmt(STARTUP_PROFILE['polling_ready'])}"
+    )
     await message.answer(
         f"🤖 Bot version: {safe_version}\n"
-        f"⏳ Uptime: {safe_uptime}"
+        f"⏳ Uptime: {safe_uptime}\n"
+        f"🚀 Startup: {escape_markdown(profile)}"
     )
 
+async def handle_reload(message: Message):
+    if await deny_if_unauthorized(message):
+        return
+    try:
+        await message.delete()
+    except Exception:
+        pass
+    ok, text = await reload_config()
+    await message.answer(escape_markdown(text))
+
+async def handle_dashboard(message: Message):
+    if await deny_if_unauthorized(message):
+        return
+    try:
+        await message.delete()
+    except Exception:
+        pass
+    try:
+        enabled = await dashboard.toggle(message.chat.id)
+    except Exception as e:
+        bot_logger.error(f"handle_dashboard failed -> {e}")
+        await message.answer(escape_markdown(f"❌ Не удалось переключить дашборд: {e}"))
+        return
+    if not enabled:
+        await message.answer("📌 Дашборд отключён")
+
 async def handle_servers(message: Message):
     if await deny_if_unauthorized(message):
         return
     await handle_command_servers(message)
 
+async def handle_package(message: Message):
+    if await deny_if_unauthorized(message):
+        return
+    await handle_package_command(message)
+
 async def handle_logs(message: Message):
     if await deny_if_unauthorized(message):
         return
@@ -195,7 +141,15 @@ async def handle_callback(callback: CallbackQuery):
         return
     await handle_callback_server(callback)
 
-async def main():
+# Хэндлер inline-поиска (@bot srv-na…)
+async def handle_inline(query: InlineQuery):
+    if await deny_if_unauthorized(query):
+        return
+    await handle_inline_query(query)
+
+# Возвращает True, если лидер HA потерял аренду (процесс завершится с кодом 1)
+async def main() -> bool:
+    lost_lease = False
     bot_logger.info(f"Bot R145j7 v{BOT_VERSION} is starting...")
 
     async with Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode="MarkdownV2")) as bot:
@@ -206,26 +160,76 @@ async def main():
         dp.message.register(handle_version, Command("version"))
         dp.message.register(handle_servers, Command("server"))
         dp.message.register(handle_logs, Command("logs"))
+        dp.message.register(handle_reload, Command("reload"))
+        dp.message.register(handle_package, Command("package"))
+        dp.message.register(handle_dashboard, Command("dashboard"))
         dp.callback_query.register(handle_callback)
+        dp.inline_query.register(handle_inline)
+
+        async def on_startup():
+            STARTUP_PROFILE["polling_ready"] = time.perf_counter() - _IMPORT_STARTED
+            mode = "webhook" if webhook.enabled() else "polling"
+            bot_logger.info(f"Bot {mode} ready in {STARTUP_PROFILE['polling_ready']:.2f}s")
 
-        # Фоновые задачи
-        tasks = [asyncio.create_task(monitor(sid), name=f"monitor:{SERVERS[sid]['name']}") for sid in SERVERS.keys()]
+        dp.startup.register(on_startup)
+
+        # В режиме HA standby ждёт здесь, подтягивая снимки состояния лидера
+        if ha.enabled():
+            await ha.wait_for_leadership()
+
+        # Фоновые задачи (первые опросы разнесены по окну WARMUP_SPREAD)
+        if sharding.enabled():
+            sharding.start(bot, WARMUP_SPREAD)
+            bot_logger.info(f"Monitoring sharded across {len(sharding.WORKERS)} worker processes")
+        else:
+            start_all_monitors(WARMUP_SPREAD)
         bot_logger.info(f"Monitoring started for servers: {', '.join([cfg['name'] for cfg in SERVERS.values()])}")
-        tasks.append(asyncio.create_task(monitor_sites(), name="monitor:sites"))
+        start_sites_monitor()
         bot_logger.info("Monitoring of sites started")
+        if start_digest_monitor() is not None:
+            bot_logger.info("Updates digest scheduled")
+
+        async def notify_reload(text: str):
+            await bot.send_message(chat_id=TG_ID, text=escape_markdown(text))
+
+        tasks = [
+            asyncio.create_task(watch_config(notify_reload), name="config:watch"),
+            asyncio.create_task(dashboard.dashboard_loop(), name="dashboard"),
+            asyncio.create_task(access.summary_loop(), name="access:summary"),
+        ]
 
         try:
-            bot_logger.info("Bot polling started")
-            await dp.start_polling(bot)
+            if webhook.enabled():
+                serving = webhook.run_webhook(dp, bot)
+            else:
+                # webhook, оставшийся от прошлого запуска, мешает getUpdates
+                with suppress(Exception):
+                    await bot.delete_webhook(drop_pending_updates=False)
+                bot_logger.info("Bot polling started")
+                serving = dp.start_polling(bot)
+            if ha.enabled():
+                # потеря аренды останавливает приём апдейтов и мониторинг
+                lost_lease = await ha.serve_while_leader(serving)
+            else:
+                await serving
         finally:
             # Корректное завершение фоновых задач
             for t in tasks:
                 t.cancel()
             with suppress(Exception):
                 await asyncio.gather(*tasks, return_exceptions=True)
+                await stop_all_monitors()
+                await sharding.stop()
+            if ha.enabled():
+                await ha.step_down()
 
             bot_logger.info("Bot stopped.")
+    return lost_lease
 
 if __name__ == "__main__":
+    lost_lease = False
     with suppress(KeyboardInterrupt, SystemExit):
-        asyncio.run(main())
\ No newline at end of file
+        lost_lease = asyncio.run(main())
+    # ненулевой код — супервизор перезапустит процесс, и он вернётся в standby
+    if lost_lease:
+        raise SystemExit(1)
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+• Роутер callback-кнопок
+  - Каждая категория/действие регистрируется один раз: register(action, kind, handler).
+  - callback_data — компактный версионированный id "v|gen|action|idx[|arg]": idx — индекс
+    сервера, бота, сайта или категории в реестре текущего поколения ("*" — все), arg —
+    короткий параметр (например, номер страницы). Длина не зависит от имён и укладывается
+    в лимит Telegram в 64 байта.
+  - Поколение реестра — хеш списков серверов/ботов/сайтов/категорий: оно одинаково после рестарта
+    с тем же конфигом и меняется при любом изменении списков (в том числе между рестартами);
+    кнопки старых меню распознаются как устаревшие.
+  - Кнопки прежнего формата "action:target" из уже отправленных сообщений продолжают работать.
+  - Диспетчеризация — поиск по словарю, без цепочки if/elif.
+"""
+
+import json
+import hashlib
+import logging
+from aiogram.types import CallbackQuery
+from config import SERVERS, CATEGORIES, SITES_MONITOR
+from monitoring import BOTS_REGISTRY
+
+logger = logging.getLogger("bot")
+
+CALLBACK_VERSION = "1"
+MAX_CALLBACK_BYTES = 64
+ALL = "ALL"
+
+# action → (вид цели: server | bot | site | category, handler(callback, target, arg), удалять ли сообщение с кнопкой)
+ROUTES: dict[str, tuple[str, object, bool]] = {}
+
+# Реестр целей текущего поколения: вид → список ключей и обратный индекс
+_TARGETS: dict[str, list[str]] = {"server": [], "bot": [], "site": [], "category": []}
+_INDEX: dict[str, dict[str, int]] = {"server": {}, "bot": {}, "site": {}, "category": {}}
+_GENERATION = ""
+
+class StaleCallback(Exception):
+    pass
+
+# Поколение — первые 6 hex-символов blake2b от списков целей
+def _generation_of(targets: dict[str, list[str]]) -> str:
+    raw = json.dumps(targets, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=3).hexdigest()
+
+# Пересборка реестра целей; поколение меняется, только если изменились списки
+def refresh():
+    global _GENERATION
+    targets = {
+        "server": list(SERVERS),
+        "bot": list(BOTS_REGISTRY["order"]),
+        "site": list(SITES_MONITOR.get("urls", [])),
+        "category": list(CATEGORIES),
+    }
+    _GENERATION = _generation_of(targets)
+    for kind, keys in targets.items():
+        _TARGETS[kind] = keys
+        _INDEX[kind] = {key: i for i, key in enumerate(keys)}
+
+refresh()
+
+def generation() -> str:
+    return _GENERATION
+
+def targets(kind: str) -> list[str]:
+    return _TARGETS[kind]
+
+def index_of(kind: str, target: str) -> int:
+    return _INDEX[kind][target]
+
+# delete=False — сообщение с кнопкой не удаляется (навигация по страницам, правка на месте)
+def register(action: str, kind: str, handler, delete: bool = True):
+    if kind not in _TARGETS:
+        raise ValueError(f"unknown callback target kind: {kind}")
+    if "|" in action or ":" in action:
+        raise ValueError(f"bad callback action name: {action!r}")
+    ROUTES[action] = (kind, handler, delete)
+
+def encode(action: str, target: str = ALL, arg: str | int | None = None) -> str:
+    kind = ROUTES[action][0]
+    idx = "*" if target == ALL else str(_INDEX[kind][target])
+    data = f"{CALLBACK_VERSION}|{_GENERATION}|{action}|{idx}"
+    if arg is not None:
+        data += f"|{arg}"
+    if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data too long: {data!r}")
+    return data
+
+# Разбор callback_data → (action, target, arg)
+def decode(data: str) -> tuple[str, str, str | None]:
+    if "|" not in data:
+        # прежний формат "action:target"
+        action, target = data.split(":", 1)
+        return action, target, None
+
+    version, gen, action, idx, *rest = data.split("|")
+    if version != CALLBACK_VERSION or gen != _GENERATION:
+        raise StaleCallback(data)
+    arg = rest[0] if rest else None
+    kind = ROUTES[action][0]
+    if idx == "*":
+        return action, ALL, arg
+    return action, _TARGETS[kind][int(idx)], arg
+
+async def dispatch(callback: CallbackQuery):
+    data = callback.data
+    if not data:
+        logger.warning("callbacks.dispatch: empty callback.data")
+        return
+    try:
+        action, target, arg = decode(data)
+        _, handler, delete = ROUTES[action]
+    except StaleCallback:
+        try:
+            await callback.answer("Меню устарело, откройте его заново", show_alert=True)
+        except Exception as e:
+            logger.warning(f"callbacks.dispatch: answer failed -> {e}")
+        return
+    except (ValueError, KeyError, IndexError) as e:
+        logger.warning(f"callbacks.dispatch: bad callback data {data!r} -> {e}")
+        return
+
+    # у сообщений из inline-режима callback.message нет
+    if delete and callback.message is not None:
+        try:
+            await callback.message.delete()
+        except Exception as e:
+            logger.warning(f"callbacks.dispatch: delete failed -> {e}")
+
+    try:
+        await handler(callback, target, arg)
+    except Exception as e:
+        logger.error(f"callback {action} failed -> {e}")
@@ -0,0 +1,267 @@
+"""
+• Горячая перезагрузка конфига без рестарта бота
+  - Команда /reload и фоновый наблюдатель за изменением config.py.
+  - Новый конфиг читается в отдельный модуль и проверяется, текущий при ошибке не трогается.
+  - Считается diff: добавленные, удалённые и изменённые сервера, сайты, боты, майнеры.
+  - Запускаются/останавливаются/перезапускаются только затронутые задачи мониторинга,
+    состояние (CPU_STATE, BOTS_STATE, ...) для неизменённых записей сохраняется,
+    для новых — создаётся лениво при первом обращении.
+  - SERVERS, SITES_MONITOR, BOTS_MONITOR, MINERS и др. обновляются на месте (те же объекты),
+    поэтому все модули, сделавшие `from config import ...`, сразу видят новые значения.
+  - BOT_TOKEN и TG_ID перезагрузкой не меняются — для них нужен рестарт.
+"""
+
+import os
+import asyncio
+import logging
+import importlib.util
+import config
+from config import SERVERS, SITES_MONITOR, BOTS_MONITOR
+import monitoring
+import callbacks
+import access
+import sharding
+from utils import setup_server_logger
+from scheduler import CronSchedule
+
+logger = logging.getLogger("bot")
+
+# Объекты конфига, которые обновляются на месте
+RELOADABLE = ("SERVERS", "SITES_MONITOR", "BOTS_MONITOR", "MINERS", "CATEGORIES", "LOG_DIRS", "CORRELATION", "ALERT_ROUTES", "ACCESS")
+# Значения, изменение которых требует рестарта
+RESTART_ONLY = ("BOT_TOKEN", "TG_ID")
+
+CONFIG_RELOAD = getattr(config, "CONFIG_RELOAD", {})
+
+_reload_lock = asyncio.Lock()
+
+# Чтение config.py в отдельный модуль, не затрагивая текущий
+def load_candidate():
+    spec = importlib.util.spec_from_file_location("config_candidate", config.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Проверка нового конфига. Возвращает список ошибок (пустой — всё в порядке)
+def validate(candidate) -> list[str]:
+    errors = []
+
+    servers = getattr(candidate, "SERVERS", None)
+    if not isinstance(servers, dict) or not servers:
+        return ["SERVERS: должен быть непустым dict"]
+
+    for sid, cfg in servers.items():
+        if not isinstance(cfg, dict):
+            errors.append(f"SERVERS[{sid}]: должен быть dict")
+            continue
+        for key in ("name", "ip", "monitoring_port", "token"):
+            if key not in cfg:
+                errors.append(f"SERVERS[{sid}]: нет ключа {key}")
+        cpu_ram = cfg.get("cpu_ram") or {}
+        for key in ("cpu_high", "cpu_low", "ram_high", "ram_low"):
+            if not isinstance(cpu_ram.get(key), (int, float)):
+                errors.append(f"SERVERS[{sid}].cpu_ram: нет числового {key}")
+        if cpu_ram.get("cpu_low", 0) > cpu_ram.get("cpu_high", 0) or cpu_ram.get("ram_low", 0) > cpu_ram.get("ram_high", 0):
+            errors.append(f"SERVERS[{sid}].cpu_ram: нижний порог выше верхнего")
+        if (cpu_ram.get("window") or {}).get("mode", "n_of_m") not in ("n_of_m", "ewma", "percentile"):
+            errors.append(f"SERVERS[{sid}].cpu_ram.window: mode должен быть n_of_m, ewma или percentile")
+        intervals = cpu_ram.get("interval") or {}
+        for key in ("normal", "warning", "critical"):
+            if not isinstance(intervals.get(key), (int, float)) or intervals.get(key) <= 0:
+                errors.append(f"SERVERS[{sid}].cpu_ram.interval: нет положительного {key}")
+        disk = cfg.get("disk") or {}
+        for key in ("threshold", "interval", "total_gb"):
+            if not isinstance(disk.get(key), (int, float)):
+                errors.append(f"SERVERS[{sid}].disk: нет числового {key}")
+        for section in ("processes", "updates"):
+            if not isinstance((cfg.get(section) or {}).get("interval"), (int, float)):
+                errors.append(f"SERVERS[{sid}].{section}: нет числового interval")
+        backups = cfg.get("backups") or {}
+        try:
+            if backups.get("cron"):
+                CronSchedule(backups["cron"], backups.get("tz"))
+            else:
+                CronSchedule.daily(str(backups.get("time", "")), backups.get("tz"))
+        except Exception as e:
+            errors.append(f"SERVERS[{sid}].backups: ожидается cron или time HH:MM и корректная tz ({e})")
+
+    bots_monitor = getattr(candidate, "BOTS_MONITOR", None)
+    if not isinstance(bots_monitor, dict) or not isinstance(bots_monitor.get("bots"), dict):
+        errors.append("BOTS_MONITOR: нужен dict с ключом bots")
+    else:
+        if not isinstance(bots_monitor.get("interval"), (int, float)):
+            errors.append("BOTS_MONITOR: нет числового interval")
+        seen = {}
+        for sid, bots in bots_monitor["bots"].items():
+            if sid not in servers:
+                errors.append(f"BOTS_MONITOR.bots: неизвестный сервер {sid}")
+            for bot_name in (bots or {}):
+                if bot_name in seen:
+                    errors.append(f"BOTS_MONITOR.bots: бот {bot_name} указан на {seen[bot_name]} и {sid}")
+                seen[bot_name] = sid
+
+    sites = getattr(candidate, "SITES_MONITOR", None)
+    if not isinstance(sites, dict) or not isinstance(sites.get("urls", []), list):
+        errors.append('SITES_MONITOR: нужен dict со списком "urls"')
+
+    miners = getattr(candidate, "MINERS", None)
+    if not isinstance(miners, (list, tuple)) or not all(isinstance(m, str) for m in miners):
+        errors.append("MINERS: должен быть списком строк")
+    else:
+        for rule in miners:
+            if rule.strip().lower().startswith("re:"):
+                reason = monitoring.MinerMatcher._unsafe(rule.strip()[3:])
+                if reason:
+                    errors.append(f"MINERS: {rule!r} — {reason}")
+
+    return errors
+
+# Разница между текущим и новым конфигом
+def compute_diff(candidate) -> dict:
+    new_servers = candidate.SERVERS
+    new_bots = candidate.BOTS_MONITOR.get("bots", {})
+    old_bots = BOTS_MONITOR.get("bots", {})
+    bots_interval_changed = candidate.BOTS_MONITOR.get("interval") != BOTS_MONITOR.get("interval")
+
+    added = [sid for sid in new_servers if sid not in SERVERS]
+    removed = [sid for sid in SERVERS if sid not in new_servers]
+    changed = []
+    for sid in new_servers:
+        if sid not in SERVERS:
+            continue
+        bots_changed = (old_bots.get(sid) or {}) != (new_bots.get(sid) or {})
+        if bots_interval_changed and (new_bots.get(sid) or old_bots.get(sid)):
+            bots_changed = True
+        if SERVERS[sid] != new_servers[sid] or bots_changed:
+            changed.append(sid)
+
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "sites_changed": candidate.SITES_MONITOR != SITES_MONITOR,
+        "miners_changed": list(candidate.MINERS) != list(getattr(config, "MINERS", [])),
+        "restart_required": [
+            name for name in RESTART_ONLY
+            if getattr(candidate, name, None) != getattr(config, name, None)
+        ],
+    }
+
+# Обновление объекта конфига на месте (чтобы импортированные ссылки остались валидными)
+def _update_in_place(name, new_value):
+    old_value = getattr(config, name, None)
+    if isinstance(old_value, dict) and isinstance(new_value, dict):
+        old_value.clear()
+        old_value.update(new_value)
+    elif isinstance(old_value, list) and isinstance(new_value, (list, tuple)):
+        old_value[:] = list(new_value)
+    else:
+        setattr(config, name, new_value)
+
+# Применение diff: остановка затронутых задач, обновление конфига и состояния, запуск задач
+async def apply(candidate, diff: dict):
+    for sid in diff["removed"] + diff["changed"]:
+        await monitoring.stop_monitor(sid)
+    if diff["sites_changed"]:
+        await monitoring.stop_monitor(monitoring.SITES_TASK_KEY)
+
+    for name in RELOADABLE:
+        if hasattr(candidate, name):
+            _update_in_place(name, getattr(candidate, name))
+
+    for sid in diff["removed"]:
+        monitoring.state__drop_server(sid)
+    for sid in diff["added"]:
+        setup_server_logger(sid)
+    if diff["miners_changed"]:
+        monitoring.miners__invalidate()
+    monitoring.bots__sync_state()
+    callbacks.refresh()
+    access.refresh()
+
+    urls = set(SITES_MONITOR.get("urls", []))
+    for url in list(monitoring.SITES_STATE.keys()):
+        if url not in urls:
+            del monitoring.SITES_STATE[url]
+            monitoring.SITES_FLAPS.forget(url)
+            monitoring.SITES_INCIDENTS.forget(url)
+
+    if sharding.running():
+        # воркеры заново читают config.py и получают последний снимок состояния
+        await sharding.restart()
+    else:
+        for sid in diff["added"] + diff["changed"]:
+            monitoring.start_server_monitor(sid)
+    if diff["sites_changed"]:
+        monitoring.start_sites_monitor()
+
+# Краткое текстовое описание diff
+def describe(diff: dict) -> str:
+    lines = []
+    if diff["added"]:
+        lines.append("➕ Добавлены: " + ", ".join(SERVERS[sid]["name"] for sid in diff["added"]))
+    if diff["removed"]:
+        lines.append("➖ Удалены: " + ", ".join(diff["removed"]))
+    if diff["changed"]:
+        lines.append("🔁 Перезапущены: " + ", ".join(SERVERS[sid]["name"] for sid in diff["changed"]))
+    if diff["sites_changed"]:
+        lines.append("🌐 Мониторинг сайтов перезапущен")
+    if diff["miners_changed"]:
+        lines.append("⛏️ Список майнеров обновлён")
+    if diff["restart_required"]:
+        lines.append("⚠️ Требуется рестарт для: " + ", ".join(diff["restart_required"]))
+    return "\n".join(lines) if lines else "Изменений нет"
+
+# Полный цикл перезагрузки. Возвращает (успех, текст для пользователя)
+async def reload_config() -> tuple[bool, str]:
+    async with _reload_lock:
+        try:
+            candidate = load_candidate()
+        except Exception as e:
+            logger.error(f"config reload: не удалось прочитать config.py -> {e}")
+            return False, f"❌ Ошибка чтения конфига: {e}"
+
+        errors = validate(candidate)
+        if errors:
+            logger.error("config reload: конфиг не прошёл проверку: " + "; ".join(errors))
+            return False, "❌ Конфиг не применён:\n" + "\n".join(f"• {err}" for err in errors)
+
+        diff = compute_diff(candidate)
+        try:
+            await apply(candidate, diff)
+        except Exception as e:
+            logger.error(f"config reload: ошибка применения -> {e}")
+            return False, f"❌ Ошибка применения конфига: {e}"
+
+        summary = describe(diff)
+        logger.info("config reload: " + summary.replace("\n", "; "))
+        return True, "✅ Конфиг перезагружен\n" + summary
+
+# Наблюдатель за config.py: перезагрузка при изменении времени модификации
+async def watch_config(notify=None):
+    if not CONFIG_RELOAD.get("watch", True):
+        return
+    interval = max(1.0, float(CONFIG_RELOAD.get("watch_interval", 5)))
+    path = config.__file__
+    try:
+        last_mtime = os.stat(path).st_mtime
+    except OSError as e:
+        logger.error(f"config watcher: нет доступа к {path} -> {e}")
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            logger.warning(f"config watcher: stat failed -> {e}")
+            continue
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        ok, text = await reload_config()
+        if notify is not None:
+            try:
+                await notify(text)
+            except Exception as e:
+                logger.warning(f"config watcher: notify failed -> {e}")
@@ -0,0 +1,214 @@
+"""
+• Закреплённый дашборд парка серверов
+  - Включается/выключается командой /dashboard отдельно для каждого чата.
+  - Одно закреплённое сообщение, которое бот редактирует на месте: строка на сервер
+    (CPU/RAM, диск, процессы, обновления, бэкапы, боты) и сводка по сайтам.
+  - Строится только из текущего состояния мониторинга, без запросов к агентам.
+  - Редактирование не чаще DASHBOARD["interval"] секунд; если текст не изменился (по хэшу),
+    редактирование пропускается.
+  - Список чатов и id сообщений хранится в data/dashboard.json и переживает рестарт.
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import datetime
+import config
+from config import SERVERS
+import monitoring
+import render
+from utils import escape_markdown, escape_cached
+
+logger = logging.getLogger("bot")
+
+DASHBOARD = getattr(config, "DASHBOARD", {})
+DASHBOARD_FILE = "data/dashboard.json"
+# Нижняя граница частоты редактирования, сек.
+MIN_INTERVAL = 10.0
+
+# chat_id → {"message_id": int, "hash": str | None}
+DASHBOARDS: dict[int, dict] = {}
+
+def _load():
+    try:
+        with open(DASHBOARD_FILE, "r", encoding="utf-8") as fh:
+            saved = json.load(fh)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"dashboard: не удалось прочитать {DASHBOARD_FILE} -> {e}")
+        return
+    for chat_id, message_id in saved.items():
+        DASHBOARDS[int(chat_id)] = {"message_id": int(message_id), "hash": None}
+
+def _save():
+    try:
+        os.makedirs(os.path.dirname(DASHBOARD_FILE), exist_ok=True)
+        with open(DASHBOARD_FILE, "w", encoding="utf-8") as fh:
+            json.dump({str(c): d["message_id"] for c, d in DASHBOARDS.items()}, fh)
+    except Exception as e:
+        logger.error(f"dashboard: не удалось сохранить {DASHBOARD_FILE} -> {e}")
+
+# ===== Рендер =====
+def _server_line(sid: str) -> str:
+    name = render.server_name(sid)
+    level = 0  # 0 — норма, 1 — предупреждение, 2 — авария
+    cells = []
+
+    if monitoring.AGENTS_STATE.get(sid, {}).get("down"):
+        return f"🔴 *{name}* — агент не отвечает"
+
+    cpu = monitoring.CPU_STATE.get(sid, {})
+    agg = cpu.get("agg")
+    if agg:
+        cells.append(escape_markdown(f"CPU {agg[0]:.0f}% RAM {agg[1]:.0f}%"))
+    else:
+        cells.append("CPU —")
+    if cpu.get("status") == "ALARM":
+        level = 2
+    elif cpu.get("status") == "WARNING":
+        level = max(level, 1)
+
+    disk = monitoring.DISK_STATE.get(sid, {})
+    usages = [m["history"][-1][1] for m in disk.get("mounts", {}).values() if m["history"]]
+    cells.append(escape_markdown(f"💾 {max(usages):.0f}%") if usages else "💾 —")
+    if disk.get("alert"):
+        level = 2
+
+    procs = monitoring.PROCESSES_STATE.get(sid)
+    if procs is None:
+        cells.append("⚙️ —")
+    elif procs["failed"] or procs["miners"]:
+        level = 2
+        cell = f"⚙️ ❌{len(procs['failed'])}"
+        if procs["miners"]:
+            cell += f" ⛏️{len(procs['miners'])}"
+        cells.append(cell)
+    else:
+        cells.append("⚙️ ✅")
+
+    updates = monitoring.UPDATES_STATE.get(sid)
+    cells.append(f"📦 {len(updates['packages'])}" if updates is not None else "📦 —")
+
+    history = monitoring.BACKUPS_HISTORY.get(sid)
+    anomalies = monitoring.BACKUPS_STATE.get(sid, {}).get("anomalies")
+    if not history:
+        cells.append("🗄 —")
+    elif not history[-1].get("ok"):
+        level = max(level, 1)
+        cells.append("🗄 ❌")
+    elif anomalies:
+        level = max(level, 1)
+        cells.append("🗄 ⚠️")
+    else:
+        cells.append("🗄 ✅")
+
+    bot_names = monitoring.BOTS_REGISTRY["server_to_bots"].get(sid, [])
+    if bot_names:
+        up = sum(1 for b in bot_names if monitoring.BOTS_STATE.get(b, {}).get("success"))
+        if up < len(bot_names):
+            level = max(level, 1)
+        cells.append(f"🤖 {up}/{len(bot_names)}")
+
+    icon = ("🟢", "🟡", "🔴")[level]
+    return f"{icon} *{name}* — " + " · ".join(cells)
+
+# Тело дашборда (без времени обновления — по нему считается хэш)
+def render_body() -> str:
+    lines = ["📊 *Дашборд*", ""]
+    lines.extend(_server_line(sid) for sid in SERVERS)
+
+    sites = monitoring.SITES_STATE
+    if sites:
+        up = sum(1 for ok in sites.values() if ok)
+        icon = "🟢" if up == len(sites) else "🔴"
+        lines.append("")
+        lines.append(f"{icon} 🌐 Сайты: {up}/{len(sites)}")
+        lines.extend(f"   ❌ {escape_cached(url)}" for url, ok in sites.items() if not ok)
+    return "\n".join(lines)
+
+def render_text() -> tuple[str, str]:
+    body = render_body()
+    digest = hashlib.sha1(body.encode("utf-8")).hexdigest()
+    stamp = datetime.datetime.now().strftime("%d.%m.%Y %H:%M:%S")
+    return digest, f"{body}\n\n🕒 Обновлено: `{escape_markdown(stamp)}`"
+
+# ===== Управление =====
+async def enable(chat_id: int) -> bool:
+    b = monitoring.bot
+    if b is None:
+        logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+        return False
+    digest, text = render_text()
+    sent = await b.send_message(chat_id=chat_id, text=text, parse_mode="MarkdownV2")
+    try:
+        await b.pin_chat_message(chat_id=chat_id, message_id=sent.message_id, disable_notification=True)
+    except Exception as e:
+        logger.warning(f"dashboard: pin failed in {chat_id} -> {e}")
+    DASHBOARDS[chat_id] = {"message_id": sent.message_id, "hash": digest}
+    _save()
+    return True
+
+async def disable(chat_id: int):
+    entry = DASHBOARDS.pop(chat_id, None)
+    _save()
+    b = monitoring.bot
+    if entry is None or b is None:
+        return
+    try:
+        await b.unpin_chat_message(chat_id=chat_id, message_id=entry["message_id"])
+        await b.delete_message(chat_id=chat_id, message_id=entry["message_id"])
+    except Exception as e:
+        logger.warning(f"dashboard: cleanup failed in {chat_id} -> {e}")
+
+# Переключение дашборда в чате. Возвращает True, если дашборд включён
+async def toggle(chat_id: int) -> bool:
+    if chat_id in DASHBOARDS:
+        await disable(chat_id)
+        return False
+    return await enable(chat_id)
+
+# Одно обновление всех дашбордов (пропускается, если текст не изменился)
+async def refresh():
+    if not DASHBOARDS:
+        return
+    b = monitoring.bot
+    if b is None:
+        return
+    digest, text = render_text()
+    for chat_id, entry in list(DASHBOARDS.items()):
+        if entry["hash"] == digest:
+            continue
+        try:
+            await b.edit_message_text(
+                chat_id=chat_id,
+                message_id=entry["message_id"],
+                text=text,
+                parse_mode="MarkdownV2",
+            )
+            entry["hash"] = digest
+        except Exception as e:
+            err = str(e).lower()
+            if "not modified" in err:
+                entry["hash"] = digest
+            elif "not found" in err or "chat not found" in err or "blocked" in err:
+                logger.warning(f"dashboard: сообщение в {chat_id} недоступно, дашборд отключён -> {e}")
+                DASHBOARDS.pop(chat_id, None)
+                _save()
+            else:
+                logger.warning(f"dashboard: edit failed in {chat_id} -> {e}")
+
+# Фоновое обновление с ограничением частоты
+async def dashboard_loop():
+    _load()
+    interval = max(MIN_INTERVAL, float(DASHBOARD.get("interval", 60)))
+    while True:
+        started = time.monotonic()
+        try:
+            await refresh()
+        except Exception as e:
+            logger.error(f"dashboard_loop failed -> {e}")
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
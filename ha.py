@@ -0,0 +1,255 @@
+"""
+• Режим active/standby (HA["enabled"])
+  - Два экземпляра бота делят SQLite-файл на общем хранилище (HA["db"]). Лидер держит
+    аренду — строку в таблице lease со сроком HA["ttl"] сек. — и продлевает её каждые
+    HA["heartbeat"] сек. Только лидер принимает апдейты (polling/webhook), запускает
+    мониторинг и шлёт уведомления.
+  - Standby раз в heartbeat пытается взять аренду и загружает последний снимок состояния,
+    который лидер сохраняет каждые HA["snapshot_interval"] сек.: после переключения известные
+    сбои не присылаются повторно, а расписания не догоняют уже выполненные запуски.
+  - Лидер, не сумевший продлить аренду до её истечения (в том числе если обращение к хранилищу
+    зависло — ожидание ограничено сроком аренды), сам прекращает работу раньше, чем
+    standby сможет её взять; процесс завершается с кодом 1 (перезапуск — задача супервизора,
+    например systemd Restart=on-failure) и после перезапуска становится standby.
+  - Снимок записывается только вместе с действующей арендой (holder и term в той же
+    транзакции): бывший лидер не перезапишет снимок нового.
+  - При штатной остановке лидер освобождает аренду — standby переключается сразу.
+  - Пример: HA = {"enabled": True, "db": "/mnt/shared/monitor-ha.sqlite", "node": "mon-a",
+    "ttl": 15, "heartbeat": 5, "snapshot_interval": 10}
+"""
+
+import os
+import time
+import pickle
+import socket
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import suppress
+import config
+import monitoring
+import scheduler
+
+logger = logging.getLogger("bot")
+
+HA = getattr(config, "HA", {})
+LEASE_NAME = "monitoring"
+
+def enabled() -> bool:
+    return bool(HA.get("enabled"))
+
+def node_id() -> str:
+    return str(HA.get("node") or f"{socket.gethostname()}:{os.getpid()}")
+
+def _ttl() -> float:
+    return max(3.0, float(HA.get("ttl", 15)))
+
+def _heartbeat() -> float:
+    # продление не реже трёх раз за срок аренды
+    return min(float(HA.get("heartbeat", 5)), _ttl() / 3)
+
+# Срок действия аренды по часам этого экземпляра
+_LEASE = {"expires": 0.0, "term": 0, "lost": False}
+
+def _connect() -> sqlite3.Connection:
+    db = HA.get("db", "data/ha.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(db)), exist_ok=True)
+    # журнал по умолчанию (DELETE): WAL не работает на сетевых файловых системах
+    conn = sqlite3.connect(db, timeout=5, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, holder TEXT, term INTEGER, expires REAL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS snapshot (name TEXT PRIMARY KEY, holder TEXT, term INTEGER, taken REAL, data BLOB)")
+    return conn
+
+# Обращение к хранилищу в daemon-потоке: зависший вызов не задержит и завершение процесса
+# (asyncio.to_thread ждал бы поток при выходе из asyncio.run)
+def _storage(func, *args) -> asyncio.Future:
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run():
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            result, error = None, e
+        with suppress(RuntimeError):
+            loop.call_soon_threadsafe(settle, result, error)
+
+    threading.Thread(target=run, name=f"ha:{func.__name__}", daemon=True).start()
+    return future
+
+# ===== Аренда =====
+# Взять или продлить аренду. Результат — (expires по monotonic, term) или None, если аренда чужая.
+# _LEASE обновляет вызывающий: поток зависшего обращения может завершиться уже после таймаута
+def _acquire() -> tuple[float, int] | None:
+    me = node_id()
+    # срок по локальным часам отсчитываем до обращения к хранилищу — с запасом
+    started = time.monotonic()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT holder, term, expires FROM lease WHERE name = ?", (LEASE_NAME,)).fetchone()
+        now = time.time()
+        if row is not None and row[0] != me and row[2] > now:
+            conn.execute("ROLLBACK")
+            return None
+        # term растёт при каждой смене лидера — по нему видно, чей снимок новее
+        term = row[1] if row is not None and row[0] == me else (row[1] + 1 if row is not None else 1)
+        conn.execute(
+            "INSERT OR REPLACE INTO lease (name, holder, term, expires) VALUES (?, ?, ?, ?)",
+            (LEASE_NAME, me, term, now + _ttl()),
+        )
+        conn.execute("COMMIT")
+        return started + _ttl(), term
+    finally:
+        conn.close()
+
+def _hold(lease: tuple[float, int]):
+    _LEASE.update(expires=lease[0], term=lease[1], lost=False)
+
+# Сколько можно ждать хранилище: до истечения аренды с запасом в один heartbeat. Зависшее
+# обращение (NFS, SQLite на отвалившемся томе) не должно держать лидера дольше его аренды
+def _storage_timeout() -> float:
+    return max(0.0, _LEASE["expires"] - time.monotonic() - _heartbeat())
+
+def _release():
+    conn = _connect()
+    try:
+        conn.execute("UPDATE lease SET expires = 0 WHERE name = ? AND holder = ?", (LEASE_NAME, node_id()))
+    finally:
+        conn.close()
+
+# ===== Снимок состояния =====
+# Снимок собирается в потоке event loop: состояние мониторинга меняют только его задачи
+def _snapshot_data() -> bytes:
+    return pickle.dumps({
+        "state": monitoring.state__snapshot(),
+        "schedules": scheduler.last_runs(),
+    })
+
+# Запись снимка, если аренда всё ещё за этим узлом и в том же term. True — снимок записан
+def _save_snapshot(data: bytes) -> bool:
+    me = node_id()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(
+            "INSERT OR REPLACE INTO snapshot (name, holder, term, taken, data) "
+            "SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM lease WHERE name = ? AND holder = ? AND term = ?)",
+            (LEASE_NAME, me, _LEASE["term"], time.time(), data, LEASE_NAME, me, _LEASE["term"]),
+        )
+        conn.execute("COMMIT")
+        return cur.rowcount > 0
+    finally:
+        conn.close()
+
+# Применение снимка лидера, если он новее known. Возвращает время снимка
+def _load_snapshot(known: float | None = None) -> float | None:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT taken FROM snapshot WHERE name = ?", (LEASE_NAME,)).fetchone()
+        if row is None or row[0] == known:
+            return known
+        taken, data = conn.execute("SELECT taken, data FROM snapshot WHERE name = ?", (LEASE_NAME,)).fetchone()
+    finally:
+        conn.close()
+    snapshot = pickle.loads(data)
+    monitoring.state__restore(snapshot.get("state", {}))
+    scheduler.merge_last_runs(snapshot.get("schedules", {}))
+    return taken
+
+# ===== Standby =====
+# Ожидание лидерства; всё это время состояние подтягивается из последнего снимка
+async def wait_for_leadership():
+    logger.info(f"HA: узел {node_id()} — standby, ожидание аренды")
+    loaded = None
+    while True:
+        try:
+            taken = await _storage(_load_snapshot, loaded)
+            if taken != loaded:
+                loaded = taken
+                logger.info(f"HA: загружен снимок состояния ({time.time() - taken:.0f} с назад)")
+            lease = await _storage(_acquire)
+            if lease is not None:
+                _hold(lease)
+                logger.warning(f"HA: узел {node_id()} стал лидером (term {_LEASE['term']})")
+                return
+        except Exception as e:
+            logger.error(f"HA: standby check failed -> {e}")
+        await asyncio.sleep(_heartbeat())
+
+# ===== Лидер =====
+# Продление аренды и сохранение снимков; возврат — аренда потеряна (_LEASE["lost"])
+async def _hold_lease():
+    snapshot_interval = max(_heartbeat(), float(HA.get("snapshot_interval", 10)))
+    last_snapshot = time.monotonic()
+    while True:
+        await asyncio.sleep(_heartbeat())
+        try:
+            lease = await asyncio.wait_for(_storage(_acquire), _storage_timeout())
+            if lease is None:
+                logger.error("HA: аренду взял другой узел")
+                _LEASE["lost"] = True
+                return
+            _hold(lease)
+        except asyncio.TimeoutError:
+            logger.error("HA: хранилище не ответило до истечения аренды, лидерство сложено")
+            _LEASE["lost"] = True
+            return
+        except Exception as e:
+            logger.error(f"HA: lease renew failed -> {e}")
+            # без связи с хранилищем работаем только до истечения уже взятой аренды
+            if time.monotonic() + _heartbeat() >= _LEASE["expires"]:
+                logger.error("HA: аренда истекает, лидерство сложено")
+                _LEASE["lost"] = True
+                return
+            continue
+        if time.monotonic() - last_snapshot >= snapshot_interval:
+            try:
+                saved = await asyncio.wait_for(_storage(_save_snapshot, _snapshot_data()), _storage_timeout())
+                if not saved:
+                    logger.error("HA: аренду взял другой узел, снимок не записан")
+                    _LEASE["lost"] = True
+                    return
+                last_snapshot = time.monotonic()
+            except asyncio.TimeoutError:
+                logger.error("HA: хранилище не ответило до истечения аренды, лидерство сложено")
+                _LEASE["lost"] = True
+                return
+            except Exception as e:
+                logger.error(f"HA: snapshot save failed -> {e}")
+
+# Работа serving (polling/webhook), пока этот узел лидер. При потере аренды serving отменяется
+# и возвращается True — процесс должен завершиться с ошибкой
+async def serve_while_leader(serving) -> bool:
+    serve_task = asyncio.ensure_future(serving)
+    lease_task = asyncio.create_task(_hold_lease(), name="ha:lease")
+    try:
+        await asyncio.wait({serve_task, lease_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (serve_task, lease_task):
+            task.cancel()
+        await asyncio.gather(serve_task, lease_task, return_exceptions=True)
+    if not serve_task.cancelled() and serve_task.exception() is not None:
+        raise serve_task.exception()
+    return _LEASE["lost"]
+
+# Штатная остановка лидера: последний снимок и освобождение аренды.
+# Потерянная аренда уже не наша — ни снимка, ни освобождения
+async def step_down():
+    if _LEASE["lost"] or time.monotonic() >= _LEASE["expires"]:
+        return
+    with suppress(Exception):
+        await asyncio.wait_for(_storage(_save_snapshot, _snapshot_data()), _storage_timeout())
+    with suppress(Exception):
+        await asyncio.wait_for(_storage(_release), _storage_timeout())
+    _LEASE["expires"] = 0.0
+    logger.info("HA: аренда освобождена")
@@ -2,45 +2,130 @@
 Данный файл содержит хэндлеры для работы с кнопками Telegram-бота.
 Реализует доступ к категориям мониторинга (CPU/RAM, диск, процессы, обновления, бэкапы, сайты, боты)
 и ручные запросы по серверам, ботам и сайтам через Telegram-интерфейс.
+Списки серверов и ботов выводятся постранично (PICKER["page_size"]), боты — по серверам;
+inline-режим (@bot srv-na…) ищет сервера, ботов и сайты по префиксу.
 """
 import logging
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
-from config import CATEGORIES, SERVERS, SITES_MONITOR, BOTS_MONITOR
+from aiogram.types import (
+    Message, CallbackQuery, InlineQuery, InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultArticle, InputTextMessageContent,
+)
+import config
+from config import CATEGORIES, SERVERS
 from monitoring import (
     cpu_ram__manual_button,
     disk__manual_button,
     processes__manual_button,
     updates__manual_button,
     backups__manual_button,
-    check_single_site, send_site_status,
+    backups__history_button,
+    sites__manual_button,
     bots__manual_button,
+    updates__render_package_report,
+    BOTS_REGISTRY,
     escape_markdown
 )
+import search
+import jobs
+import callbacks
+from callbacks import ALL, encode, register
 
 logger = logging.getLogger('bot')
 
+PICKER = getattr(config, "PICKER", {})
+PAGE_SIZE = max(1, int(PICKER.get("page_size", 8)))
+
 def build_main_menu():
-    buttons = [[InlineKeyboardButton(text=name, callback_data=f"cat:{cat}")] for cat, name in CATEGORIES.items()]
+    buttons = [[InlineKeyboardButton(text=name, callback_data=encode("cat", cat))] for cat, name in CATEGORIES.items()]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def build_servers_menu(category: str):
+# Срез страницы: (элементы, номер страницы, всего страниц)
+def paginate(items: list, page: int):
+    pages = max(1, -(-len(items) // PAGE_SIZE))
+    page = min(max(0, page), pages - 1)
+    return items[page * PAGE_SIZE:(page + 1) * PAGE_SIZE], page, pages
+
+# Ряд навигации по страницам (пустой, если страница одна)
+def nav_row(action: str, target: str, page: int, pages: int) -> list:
+    if pages <= 1:
+        return []
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton(text="«", callback_data=encode(action, target, page - 1)))
+    row.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=encode("noop")))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton(text="»", callback_data=encode(action, target, page + 1)))
+    return row
+
+def bot_servers() -> list[str]:
+    return [sid for sid in SERVERS if BOTS_REGISTRY["server_to_bots"].get(sid)]
+
+# Боты одного сервера
+def bots_picker(sid: str, page: int = 0):
+    names, page, pages = paginate(BOTS_REGISTRY["server_to_bots"].get(sid, []), page)
+    buttons = [[InlineKeyboardButton(text=bot_name, callback_data=encode("bots", bot_name))] for bot_name in names]
+    row = nav_row("bots_srv", sid, page, pages)
+    if row:
+        buttons.append(row)
+    last = [InlineKeyboardButton(text="Все", callback_data=encode("bots", ALL))]
+    if len(bot_servers()) > 1:
+        last.insert(0, InlineKeyboardButton(text="⬅️ Сервера", callback_data=encode("page", "bots", 0)))
+    buttons.append(last)
+    text = f"🤖 Выберите бота на {escape_markdown(SERVERS[sid]['name'])}:"
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+# Пикер категории: (текст, клавиатура) для страницы page
+def picker(category: str, page: int = 0):
+    if category == "bots":
+        sids = bot_servers()
+        if len(sids) == 1:
+            return bots_picker(sids[0], page)
+        items, page, pages = paginate(sids, page)
+        buttons = [
+            [InlineKeyboardButton(
+                text=f"{SERVERS[sid]['name']} ({len(BOTS_REGISTRY['server_to_bots'][sid])})",
+                callback_data=encode("bots_srv", sid),
+            )]
+            for sid in items
+        ]
+        row = nav_row("page", category, page, pages)
+        if row:
+            buttons.append(row)
+        buttons.append([InlineKeyboardButton(text="Все", callback_data=encode("bots", ALL))])
+        return "🤖 Выберите сервер с ботами:", InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    # show server names, but callback carries server index
+    items, page, pages = paginate(list(SERVERS), page)
+    if category == "backups":
+        # рядом с каждым сервером — кнопка истории запусков
+        buttons = [
+            [
+                InlineKeyboardButton(text=SERVERS[sid]["name"], callback_data=encode(category, sid)),
+                InlineKeyboardButton(text="📜", callback_data=encode("backups_history", sid)),
+            ]
+            for sid in items
+        ]
+        last = [
+            InlineKeyboardButton(text="Все", callback_data=encode(category, ALL)),
+            InlineKeyboardButton(text="📜", callback_data=encode("backups_history", ALL)),
+        ]
+    else:
+        buttons = [
+            [InlineKeyboardButton(text=SERVERS[sid]["name"], callback_data=encode(category, sid))]
+            for sid in items
+        ]
+        last = [InlineKeyboardButton(text="Все", callback_data=encode(category, ALL))]
+    row = nav_row("page", category, page, pages)
+    if row:
+        buttons.append(row)
+    buttons.append(last)
+    label = CATEGORIES.get(category, category.upper())
+    return f"📡 Выберите сервер для {escape_markdown(label)}:", InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def build_servers_menu(category: str, page: int = 0):
     if category == "sites":
         return None
-    if category == "bots":
-        buttons = []
-        bots = BOTS_MONITOR.get("bots", {})
-        for sid, bot_list in bots.items():
-            for bot_name in bot_list:
-                buttons.append([InlineKeyboardButton(text=bot_name, callback_data=f"bots:{bot_name}")])
-        buttons.append([InlineKeyboardButton(text="Все", callback_data="bots:ALL")])
-        return InlineKeyboardMarkup(inline_keyboard=buttons)
-    # show server names, but callback carries server_id (sid)
-    buttons = [
-        [InlineKeyboardButton(text=cfg["name"], callback_data=f"{category}:{sid}")]
-        for sid, cfg in SERVERS.items()
-    ]
-    buttons.append([InlineKeyboardButton(text="Все", callback_data=f"{category}:ALL")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return picker(category, page)[1]
 
 async def handle_command_servers(message: Message):
 
@@ -54,92 +139,108 @@ async def handle_command_servers(message: Message):
     except Exception as e:
         logger.error('handle_command_servers: answer failed: %s', e)
 
-async def handle_callback_server(callback: CallbackQuery):
-
+async def handle_package_command(message: Message):
+    parts = (message.text or "").split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        text = "Использование: `/package <имя или префикс пакета>`"
+    else:
+        text = updates__render_package_report(parts[1].strip())
     try:
-        await callback.message.delete()
+        await message.answer(text)
     except Exception as e:
-        logger.warning('handle_callback_server: delete failed: %s', e)
-    data = callback.data
+        logger.error('handle_package_command: answer failed: %s', e)
 
-    if not data:
-        logger.warning('handle_callback_server: empty callback.data')
-        return
+async def handle_callback_server(callback: CallbackQuery):
+    await callbacks.dispatch(callback)
 
-    if data.startswith("cat:"):
-        category = data.split(":")[1]
-        
-        if category == "sites":
-            try:
-                urls = SITES_MONITOR.get('urls', [])
-                if not isinstance(urls, list):
-                    raise ValueError('SITES_MONITOR["urls"] must be a list')
-                results = []
-                for url in urls:
-                    try:
-                        status = await check_single_site(url)
-                        emoji = "✅" if status else "❌"
-                        results.append(f"{emoji} {url}")
-                    except Exception as e:
-                        logger.error('handle_callback_server: site check failed for %s: %s', url, e)
-                        results.append(f"❌ {url}")
-                await send_site_status("request", "\n".join(results))
-            except Exception as e:
-                logger.error('handle_callback_server: sites block failed: %s', e)
-        elif category == "bots":
-            try:
-                await callback.message.answer(
-                    "🤖 Выберите бота:",
-                    reply_markup=build_servers_menu(category)
-                )
-            except Exception as e:
-                logger.error('handle_callback_server: answer failed: %s', e)
-        else:
-            try:
-                label = CATEGORIES.get(category, category.upper())
-                await callback.message.answer(
-                    f"📡 Выберите сервер для {escape_markdown(label)}:",
-                    reply_markup=build_servers_menu(category)
-                )
-            except Exception as e:
-                logger.error('handle_callback_server: answer failed: %s', e)
-        return
+# ===== Inline-поиск =====
+# Карточка цели: (заголовок, описание, текст сообщения, кнопки действий)
+def target_card(kind: str, key: str):
+    if kind == "server":
+        name = SERVERS[key]["name"]
+        actions = [
+            InlineKeyboardButton(text=label, callback_data=encode(cat, key))
+            for cat, label in CATEGORIES.items()
+            if callbacks.ROUTES.get(cat, ("",))[0] == "server"
+        ]
+        rows = [actions[i:i + 2] for i in range(0, len(actions), 2)]
+        return name, "Сервер", f"🖥 *{escape_markdown(name)}*", rows
+    if kind == "bot":
+        sid = BOTS_REGISTRY["bot_to_server"].get(key)
+        srv_name = SERVERS[sid]["name"] if sid in SERVERS else "—"
+        rows = [[InlineKeyboardButton(text="🤖 Статус", callback_data=encode("bots", key))]]
+        return key, f"Бот на {srv_name}", f"🤖 *{escape_markdown(key)}* — {escape_markdown(srv_name)}", rows
+    rows = [[InlineKeyboardButton(text="🌐 Проверить", callback_data=encode("site", key))]]
+    return key, "Сайт", f"🌐 {escape_markdown(key)}", rows
 
+async def handle_inline_query(query: InlineQuery):
+    results = []
+    for kind, key in search.find(query.query or ""):
+        title, description, text, rows = target_card(kind, key)
+        results.append(InlineQueryResultArticle(
+            id=f"{kind[0]}{callbacks.index_of(kind, key)}",
+            title=title,
+            description=description,
+            input_message_content=InputTextMessageContent(message_text=text, parse_mode="MarkdownV2"),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=rows),
+        ))
     try:
-        category, target = data.split(":", 1)
+        await query.answer(results, cache_time=5, is_personal=True)
     except Exception as e:
-        logger.warning('handle_callback_server: bad callback data: %r (%s)', data, e)
+        logger.error('handle_inline_query: answer failed: %s', e)
+
+# ===== Обработчики callback-кнопок =====
+# Проверка сайтов — фоновой задачей jobs, как и остальные ручные запросы
+async def callback__site(callback: CallbackQuery, url: str, arg=None):
+    await jobs.start(callback, "site", url, sites__manual_button)
+
+# Выбор категории в главном меню
+async def callback__category(callback: CallbackQuery, category: str, arg=None):
+    if category == "sites":
+        await jobs.start(callback, "sites", ALL, sites__manual_button)
         return
+    if category not in callbacks.ROUTES:
+        logger.warning('handle_callback_server: no handler for category %r', category)
+        return
+    text, markup = picker(category)
+    await callback.message.answer(text, reply_markup=markup)
+
+# Листание пикера (сообщение правится на месте)
+async def callback__page(callback: CallbackQuery, category: str, arg=None):
+    text, markup = picker(category, int(arg or 0))
+    await callback.message.edit_text(text, reply_markup=markup)
+
+async def callback__bots_server(callback: CallbackQuery, sid: str, arg=None):
+    text, markup = bots_picker(sid, int(arg or 0))
+    await callback.message.edit_text(text, reply_markup=markup)
+
+async def callback__noop(callback: CallbackQuery, target: str, arg=None):
+    await callback.answer()
+
+# Ручной запрос по серверу/боту: manual-функция категории запускается фоновой задачей
+def manual(action: str, func):
+    async def handler(callback: CallbackQuery, target: str, arg=None):
+        await jobs.start(callback, action, target, func)
+    return handler
+
+async def callback__cancel(callback: CallbackQuery, target: str, arg=None):
+    if await jobs.cancel(callback, int(arg or 0)):
+        await callback.answer("Запрос отменён")
+        if callback.message is not None:
+            await callback.message.edit_text("⛔ Запрос отменён")
+    else:
+        await callback.answer("Запрос уже завершён")
 
-    arg = "ALL" if target == "ALL" else target
-
-    if category == "cpu_ram":
-        try:
-            await cpu_ram__manual_button(arg)
-        except Exception as e:
-            logger.error('cpu_ram__manual_button failed: %s', e)
-    elif category == "disk":
-        try:
-            await disk__manual_button(arg)
-        except Exception as e:
-            logger.error('disk__manual_button failed: %s', e)
-    elif category == "processes":
-        try:
-            await processes__manual_button(arg)
-        except Exception as e:
-            logger.error('processes__manual_button failed: %s', e)
-    elif category == "updates":
-        try:
-            await updates__manual_button(arg)
-        except Exception as e:
-            logger.error('updates__manual_button failed: %s', e)
-    elif category == "backups":
-        try:
-            await backups__manual_button(arg)
-        except Exception as e:
-            logger.error('backups__manual_button failed: %s', e)
-    elif category == "bots":
-        try:
-            await bots__manual_button(arg)
-        except Exception as e:
-            logger.error('bots__manual_button failed: %s', e)
\ No newline at end of file
+register("cat", "category", callback__category)
+register("page", "category", callback__page, delete=False)
+register("bots_srv", "server", callback__bots_server, delete=False)
+register("noop", "category", callback__noop, delete=False)
+register("site", "site", callback__site, delete=False)
+register("cancel", "category", callback__cancel, delete=False)
+register("cpu_ram", "server", manual("cpu_ram", cpu_ram__manual_button))
+register("disk", "server", manual("disk", disk__manual_button))
+register("processes", "server", manual("processes", processes__manual_button))
+register("updates", "server", manual("updates", updates__manual_button))
+register("backups", "server", manual("backups", backups__manual_button))
+register("backups_history", "server", manual("backups_history", backups__history_button))
+register("bots", "bot", manual("bots", bots__manual_button))
@@ -0,0 +1,110 @@
+"""
+• Фоновые ручные запросы
+  - Ручной запрос по кнопке запускается отдельной задачей: обработка апдейтов aiogram не ждёт
+    окончания опроса серверов.
+  - Повторное нажатие с тем же (пользователь, категория, цель), пока запрос выполняется,
+    новый запрос не запускает.
+  - Плейсхолдер «⏳ Ожидание данных» отправляется сразу, с кнопкой отмены, в тот чат (и тему),
+    где нажата кнопка; туда же приходит результат.
+  - Одновременных обходов «Все» не больше MANUAL_JOBS["max_sweeps"], запросов по одной цели —
+    не больше MANUAL_JOBS["max_jobs"]; остальные ждут в очереди.
+"""
+
+import asyncio
+import logging
+import itertools
+from contextlib import suppress
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+import config
+import monitoring
+from callbacks import ALL, encode
+
+logger = logging.getLogger("bot")
+
+MANUAL_JOBS = getattr(config, "MANUAL_JOBS", {})
+_SWEEPS = asyncio.Semaphore(max(1, int(MANUAL_JOBS.get("max_sweeps", 2))))
+_SINGLE = asyncio.Semaphore(max(1, int(MANUAL_JOBS.get("max_jobs", 8))))
+
+# (user_id, action, target) → {"id": int, "task": asyncio.Task, "edit_to": (chat_id, message_id) | None,
+#                              "reply_to": (chat_id, thread_id)}
+JOBS: dict[tuple[int, str, str], dict] = {}
+# id задачи → ключ в JOBS (для кнопки отмены)
+JOBS_BY_ID: dict[int, tuple[int, str, str]] = {}
+_ids = itertools.count(1)
+
+def cancel_markup(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✖️ Отменить", callback_data=encode("cancel", ALL, job_id))]
+    ])
+
+# Чат, в котором нажата кнопка: (chat_id, thread_id). У кнопок из inline-режима сообщения нет —
+# ответ уходит в личный чат нажавшего
+def reply_chat(callback: CallbackQuery) -> tuple[int, int | None]:
+    message = callback.message
+    if message is None:
+        return callback.from_user.id, None
+    return message.chat.id, getattr(message, "message_thread_id", None)
+
+# Запуск ручного запроса func(target, edit_to=..., reply_to=...) в фоне
+async def start(callback: CallbackQuery, action: str, target: str, func):
+    key = (callback.from_user.id, action, target)
+    if key in JOBS:
+        with suppress(Exception):
+            await callback.answer("⏳ Этот запрос уже выполняется")
+        return
+
+    sem = _SWEEPS if target == ALL else _SINGLE
+    job_id = next(_ids)
+    job = JOBS[key] = {"id": job_id, "task": None, "edit_to": None, "reply_to": reply_chat(callback)}
+    JOBS_BY_ID[job_id] = key
+
+    with suppress(Exception):
+        await callback.answer("⏳ Запрос в очереди" if sem.locked() else None)
+
+    b = monitoring.bot
+    try:
+        placeholder = await b.send_message(
+            chat_id=job["reply_to"][0],
+            message_thread_id=job["reply_to"][1],
+            text="⏳ Ожидание данных",
+            parse_mode="MarkdownV2",
+            reply_markup=cancel_markup(job_id),
+        )
+        job["edit_to"] = (placeholder.chat.id, placeholder.message_id)
+    except Exception as e:
+        logger.warning(f"jobs.start: placeholder send failed -> {e}")
+
+    if job.get("cancelled"):
+        JOBS.pop(key, None)
+        JOBS_BY_ID.pop(job_id, None)
+        return
+    job["task"] = asyncio.create_task(_run(key, job, sem, func, target), name=f"manual:{action}:{target}")
+
+async def _run(key, job, sem, func, target):
+    try:
+        async with sem:
+            await func(target, edit_to=job["edit_to"], reply_to=job["reply_to"])
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.error(f"manual job {key[1]}:{target} failed -> {e}")
+    finally:
+        JOBS.pop(key, None)
+        JOBS_BY_ID.pop(job["id"], None)
+        # результат уже заменил плейсхолдер; если нет — убираем кнопку отмены
+        if job["edit_to"] and monitoring.bot is not None:
+            with suppress(Exception):
+                await monitoring.bot.edit_message_reply_markup(
+                    chat_id=job["edit_to"][0], message_id=job["edit_to"][1], reply_markup=None
+                )
+
+# Отмена по кнопке на плейсхолдере
+async def cancel(callback: CallbackQuery, job_id: int) -> bool:
+    key = JOBS_BY_ID.get(job_id)
+    if key is None or key[0] != callback.from_user.id:
+        return False
+    job = JOBS[key]
+    job["cancelled"] = True
+    if job["task"] is not None:
+        job["task"].cancel()
+    return True
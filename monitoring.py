@@ -7,11 +7,12 @@
 
 • Запросы данных с серверов по API
   - /cpu_ram             → загрузка CPU и RAM, load average
-  - /disk                → заполнение диска
+  - /disk                → заполнение дисков по точкам монтирования (и inodes), прогноз времени до заполнения
   - /processes           → статус системных сервисов
   - /updates             → наличие системных обновлений
   - /backup_json         → отчёт о выполнении бэкапов
   - /bots                → статус, версия и аптайм Telegram-ботов
+  - /stream (WebSocket)  → опционально: поток дельт CPU/RAM и DISK, при обрыве — обратно на опрос
 
 • Контроль майнеров
   - Поиск подозрительных процессов (майнеров) в списке запущенных.
@@ -23,14 +24,25 @@
   - Контроль доступности, версий и аптайма Telegram-ботов, уведомления при сбоях и обновлениях.
 """
 
+import time
 import asyncio
 import aiohttp
+import os
+import re
+import json
+import bisect
 import datetime
+from collections import deque
+import config
 from config import TG_ID, SERVERS, BOTS_MONITOR, SITES_MONITOR, MINERS
 from aiogram import Bot
 import ssl
 import logging
-from utils import escape_markdown
+import agent_api
+import alerts
+import render
+from utils import escape_markdown, escape_cached, LazyState, RingBuffer, file_lock
+from scheduler import CronSchedule, run_schedule
 
 # ===== Бот берём извне (из bot.py) =====
 from typing import Optional
@@ -41,22 +53,265 @@ def set_bot(external_bot: Bot) -> None:
     global bot
     bot = external_bot
 
+# Чат ответа на ручной запрос: reply_to = (chat_id, thread_id) того, кто нажал кнопку;
+# без него — владелец
+def _reply_chat(reply_to: tuple[int, int | None] | None) -> dict:
+    chat_id, thread_id = reply_to or (TG_ID, None)
+    return {"chat_id": chat_id, "message_thread_id": thread_id}
+
+# Отправка уведомления: автоуведомления — получателям из таблицы маршрутов (alerts.py),
+# ответ на ручной запрос (manual=True) — в чат запроса (reply_to). Возвращает [(chat_id, message_id)]
+async def _deliver(text: str, category: str, server_id: str | None = None,
+                   severity: str = "warning", manual: bool = False,
+                   reply_to: tuple[int, int | None] | None = None) -> list[tuple[int, int]]:
+    if manual:
+        sent = await bot.send_message(**_reply_chat(reply_to), text=text, parse_mode="MarkdownV2")
+        return [(sent.chat.id, sent.message_id)]
+    return await alerts.deliver(bot, text, category, server_id, severity)
+
+# ===== Детектор флаппинга =====
+# Скользящее окно событий (переходов/алертов) по каждой цели. Как только за окно набирается
+# порог событий, цель считается флапающей: шлётся одна сводка, дальше алерты глушатся,
+# пока цель не проведёт в тишине quiet секунд. Параметры читаются из cfg_source() при каждом
+# вызове, поэтому подхватываются перезагрузкой конфига. Событие — только смена состояния
+# (падение/восстановление, перезапуск), а не повтор того же статуса на следующем цикле.
+# Окно по умолчанию — не меньше threshold интервалов опроса (interval_source()): иначе при
+# редких проверках порог недостижим. Явно заданный window должен быть ≥ threshold × interval.
+class FlapDetector:
+    def __init__(self, cfg_source, interval_source=None):
+        self.cfg_source = cfg_source
+        self.interval_source = interval_source
+        self.events: dict[str, deque] = {}
+        self.flapping: dict[str, float] = {}  # цель → время последнего события во флаппинге
+
+    def _cfg(self):
+        cfg = self.cfg_source() or {}
+        threshold = int(cfg.get("threshold", 4))
+        window = cfg.get("window")
+        if window is None:
+            interval = float(self.interval_source()) if self.interval_source else 0.0
+            window = max(900.0, threshold * interval)
+        return (
+            float(window),
+            threshold,
+            float(cfg.get("quiet", 1800)),
+        )
+
+    # Регистрирует событие. Возвращает "alert" (слать как обычно), "flapping" (слать одну
+    # сводку о флаппинге) или "suppress" (не слать)
+    def record(self, target: str, now: float | None = None) -> str:
+        window, threshold, _ = self._cfg()
+        now = time.monotonic() if now is None else now
+        events = self.events.setdefault(target, deque())
+        events.append(now)
+        while events and events[0] < now - window:
+            events.popleft()
+
+        if target in self.flapping:
+            self.flapping[target] = now
+            return "suppress"
+        if threshold > 0 and len(events) >= threshold:
+            self.flapping[target] = now
+            return "flapping"
+        return "alert"
+
+    # Повтор алерта без смены состояния: событие не регистрируется, во флаппинге — глушится
+    def verdict(self, target: str) -> str:
+        return "suppress" if target in self.flapping else "alert"
+
+    def count(self, target: str) -> int:
+        return len(self.events.get(target, ()))
+
+    # Цели (из targets, если задано), вышедшие из флаппинга после периода тишины
+    def settled(self, targets=None, now: float | None = None) -> list[str]:
+        _, _, quiet = self._cfg()
+        now = time.monotonic() if now is None else now
+        done = [
+            t for t, last in self.flapping.items()
+            if (targets is None or t in targets) and now - last >= quiet
+        ]
+        for t in done:
+            del self.flapping[t]
+            self.events.pop(t, None)
+        return done
+
+    def forget(self, target: str):
+        self.events.pop(target, None)
+        self.flapping.pop(target, None)
+
+# ===== Корреляция инцидентов =====
+# Между анализаторами и отправкой: сбои целей одной группы (агенты, сайты, боты) в одном
+# сегменте сети копятся окно window секунд. Если за окно упало не меньше threshold целей —
+# шлётся одно сообщение-инцидент со списком, которое затем редактируется по мере
+# восстановления целей. Иначе накопленные сбои уходят обычными алертами (send_single).
+# Параметры: CORRELATION = {"window": 60, "threshold": 3, "sites": {...}, ...} — общие
+# и переопределения по группе; сегмент сервера — SERVERS[sid]["segment"].
+INCIDENT_MAX_LINES = 40
+
+class IncidentCorrelator:
+    def __init__(self, group: str, title: str, label, send_single):
+        self.group = group
+        self.title = title
+        self.label = label                  # цель → отображаемое имя
+        self.send_single = send_single      # async (targets: list[str]) → обычные алерты
+        self.pending: dict[str, dict[str, float]] = {}  # сегмент → {цель: время сбоя}
+        self.incidents: dict[str, dict] = {}            # сегмент → открытый инцидент
+        self.timers: dict[str, asyncio.Task] = {}
+        self.lock = asyncio.Lock()
+
+    def _cfg(self):
+        cfg = getattr(config, "CORRELATION", {}) or {}
+        merged = {**cfg, **(cfg.get(self.group) or {})}
+        return float(merged.get("window", 60)), int(merged.get("threshold", 3))
+
+    def _incident_of(self, target: str) -> str | None:
+        for segment, incident in self.incidents.items():
+            if target in incident["targets"]:
+                return segment
+        return None
+
+    # Цель под наблюдением коррелятора (ждёт окна или входит в открытый инцидент)
+    def tracks(self, target: str) -> bool:
+        return any(target in p for p in self.pending.values()) or self._incident_of(target) is not None
+
+    def render(self, segment: str, incident: dict, closed: bool = False) -> str:
+        targets = incident["targets"]
+        down = [t for t, is_down in targets.items() if is_down]
+        up = [t for t, is_down in targets.items() if not is_down]
+        icon = "✅" if closed else "🚨"
+        state = "завершён" if closed else "открыт"
+        header = f"{icon} *{escape_markdown(self.title)}* — инцидент {state}"
+        if segment != "all":
+            header += f"\nСегмент: `{escape_markdown(segment)}`"
+        duration = bots__format_uptime(time.time() - incident["started"])
+        lines = [
+            header,
+            escape_markdown(f"Затронуто: {len(targets)}, недоступно: {len(down)}, восстановилось: {len(up)}"),
+            f"⏱ Длительность: `{escape_markdown(duration)}`",
+            "",
+        ]
+        rows = [f"❌ {escape_markdown(self.label(t))}" for t in down]
+        rows += [f"✅ {escape_markdown(self.label(t))}" for t in up]
+        if len(rows) > INCIDENT_MAX_LINES:
+            rest = len(rows) - INCIDENT_MAX_LINES
+            rows = rows[:INCIDENT_MAX_LINES] + [escape_markdown(f"… и ещё {rest}")]
+        return "\n".join(lines + rows)
+
+    async def _publish(self, segment: str, closed: bool = False):
+        logger = logging.getLogger("global_monitoring")
+        incident = self.incidents[segment]
+        text = self.render(segment, incident, closed)
+        b = bot
+        if b is None:
+            logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+            return
+        try:
+            if incident["messages"]:
+                for chat_id, message_id in incident["messages"]:
+                    await b.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode="MarkdownV2")
+            else:
+                incident["messages"] = await _deliver(text, self.group, severity="critical")
+        except Exception as e:
+            logger.warning(f"incident[{self.group}/{segment}]: publish failed -> {e}")
+
+    # Сбой цели: в открытый инцидент сегмента или в буфер до конца окна
+    async def failed(self, target: str, segment: str = "all"):
+        async with self.lock:
+            incident = self.incidents.get(segment)
+            if incident is not None:
+                if incident["targets"].get(target) is not True:
+                    incident["targets"][target] = True
+                    await self._publish(segment)
+                return
+            self.pending.setdefault(segment, {}).setdefault(target, time.time())
+            if segment not in self.timers:
+                window, _ = self._cfg()
+                self.timers[segment] = asyncio.create_task(self._flush_later(segment, window))
+
+    # Восстановление цели. True — событие поглощено коррелятором (обычный алерт не нужен)
+    async def recovered(self, target: str) -> bool:
+        async with self.lock:
+            for pending in self.pending.values():
+                if pending.pop(target, None) is not None:
+                    return True
+            segment = self._incident_of(target)
+            if segment is None:
+                return False
+            incident = self.incidents[segment]
+            incident["targets"][target] = False
+            closed = not any(incident["targets"].values())
+            await self._publish(segment, closed=closed)
+            if closed:
+                del self.incidents[segment]
+            return True
+
+    async def _flush_later(self, segment: str, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            self.timers.pop(segment, None)
+            async with self.lock:
+                await self._flush_segment(segment)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.getLogger("global_monitoring").error(f"incident[{self.group}/{segment}]: flush failed -> {e}")
+
+    async def _flush_segment(self, segment: str):
+        pending = self.pending.pop(segment, {})
+        if not pending:
+            return
+        _, threshold = self._cfg()
+        if threshold > 0 and len(pending) >= threshold:
+            logging.getLogger("global_monitoring").warning(
+                f"incident[{self.group}/{segment}]: {len(pending)} целей недоступны одновременно"
+            )
+            self.incidents[segment] = {
+                "started": min(pending.values()),
+                "targets": {t: True for t in pending},
+                "messages": [],
+            }
+            await self._publish(segment)
+        else:
+            await self.send_single(list(pending))
+
+    # Досрочное закрытие окна (например, в конце цикла проверки сайтов)
+    async def flush(self):
+        async with self.lock:
+            for segment in list(self.pending):
+                timer = self.timers.pop(segment, None)
+                if timer is not None:
+                    timer.cancel()
+                await self._flush_segment(segment)
+
+    def forget(self, target: str):
+        for pending in self.pending.values():
+            pending.pop(target, None)
+        for segment, incident in list(self.incidents.items()):
+            incident["targets"].pop(target, None)
+            if not incident["targets"]:
+                del self.incidents[segment]
+
 # ===== Мониторинг сайтов =====
-async def send_site_status(type, msg: str):
-    if type == "problem":
-        message = f"🌐 *Проблема с сайтом:*\n\n{escape_markdown(msg)}"
-    elif type == "request":
-        message = f"🌐 *Результат опроса сайтов:*\n\n{escape_markdown(msg)}"
+async def send_site_status(type, msg: str, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
+    message = render.TEMPLATES["sites"][type].format(text=escape_markdown(msg))
+    severity = {"problem": "critical", "flapping": "warning"}.get(type, "info")
     try:
         b = bot
         if b is None:
             print("Bot instance is not set. Call set_bot() from bot.py first.")
             return
-        await b.send_message(
-            chat_id=TG_ID,
-            text=message,
-            parse_mode="MarkdownV2"
-        )
+        if edit_to:
+            try:
+                await b.edit_message_text(
+                    chat_id=edit_to[0],
+                    message_id=edit_to[1],
+                    text=message,
+                    parse_mode="MarkdownV2",
+                )
+                return
+            except Exception as e:
+                print(f"edit_message_text failed -> {e}; fallback to send")
+        await _deliver(message, "sites", severity=severity, manual=(type == "request"), reply_to=reply_to)
     except Exception as e:
         print(f"Ошибка при отправке отчета: {e}")
 
@@ -73,15 +328,66 @@ async def check_single_site(url):
         print(f"❌ Ошибка при обращении к {url}: {e}")
         return False
 
+# Ручной запрос по кнопке: url — один сайт, "ALL" — обход всех сайтов из SITES_MONITOR
+async def sites__manual_button(target, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
+    logger = logging.getLogger("sites_monitoring")
+    if target == "ALL":
+        urls = SITES_MONITOR.get("urls", [])
+        if not isinstance(urls, list):
+            raise ValueError('SITES_MONITOR["urls"] must be a list')
+    else:
+        urls = [target]
+    results = []
+    for url in urls:
+        try:
+            status = await check_single_site(url)
+        except Exception as e:
+            logger.error(f"sites__manual_button: site check failed for {url} -> {e}")
+            status = False
+        results.append(f"{'✅' if status else '❌'} {url}")
+    await send_site_status("request", "\n".join(results), edit_to=edit_to, reply_to=reply_to)
+
+# Последний известный статус сайтов (переживает перезапуск задачи при перезагрузке конфига)
+SITES_STATE: dict[str, bool] = {}
+SITES_FLAPS = FlapDetector(lambda: SITES_MONITOR.get("flap"), lambda: max(30, int(SITES_MONITOR.get("interval", 3600))))
+
+# Обычный алерт по сайту с учётом флаппинга
+async def sites__alert(url: str, is_ok: bool):
+    logger = logging.getLogger("sites_monitoring")
+    verdict = SITES_FLAPS.record(url)
+    if verdict == "alert":
+        await send_site_status("recovered" if is_ok else "problem", url)
+    elif verdict == "flapping":
+        logger.warning(f"🔁 {url} — флаппинг, уведомления приостановлены")
+        await send_site_status("flapping", f"{url} — {SITES_FLAPS.count(url)} переключений подряд")
+    else:
+        logger.info(f"🔁 {url} — флаппинг, уведомление подавлено")
+
+async def sites__alert_down(urls: list[str]):
+    for url in urls:
+        await sites__alert(url, False)
+
+SITES_INCIDENTS = IncidentCorrelator("sites", "Массовая недоступность сайтов", lambda url: url, sites__alert_down)
+
+# Уведомление о смене статуса сайта: сбои идут через коррелятор инцидентов
+async def sites__notify(url: str, is_ok: bool):
+    if not is_ok:
+        await SITES_INCIDENTS.failed(url)
+        return
+    if await SITES_INCIDENTS.recovered(url):
+        return
+    await sites__alert(url, True)
+
 async def monitor_sites():
     logger = logging.getLogger("sites_monitoring")
 
     interval = int(SITES_MONITOR.get("interval", 3600))
     interval = max(30, interval)
-    urls = SITES_MONITOR.get("urls", [])
-    last_status: dict[str, bool] = {}
+    last_status = SITES_STATE
 
     while True:
+        # список читаем каждый цикл — его может обновить перезагрузка конфига
+        urls = list(SITES_MONITOR.get("urls", []))
         for url in urls:
             is_ok = await check_single_site(url)
             if is_ok:
@@ -91,48 +397,75 @@ async def monitor_sites():
             prev = last_status.get(url)
             if prev is None:
                 if not is_ok:
-                    await send_site_status("problem", url)
-            else:
-                if prev and not is_ok:
-                    await send_site_status("problem", url)
-                elif (not prev) and is_ok:
-                    try:
-                        b = bot
-                        if b is None:
-                            print("Bot instance is not set. Call set_bot() from bot.py first.")
-                            return
-                        await b.send_message(
-                            chat_id=TG_ID,
-                            text=f"🌐 *Сайт восстановился:*\n\n{escape_markdown(url)}",
-                            parse_mode="MarkdownV2",
-                        )
-                    except Exception as e:
-                        print(f"Ошибка при отправке отчёта о восстановлении: {e}")
+                    await sites__notify(url, is_ok)
+            elif prev != is_ok:
+                await sites__notify(url, is_ok)
             last_status[url] = is_ok
+
+        # цикл проверки окончен — сбои этого цикла коррелируются сразу, без ожидания окна
+        await SITES_INCIDENTS.flush()
+
+        # сайты, вышедшие из флаппинга: одно сообщение с текущим статусом
+        for url in SITES_FLAPS.settled():
+            if url in last_status:
+                emoji = "✅" if last_status[url] else "❌"
+                await send_site_status("stable", f"{emoji} {url}")
         await asyncio.sleep(interval)
 
 # ===== Мониторинг БОТов =====
-# Глобальное состояние БОТОВ для всех серверов
-BOTS_STATE = {
-    bot_name: {
-        "success": None,
-        "version": "",
-        "uptime": "",
-        "new_version": False,
-        "restarted": False,
-    }
-    for srv in BOTS_MONITOR["bots"].values()
-    for bot_name in srv.keys()
+# Глобальное состояние БОТОВ для всех серверов (запись создаётся при первом обращении)
+BOTS_STATE = LazyState(lambda: {
+    "success": None,
+    "version": "",
+    "started_at": None,
+    "new_version": False,
+    "restarted": False,
+})
+
+# Реестр ботов: индексы строятся из BOTS_MONITOR один раз (и заново — при перезагрузке конфига)
+BOTS_REGISTRY = {
+    "port_to_bot": {},     # server_id → {str(port): bot_name}
+    "bot_to_server": {},   # bot_name → server_id
+    "server_to_bots": {},  # server_id → [bot_name, ...]
+    "order": [],           # все боты, сгруппированные по серверам
 }
 
+def bots__build_registry():
+    port_to_bot, bot_to_server, server_to_bots, order = {}, {}, {}, []
+    for sid, bots_cfg in (BOTS_MONITOR.get("bots") or {}).items():
+        bots_cfg = bots_cfg or {}
+        names = list(bots_cfg.keys())
+        server_to_bots[sid] = names
+        port_to_bot[sid] = {str(port): name for name, port in bots_cfg.items()}
+        for name in names:
+            bot_to_server[name] = sid
+        order.extend(names)
+    BOTS_REGISTRY.update(
+        port_to_bot=port_to_bot,
+        bot_to_server=bot_to_server,
+        server_to_bots=server_to_bots,
+        order=order,
+    )
+
+bots__build_registry()
+
+# Синхронизация с конфигом: пересборка реестра, состояние удалённых ботов убирается
+def bots__sync_state():
+    bots__build_registry()
+    names = BOTS_REGISTRY["bot_to_server"]
+    for bot_name in list(BOTS_STATE.keys()):
+        if bot_name not in names:
+            del BOTS_STATE[bot_name]
+            BOTS_FLAPS.forget(bot_name)
+            BOTS_INCIDENTS.forget(bot_name)
+
 # Запрос данных о БОТах с API сервера
 async def bots__fetch_data(server_id):
     logger = logging.getLogger(server_id)
-    srv = SERVERS[server_id]
 
     # Проверяем, есть ли боты на этом сервере
     from config import BOTS_MONITOR
-    bots_cfg = BOTS_MONITOR.get("bots", {}).get(server_id)
+    bots_cfg = (BOTS_MONITOR.get("bots") or {}).get(server_id)
     if not bots_cfg:
         logger.info(f"[{server_id}] ⚪ Нет ботов для мониторинга, пропуск")
         return {}
@@ -140,35 +473,82 @@ async def bots__fetch_data(server_id):
     # Формируем строку портов
     ports = list(bots_cfg.values())
     ports_param = ",".join(str(p) for p in ports)
-    url = f"http://{srv['ip']}:{srv['monitoring_port']}/bots?token={srv['token']}&ports={ports_param}"
-    timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data
-                else:
-                    logger.warning(f"[{server_id}] ❌ Ошибка при запросе ботов: {resp.status}")
+        async with agent_api.session() as session:
+            status, data = await agent_api.get_json(session, server_id, "/bots", f"ports={ports_param}")
+            if status == 200:
+                return data
+            else:
+                logger.warning(f"[{server_id}] ❌ Ошибка при запросе ботов: {status}")
     except Exception as e:
         logger.error(f"[{server_id}] ❌ Ошибка при подключении к API ботов: {e}")
 
     return {}
 
+# Разбор аптайма агента в секунды — выполняется один раз на сэмпл.
+# Предпочитаем числовые поля (started_at / uptime_seconds), строку "0м. 3д. 04:05:06" — как запасной вариант
+_UPTIME_RE = re.compile(r"(?:(\d+)\s*м\.?)?\s*(?:(\d+)\s*д\.?)?\s*(\d+):(\d{2}):(\d{2})")
+
+def bots__started_at(bot_info: dict, sample_ts: float) -> float | None:
+    started = bot_info.get("started_at")
+    if isinstance(started, (int, float)):
+        return float(started)
+    seconds = bot_info.get("uptime_seconds")
+    if not isinstance(seconds, (int, float)):
+        m = _UPTIME_RE.search(str(bot_info.get("uptime", "")))
+        if not m:
+            return None
+        months, days, h, mi, se = (int(g or 0) for g in m.groups())
+        # агент считает месяц как 30 дней — важно лишь, чтобы формула была стабильной
+        seconds = (((months * 30 + days) * 24 + h) * 60 + mi) * 60 + se
+    return sample_ts - float(seconds)
+
+def bots__format_uptime(seconds: float) -> str:
+    minutes, seconds = divmod(int(max(0, seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    months, days = divmod(days, 30)
+    return f"{months}м. {days}д. {hours:02}:{minutes:02}:{seconds:02}"
+
+# История перезапусков и смены версий по каждому боту: (ts, вид, описание)
+BOTS_HISTORY_LEN = int(BOTS_MONITOR.get("history", 10))
+BOTS_HISTORY = LazyState(lambda: deque(maxlen=BOTS_HISTORY_LEN))
+
+# Флаппинг ботов: перезапуски в цикле и повторяющаяся недоступность
+BOTS_FLAPS = FlapDetector(lambda: BOTS_MONITOR.get("flap"), lambda: BOTS_MONITOR.get("interval", 0))
+
+# Сводка о флаппинге / стабилизации ботов одним сообщением
+async def bots__send_flap_message(bot_names: list[str], kind: str):
+    logger = logging.getLogger("global_monitoring")
+    try:
+        if kind == "flapping":
+            header = "🔁 *Боты флапают \\(перезапуски/недоступность\\):*"
+            footer = "\n\nУведомления по ним приостановлены до стабилизации"
+        else:
+            header = "✅ *Боты стабилизировались:*"
+            footer = ""
+        lines = []
+        for bot_name in bot_names:
+            sid = BOTS_REGISTRY["bot_to_server"].get(bot_name)
+            srv_name = SERVERS[sid]["name"] if sid in SERVERS else "—"
+            suffix = f" — {BOTS_FLAPS.count(bot_name)} событий" if kind == "flapping" else ""
+            lines.append(f"• `{escape_cached(bot_name)}` — {escape_cached(srv_name)}{escape_markdown(suffix)}")
+        msg = header + "\n\n" + "\n".join(lines) + footer
+
+        b = bot
+        if b is None:
+            logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+            return
+        await _deliver(msg, "bots", severity="warning" if kind == "flapping" else "info")
+    except Exception as e:
+        logger.error(f"bots__send_flap_message failed -> {e}")
+
 # Анализ полученных данных и обновление BOTS_STATE
 async def bots__analyzer(server_id, data):
     logger = logging.getLogger(server_id)
-
-    def _parse_uptime_tuple(uptime_str: str):
-        try:
-            m_part, d_part, t_part = uptime_str.strip().split()
-            months = int(m_part[:-1])
-            days = int(d_part[:-1])
-            h, mi, se = map(int, t_part.split(":"))
-            return (months, days, h, mi, se)
-        except Exception:
-            return (0, 0, 0, 0, 0)
+    # Допуск (сек.) на расхождение вычисленного времени старта между сэмплами
+    tolerance = float(BOTS_MONITOR.get("restart_tolerance", 120))
     try:
         if not data:
             logger.warning(f"[{server_id}] bots__analyzer: пустые данные")
@@ -176,41 +556,37 @@ async def bots__analyzer(server_id, data):
 
         notify = False
         bots_to_notify = []
+        sample_ts = time.time()
 
-        # Получаем только ботов для текущего сервера
-        bots_cfg = BOTS_MONITOR["bots"].get(server_id, {})
+        # Индекс порт → бот только для текущего сервера
+        port_to_bot = BOTS_REGISTRY["port_to_bot"].get(server_id, {})
         # проходим по всем ботам, которые пришли с сервера
         for port, bot_info in data.items():
             try:
-                success = bool(bot_info.get("success"))
-                version = str(bot_info.get("version", "")).strip()
-                uptime  = str(bot_info.get("uptime", "")).strip()
-
-                # ищем имя бота по порту только внутри bots_cfg
-                bot_name = None
-                for name, p in bots_cfg.items():
-                    if str(p) == str(port):
-                        bot_name = name
-                        break
-
+                bot_name = port_to_bot.get(str(port))
                 if not bot_name:
                     logger.warning(f"[{server_id}] неизвестный бот на порту {port}")
                     continue
 
-                prev_state = BOTS_STATE.get(bot_name, {})
-                prev_version = str(prev_state.get("version", "")).strip()
-                prev_uptime  = str(prev_state.get("uptime", "")).strip()
+                success = bool(bot_info.get("success"))
+                version = str(bot_info.get("version", "")).strip()
+                started_at = bots__started_at(bot_info, sample_ts) if success else None
+
+                state = BOTS_STATE[bot_name]
+                prev_version = state["version"]
+                prev_started = state["started_at"]
 
                 # Сбросить флаги перед анализом
-                BOTS_STATE[bot_name]["new_version"] = False
-                BOTS_STATE[bot_name]["restarted"] = False
-
-                # если первый цикл (пустая версия и аптайм) — не уведомляем
-                if prev_version == "" and prev_uptime == "":
-                    BOTS_STATE[bot_name]["success"] = success
-                    BOTS_STATE[bot_name]["version"] = version
-                    BOTS_STATE[bot_name]["uptime"] = uptime
-                    # Флаги уже сброшены выше
+                state["new_version"] = False
+                state["restarted"] = False
+                # transition — смена доступности или перезапуск (событие для детектора флаппинга)
+                state["transition"] = False
+
+                # если первый цикл (ещё нет версии и времени старта) — не уведомляем
+                if prev_version == "" and prev_started is None:
+                    state["success"] = success
+                    state["version"] = version
+                    state["started_at"] = started_at
                     continue
 
                 # анализ условий для уведомления
@@ -219,18 +595,25 @@ async def bots__analyzer(server_id, data):
                     bots_to_notify.append(bot_name)
                 elif version != prev_version:
                     notify = True
-                    BOTS_STATE[bot_name]["new_version"] = True
+                    state["new_version"] = True
                     bots_to_notify.append(bot_name)
-                elif _parse_uptime_tuple(uptime) < _parse_uptime_tuple(prev_uptime):
+                    BOTS_HISTORY[bot_name].append((sample_ts, "version", f"{prev_version or '—'} → {version}"))
+                elif started_at is not None and prev_started is not None and started_at - prev_started > tolerance:
                     notify = True
-                    BOTS_STATE[bot_name]["restarted"] = True
+                    state["restarted"] = True
                     bots_to_notify.append(bot_name)
+                    BOTS_HISTORY[bot_name].append(
+                        (sample_ts, "restart", f"после {bots__format_uptime(started_at - prev_started)} работы")
+                    )
 
-                # обновляем текущее состояние, включая флаги
-                BOTS_STATE[bot_name]["success"] = success
-                BOTS_STATE[bot_name]["version"] = version
-                BOTS_STATE[bot_name]["uptime"] = uptime
-                # Флаги new_version и restarted уже выставлены выше
+                if state["restarted"] or (state["success"] is not None and success != state["success"]):
+                    state["transition"] = True
+
+                # обновляем текущее состояние; при недоступности время старта сохраняем прежним
+                state["success"] = success
+                state["version"] = version
+                if started_at is not None:
+                    state["started_at"] = started_at
 
             except Exception as e:
                 logger.error(f"[{server_id}] bots__analyzer: ошибка при обработке бота на порту {port} -> {e}")
@@ -242,41 +625,45 @@ async def bots__analyzer(server_id, data):
         return False, []
 
 # Формирование и отправка сообщения в Telegram (группировка по списку ботов)
-async def bots__send_message(bot_names: list[str], edit_to: tuple[int, int] | None = None):
+# with_history=True — добавить к блоку бота историю перезапусков и смены версий
+async def bots__send_message(bot_names: list[str], edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None, with_history: bool = False):
     logger = logging.getLogger("global_monitoring")
     try:
+        now = time.time()
+        tpl = render.TEMPLATES["bots"]
         parts = []
+        bot_to_server = BOTS_REGISTRY["bot_to_server"]
         for bot_name in bot_names:
             # Определяем сервер для каждого бота
-            sid = None
-            for server_id, bots_cfg in BOTS_MONITOR["bots"].items():
-                if bot_name in bots_cfg:
-                    sid = server_id
-                    break
+            sid = bot_to_server.get(bot_name)
             if sid is None:
                 continue
-            srv_name = escape_markdown(SERVERS[sid]["name"])
+            srv_name = render.server_name(sid)
             state = BOTS_STATE.get(bot_name, {})
             success = state.get("success")
             version = state.get("version", "—")
-            uptime = state.get("uptime", "—")
+            started_at = state.get("started_at")
+            uptime = bots__format_uptime(now - started_at) if started_at else "—"
             new_ver = state.get("new_version", False)
             restarted = state.get("restarted", False)
 
             # Формируем блок сообщения для этого бота
-            bot_lines = [f"*🤖 {escape_markdown(bot_name)} — {srv_name}*"]
-            if not success:
-                bot_lines.append("❌ БОТ НЕДОСТУПЕН ❌")
-            else:
-                bot_lines.append("✅ НОРМА ✅")
-            if new_ver:
-                bot_lines.append(f"⚠️ Версия изменена на `{escape_markdown(version)}`")
-            else:
-                bot_lines.append(f"📦 Версия: `{escape_markdown(version)}`")
-            if restarted:
-                bot_lines.append(f"🆘 Бот был перезапущен\n🕒 Аптайм: `{escape_markdown(uptime)}`")
-            else:
-                bot_lines.append(f"🕒 Аптайм: `{escape_markdown(uptime)}`")
+            bot_lines = [tpl["header"].format(bot=escape_cached(bot_name), name=srv_name)]
+            bot_lines.append(tpl["ok"] if success else tpl["down"])
+            bot_lines.append(tpl["new_version" if new_ver else "version"].format(version=escape_markdown(version)))
+            bot_lines.append(tpl["restarted" if restarted else "uptime"].format(uptime=escape_markdown(uptime)))
+            if with_history:
+                history = BOTS_HISTORY.get(bot_name)
+                if history:
+                    bot_lines.append(tpl["history"])
+                    for ts, kind, detail in reversed(history):
+                        when = datetime.datetime.fromtimestamp(ts).strftime("%d.%m.%Y %H:%M")
+                        icon = "🔄" if kind == "restart" else "📦"
+                        bot_lines.append(tpl["history_item"].format(
+                            icon=icon, when=escape_markdown(when), detail=escape_markdown(detail),
+                        ))
+                else:
+                    bot_lines.append(tpl["no_history"])
             block_msg = "\n".join(bot_lines)
             parts.append(block_msg)
 
@@ -300,15 +687,41 @@ async def bots__send_message(bot_names: list[str], edit_to: tuple[int, int] | No
             except Exception as e:
                 logger.warning(f"edit_message_text failed -> {e}; fallback to send")
 
-        await b.send_message(chat_id=TG_ID, text=msg, parse_mode="MarkdownV2")
+        sids = {bot_to_server.get(name) for name in bot_names}
+        severity = "critical" if any(not BOTS_STATE.get(name, {}).get("success") for name in bot_names) else "warning"
+        await _deliver(msg, "bots", sids.pop() if len(sids) == 1 else None, severity, manual=bool(edit_to or reply_to), reply_to=reply_to)
 
     except Exception as e:
         logger.error(f"bots__send_message failed -> {e}")
 
+# Обычные алерты по ботам с учётом флаппинга. Вердикт по смене состояния выносится в цикле
+# мониторинга (BOTS_STATE[...]["flap"]); повтор того же статуса событием не считается
+async def bots__route_alerts(bot_names: list[str]):
+    logger = logging.getLogger("global_monitoring")
+    to_alert, to_flap = [], []
+    for bot_name in bot_names:
+        verdict = BOTS_STATE[bot_name].pop("flap", None) or BOTS_FLAPS.verdict(bot_name)
+        if verdict == "alert":
+            to_alert.append(bot_name)
+        elif verdict == "flapping":
+            to_flap.append(bot_name)
+        else:
+            logger.info(f"[{bot_name}]: флаппинг, уведомление подавлено")
+    if to_alert:
+        await bots__send_message(to_alert)
+    if to_flap:
+        await bots__send_flap_message(to_flap, "flapping")
+
+def bots__label(bot_name: str) -> str:
+    sid = BOTS_REGISTRY["bot_to_server"].get(bot_name)
+    return f"{bot_name} — {SERVERS[sid]['name']}" if sid in SERVERS else bot_name
+
+BOTS_INCIDENTS = IncidentCorrelator("bots", "Массовая недоступность ботов", bots__label, bots__route_alerts)
+
 # Автоматический мониторинг БОТОВ (циклически)
 async def bots__updates__auto_monitoring(server_id: str):
     logger = logging.getLogger(server_id)
-    bots_cfg = BOTS_MONITOR.get("bots", {}).get(server_id, {})
+    bots_cfg = (BOTS_MONITOR.get("bots") or {}).get(server_id, {})
     if not bots_cfg:
         logger.info(f"[{server_id}] ⚪ Нет ботов для мониторинга, задача остановлена")
         return
@@ -322,15 +735,42 @@ async def bots__updates__auto_monitoring(server_id: str):
                 await asyncio.sleep(interval)
                 continue
             notify, bots_to_notify = await bots__analyzer(server_id, data)
+            for bot_name in bots_cfg:
+                if BOTS_STATE[bot_name].get("transition"):
+                    BOTS_STATE[bot_name]["flap"] = BOTS_FLAPS.record(bot_name)
+            # недоступность — через коррелятор инцидентов, версии/перезапуски — сразу
+            segment = SERVERS[server_id].get("segment", "all")
+            for bot_name in bots_cfg:
+                if BOTS_STATE[bot_name]["success"] and BOTS_INCIDENTS.tracks(bot_name):
+                    await BOTS_INCIDENTS.recovered(bot_name)
             if notify and bots_to_notify:
+                to_alert = []
                 for bot_name in bots_to_notify:
-                    await bots__send_message(server_id, bot_name)
+                    if BOTS_STATE[bot_name]["success"]:
+                        to_alert.append(bot_name)
+                    else:
+                        await BOTS_INCIDENTS.failed(bot_name, segment)
+                if to_alert:
+                    await bots__route_alerts(to_alert)
+            # вердикты по ботам без алерта (например, восстановление): начало флаппинга — сводкой.
+            # Вердикт бота в инциденте разберёт bots__route_alerts по итогам окна
+            flapped = [
+                b for b in bots_cfg
+                if b not in bots_to_notify and not BOTS_INCIDENTS.tracks(b)
+                and BOTS_STATE[b].pop("flap", None) == "flapping"
+            ]
+            if flapped:
+                await bots__send_flap_message(flapped, "flapping")
+            settled = BOTS_FLAPS.settled(targets=bots_cfg)
+            if settled:
+                await bots__send_flap_message(settled, "stable")
             # Логирование состояния всех ботов текущего сервера
             for bot_name in bots_cfg.keys():
                 state = BOTS_STATE.get(bot_name, {})
                 success = state.get("success")
                 version = state.get("version", "")
-                uptime = state.get("uptime", "")
+                started_at = state.get("started_at")
+                uptime = bots__format_uptime(time.time() - started_at) if started_at else "-"
                 msg = f"[{bot_name}]: success={success}, version={version}, uptime={uptime}"
                 if notify:
                     logger.warning(msg)
@@ -341,49 +781,37 @@ async def bots__updates__auto_monitoring(server_id: str):
         await asyncio.sleep(interval)
 
 # Ручной запрос БОТОВ по кнопке (одноразовый)
-async def bots__manual_button(bot_name):
-    server_id = "ALL"
-    if bot_name != "ALL":
-        for sid, bots in BOTS_MONITOR.get("bots", {}).items():
-            if bot_name in bots:
-                server_id = sid
-                break
+async def bots__manual_button(bot_name, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
+    bot_to_server = BOTS_REGISTRY["bot_to_server"]
+    server_id = "ALL" if bot_name == "ALL" else bot_to_server.get(bot_name, "ALL")
 
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
-        try:
-            b = bot
-            if b is None:
-                logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+        if edit_to is None:
+            try:
+                b = bot
+                if b is None:
+                    logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+                    edit_to = None
+                else:
+                    placeholder = await b.send_message(
+                        **_reply_chat(reply_to),
+                        text="⏳ Ожидание данных",
+                        parse_mode="MarkdownV2",
+                    )
+                    edit_to = (placeholder.chat.id, placeholder.message_id)
+            except Exception as e:
+                logger.warning(f"bots__manual_button: placeholder send failed -> {e}")
                 edit_to = None
-            else:
-                placeholder = await b.send_message(
-                    chat_id=TG_ID,
-                    text="⏳ Ожидание данных",
-                    parse_mode="MarkdownV2",
-                )
-                edit_to = (placeholder.chat.id, placeholder.message_id)
-        except Exception as e:
-            logger.warning(f"bots__manual_button: placeholder send failed -> {e}")
-            edit_to = None
 
         # ===== все боты =====
         if bot_name == "ALL":
-            bot_names = []
-            for bots in BOTS_MONITOR["bots"].values():
-                bot_names.extend(bots.keys())
+            bot_names = list(BOTS_REGISTRY["order"])
         # ===== один бот =====
         else:
-            bot_names = [bot_name]
-        bot_names = list(set(bot_names))
+            bot_names = [bot_name] if bot_name in bot_to_server else []
 
-        servers_to_update = set()
-        bot_to_server = {}
-        for sid, bots in BOTS_MONITOR["bots"].items():
-            for bname in bots.keys():
-                if bname in bot_names:
-                    servers_to_update.add(sid)
-                    bot_to_server[bname] = sid
+        servers_to_update = {bot_to_server[bname] for bname in bot_names}
 
         any_data = False
         for sid in servers_to_update:
@@ -399,14 +827,64 @@ async def bots__manual_button(bot_name):
             return
 
         # После обновления состояний отправляем одно сообщение по всем bot_names
-        await bots__send_message(bot_names, edit_to=edit_to)
+        await bots__send_message(bot_names, edit_to=edit_to, reply_to=reply_to, with_history=(bot_name != "ALL"))
 
     except Exception as e:
         logger.error(f"[{server_id}] bots__manual_button failed -> {e}")
 
+# ===== Доступность агентов =====
+# Агент считается недоступным после fail_after подряд неудачных опросов CPU/RAM
+# (CORRELATION["agents"]["fail_after"], по умолчанию 2)
+AGENTS_STATE = LazyState(lambda: {"failures": 0, "down": False})
+
+async def agents__send_message(server_ids: list[str], is_ok: bool):
+    logger = logging.getLogger("global_monitoring")
+    try:
+        tpl = render.TEMPLATES["agents"]
+        header = tpl["up"] if is_ok else tpl["down"]
+        lines = [tpl["item"].format(name=render.server_name(sid)) for sid in server_ids if sid in SERVERS]
+        if not lines:
+            return
+        b = bot
+        if b is None:
+            logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+            return
+        sid = server_ids[0] if len(server_ids) == 1 else None
+        await _deliver(header + "\n\n" + "\n".join(lines), "agents", sid, "info" if is_ok else "critical")
+    except Exception as e:
+        logger.error(f"agents__send_message failed -> {e}")
+
+async def agents__alert_down(server_ids: list[str]):
+    await agents__send_message(server_ids, is_ok=False)
+
+AGENTS_INCIDENTS = IncidentCorrelator(
+    "agents", "Массовая недоступность агентов",
+    lambda sid: SERVERS[sid]["name"] if sid in SERVERS else sid,
+    agents__alert_down,
+)
+
+# Результат очередного опроса агента
+async def agents__report(server_id: str, ok: bool):
+    st = AGENTS_STATE[server_id]
+    if ok:
+        st["failures"] = 0
+        if st["down"]:
+            st["down"] = False
+            if not await AGENTS_INCIDENTS.recovered(server_id):
+                await agents__send_message([server_id], is_ok=True)
+        return
+
+    st["failures"] += 1
+    cfg = getattr(config, "CORRELATION", {}) or {}
+    fail_after = int((cfg.get("agents") or {}).get("fail_after", 2))
+    if not st["down"] and st["failures"] >= fail_after:
+        st["down"] = True
+        logging.getLogger(server_id).warning(f"AGENT: не отвечает ({st['failures']} опросов подряд)")
+        await AGENTS_INCIDENTS.failed(server_id, SERVERS[server_id].get("segment", "all"))
+
 # ===== CPU/RAM =====
 # Глобальное состояние CPU/RAM для всех серверов
-CPU_STATE = {sid: {"status": "NORMAL", "level": 0} for sid in SERVERS}
+CPU_STATE = LazyState(lambda: {"status": "NORMAL", "level": 0})
 
 # Маппинг статуса → ключа интервала и метки для сообщения
 STATUS = {
@@ -418,22 +896,52 @@ STATUS = {
 # Запрос данных о CPU/RAM с API сервера
 async def cpu_ram__fetch_data(server_id):
     logger = logging.getLogger(server_id)
-    srv = SERVERS[server_id]
-    url = f"http://{srv['ip']}:{srv['monitoring_port']}/cpu_ram?token={srv['token']}"
-    timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    logger.warning(f"[{server_id}] ❌ Неверный статус ответа для CPU/RAM: {resp.status}")
+        async with agent_api.session() as session:
+            status, data = await agent_api.get_json(session, server_id, "/cpu_ram")
+            if status == 200:
+                return data
+            else:
+                logger.warning(f"[{server_id}] ❌ Неверный статус ответа для CPU/RAM: {status}")
     except Exception as e:
         logger.error(f"[{server_id}] ❌ Ошибка при запросе CPU/RAM: {e}")
 
     return None
 
+# Параметры окна оценки CPU/RAM из SERVERS[sid]["cpu_ram"]["window"]:
+#   {"mode": "n_of_m", "n": 4, "m": 4}          → ALARM, если n из последних m сэмплов выше верхнего порога
+#   {"mode": "ewma", "alpha": 0.3}              → сравнение с порогами экспоненциального среднего
+#   {"mode": "percentile", "p": 90, "size": 10} → сравнение с перцентилем по окну
+# Без настройки — n_of_m 4/4 (прежнее поведение: 4 критических сэмпла подряд).
+# (server_id, mode) с неизвестным режимом окна, о которых уже предупредили
+_WINDOW_MODE_WARNED: set[tuple[str, str]] = set()
+
+def cpu_ram__window_cfg(server_id) -> dict:
+    window = dict(SERVERS[server_id]["cpu_ram"].get("window") or {})
+    mode = window.get("mode", "n_of_m")
+    if mode not in ("n_of_m", "ewma", "percentile"):
+        # стартовый конфиг не проходит validate() — падаем на режим по умолчанию
+        if (server_id, mode) not in _WINDOW_MODE_WARNED:
+            _WINDOW_MODE_WARNED.add((server_id, mode))
+            logging.getLogger(server_id).warning(f"cpu_ram.window: неизвестный mode {mode!r}, используется n_of_m")
+        mode = "n_of_m"
+    if mode == "n_of_m":
+        m = max(1, int(window.get("m", 4)))
+        window.update(mode=mode, m=m, n=min(m, max(1, int(window.get("n", m)))), size=m)
+    elif mode == "ewma":
+        window.update(mode=mode, alpha=min(1.0, max(0.01, float(window.get("alpha", 0.3)))), size=1)
+    elif mode == "percentile":
+        window.update(mode=mode, p=min(100.0, max(0.0, float(window.get("p", 90)))), size=max(1, int(window.get("size", 10))))
+    return window
+
+def _percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
 # Анализ полученных данных и обновление CPU_STATE
 async def cpu_ram__analizer(server_id, data):
     logger = logging.getLogger(server_id)
@@ -443,7 +951,6 @@ async def cpu_ram__analizer(server_id, data):
 
     st = CPU_STATE[server_id]
     status = st["status"]
-    level = st["level"]
 
     try:
         if not data:
@@ -456,40 +963,59 @@ async def cpu_ram__analizer(server_id, data):
         hi_cpu, lo_cpu = cfg["cpu_high"], cfg["cpu_low"]
         hi_ram, lo_ram = cfg["ram_high"], cfg["ram_low"]
 
-        in_critical = (cpu > hi_cpu) or (ram > hi_ram)
-        in_warning  = ((lo_cpu < cpu < hi_cpu) or (lo_ram < ram < hi_ram))
-        in_normal   = (cpu < lo_cpu) and (ram < lo_ram)
-
-        notify = False
+        window = cpu_ram__window_cfg(server_id)
+        # окно пересоздаётся, если сменился его размер или режим (например, после /reload)
+        if st.get("window_key") != (window["mode"], window["size"]):
+            st["window_key"] = (window["mode"], window["size"])
+            st["cpu_buf"] = RingBuffer(window["size"])
+            st["ram_buf"] = RingBuffer(window["size"])
+            st["crit_buf"] = RingBuffer(window["size"])
+            st["ewma"] = None
+        st["cpu_buf"].push(cpu)
+        st["ram_buf"].push(ram)
+        st["crit_buf"].push(1.0 if (cpu >= hi_cpu or ram >= hi_ram) else 0.0)
+
+        # агрегированные значения по окну
+        if window["mode"] == "ewma":
+            alpha = window["alpha"]
+            prev = st["ewma"]
+            agg_cpu, agg_ram = (cpu, ram) if prev is None else (
+                alpha * cpu + (1 - alpha) * prev[0],
+                alpha * ram + (1 - alpha) * prev[1],
+            )
+            st["ewma"] = (agg_cpu, agg_ram)
+        elif window["mode"] == "percentile":
+            agg_cpu = _percentile(st["cpu_buf"].values(), window["p"])
+            agg_ram = _percentile(st["ram_buf"].values(), window["p"])
+        else:
+            agg_cpu, agg_ram = cpu, ram
 
-        if in_critical:
-            if status != "ALARM":
-                level += 1
-                # logger.debug(f"[{srv['name']}] critical sample #{level} (cpu={cpu:.1f} ram={ram:.1f})")
-                if level >= 4:
-                    st["status"] = "ALARM"
-                    level = 0
-                    notify = True
-                else:
-                    st["status"] = "WARNING"
-            else:
-                st["status"] = "ALARM"
-                level = 0
+        level = int(sum(st["crit_buf"].values()))
+        if window["mode"] == "n_of_m":
+            enter_alarm = level >= window["n"]
+        else:
+            enter_alarm = agg_cpu >= hi_cpu or agg_ram >= hi_ram
+        below_low = agg_cpu < lo_cpu and agg_ram < lo_ram
 
-        elif in_warning:
-            st["status"] = "WARNING"
-            level = 0
+        notify = False
 
-        elif in_normal:
-            st["status"] = "NORMAL"
-            if status == "ALARM":
+        if status == "ALARM":
+            # выход из ALARM только ниже нижних порогов (гистерезис)
+            if below_low:
+                st["status"] = "NORMAL"
                 notify = True
-            level = 0
+        elif enter_alarm:
+            st["status"] = "ALARM"
+            notify = True
+        elif below_low and level == 0:
+            st["status"] = "NORMAL"
+        else:
+            st["status"] = "WARNING"
 
         st["level"] = level
+        st["agg"] = (agg_cpu, agg_ram)
         interval = intervals[STATUS[st["status"]]["interval_key"]]
 
-        # logger.info(f"[{srv['name']}] status={st['status']} level={level} cpu={cpu:.1f}% ram={ram:.1f}% -> interval={interval}s notify={notify}")
         return interval, notify
     
     except Exception as e:
@@ -498,51 +1024,30 @@ async def cpu_ram__analizer(server_id, data):
         return interval, False
 
 # Формирование и отправка сообщения в Telegram
-async def cpu_ram__send_message(data_by_server, edit_to: tuple[int, int] | None = None):
+async def cpu_ram__send_message(data_by_server, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring")
     try:
         if not data_by_server:
             logger.error("cpu_ram__send_message: empty data")
             return
 
+        # один сервер — подробный блок, несколько — по строке на сервер
+        template = render.TEMPLATES["cpu_ram"]["single" if len(data_by_server) == 1 else "row"]
         parts = []
-        prepared = []
 
         for sid, sdata in data_by_server.items():
-            srv   = SERVERS[sid]
-            name  = escape_markdown(srv["name"])
-            st    = CPU_STATE[sid]["status"]
-            label = STATUS[st]["label"]
-
-            cpu   = sdata["cpu"]
-            ram   = sdata["ram"]
-            load  = sdata.get("load") or {}
-
-            cpu_val = escape_markdown(f"{cpu:.1f}%")
-            ram_val = escape_markdown(f"{ram:.1f}%")
-            l1  = escape_markdown(f"{load['1min']:.2f}")
-            l5  = escape_markdown(f"{load['5min']:.2f}")
-            l15 = escape_markdown(f"{load['15min']:.2f}")
-
-            prepared.append((name, label, cpu_val, ram_val, l1, l5, l15))
-
-        if len(prepared) == 1:
-            name, label, cpu_val, ram_val, l1, l5, l15 = prepared[0]
-            msg = (
-                f"*{name}*\n"
-                f"{label}\n\n"
-                f"🖥 *CPU*: `{cpu_val} %`\n"
-                f"💻 *RAM*: `{ram_val} %`\n"
-                f"📈 *Load Avg*: `{l1}`, `{l5}`, `{l15}`"
-            )
-        else:
-            for (name, label, cpu_val, ram_val, l1, l5, l15) in prepared:
-                parts.append(
-                    f"*{name}*\n"
-                    f"{label}\n"
-                    f"🖥 CPU: `{cpu_val} %` \\| 💻 RAM: `{ram_val} %` \\| 📈 Load: `{l1}`, `{l5}`, `{l15}`"
-                )
-            msg = "\n\n".join(parts)
+            load = sdata.get("load") or {}
+            parts.append(template.format(
+                name=render.server_name(sid),
+                label=STATUS[CPU_STATE[sid]["status"]]["label"],
+                cpu=escape_markdown(f"{sdata['cpu']:.1f}%"),
+                ram=escape_markdown(f"{sdata['ram']:.1f}%"),
+                l1=escape_markdown(f"{load['1min']:.2f}"),
+                l5=escape_markdown(f"{load['5min']:.2f}"),
+                l15=escape_markdown(f"{load['15min']:.2f}"),
+            ))
+
+        msg = "\n\n".join(parts)
 
         b = bot
         if b is None:
@@ -561,44 +1066,62 @@ async def cpu_ram__send_message(data_by_server, edit_to: tuple[int, int] | None
             except Exception as e:
                 logger.warning(f"edit_message_text failed -> {e}; fallback to send")
 
-        await b.send_message(chat_id=TG_ID, text=msg, parse_mode="MarkdownV2")
+        statuses = {CPU_STATE[sid]["status"] for sid in data_by_server}
+        severity = "critical" if "ALARM" in statuses else "warning" if "WARNING" in statuses else "info"
+        sid = next(iter(data_by_server)) if len(data_by_server) == 1 else None
+        await _deliver(msg, "cpu_ram", sid, severity, manual=bool(edit_to or reply_to), reply_to=reply_to)
 
     except Exception as e:
         logger.error(f"cpu_ram__send_message failed -> {e}")
 
+# Обработка одного сэмпла CPU/RAM (из опроса или из стрима)
+async def cpu_ram__process_sample(server_id, data):
+    logger = logging.getLogger(server_id)
+    interval, notify = await cpu_ram__analizer(server_id, data)
+    if notify and data:
+        await cpu_ram__send_message({server_id: data})
+
+    st = CPU_STATE[server_id]
+    cpu  = float(data.get("cpu", float("nan")))
+    ram  = float(data.get("ram", float("nan")))
+    load = data.get("load") or {}
+    l1   = float(load.get("1min", float("nan")))
+    l5   = float(load.get("5min", float("nan")))
+    l15  = float(load.get("15min", float("nan")))
+
+    log_line = (
+        f"CPU-RAM: cpu={cpu:.1f} ram={ram:.1f} "
+        f"l1={l1:.2f} l5={l5:.2f} l15={l15:.2f} "
+        f"status={st['status']} level={st['level']} interval={interval}"
+    )
+    agg = st.get("agg")
+    if agg:
+        log_line += f" agg_cpu={agg[0]:.1f} agg_ram={agg[1]:.1f}"
+
+    if st["status"] == "NORMAL":
+        logger.info(log_line)
+    else:
+        logger.warning(log_line)
+    return interval
+
 # Автоматический мониторинг CPU/RAM (циклически)
 async def cpu_ram__auto_monitoring(server_id):
     logger = logging.getLogger(server_id)
     while True:
         try:
+            interval = SERVERS[server_id]["cpu_ram"]["interval"][STATUS[CPU_STATE[server_id]["status"]]["interval_key"]]
+            # Пока живой стрим присылает сэмплы CPU/RAM — опрос не нужен
+            if stream__is_live(server_id, "cpu_ram"):
+                await asyncio.sleep(interval)
+                continue
+
             data = await cpu_ram__fetch_data(server_id)
+            await agents__report(server_id, data is not None)
             if data is None:
                 logger.warning("CPU-RAM: нет данных (fetch failed)")
-                interval = SERVERS[server_id]["cpu_ram"]["interval"][STATUS[CPU_STATE[server_id]["status"]]["interval_key"]]
                 await asyncio.sleep(interval)
                 continue
-            interval, notify = await cpu_ram__analizer(server_id, data)
-            if notify and data:
-                await cpu_ram__send_message({server_id: data})
-
-            st = CPU_STATE[server_id]
-            cpu  = float(data.get("cpu", float("nan")))
-            ram  = float(data.get("ram", float("nan")))
-            load = data.get("load") or {}
-            l1   = float(load.get("1min", float("nan")))
-            l5   = float(load.get("5min", float("nan")))
-            l15  = float(load.get("15min", float("nan")))
-
-            log_line = (
-                f"CPU-RAM: cpu={cpu:.1f} ram={ram:.1f} "
-                f"l1={l1:.2f} l5={l5:.2f} l15={l15:.2f} "
-                f"status={st['status']} level={st['level']} interval={interval}"
-            )
-
-            if st["status"] == "NORMAL":
-                logger.info(log_line)
-            else:
-                logger.warning(log_line)
+            interval = await cpu_ram__process_sample(server_id, data)
 
         except Exception as e:
             logger.error(f"[{server_id}] cpu_ram__auto_monitoring failed -> {e}")
@@ -606,19 +1129,20 @@ async def cpu_ram__auto_monitoring(server_id):
         await asyncio.sleep(interval)
 
 # Ручной запрос CPU/RAM по кнопке (одноразовый)
-async def cpu_ram__manual_button(server_id):
+async def cpu_ram__manual_button(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
-        try:
-            placeholder = await bot.send_message(
-                chat_id=TG_ID,
-                text="⏳ Ожидание данных",
-                parse_mode="MarkdownV2",
-            )
-            edit_to = (placeholder.chat.id, placeholder.message_id)
-        except Exception as e:
-            logger.warning(f"cpu_ram__manual_button: placeholder send failed -> {e}")
-            edit_to = None
+        if edit_to is None:
+            try:
+                placeholder = await bot.send_message(
+                    **_reply_chat(reply_to),
+                    text="⏳ Ожидание данных",
+                    parse_mode="MarkdownV2",
+                )
+                edit_to = (placeholder.chat.id, placeholder.message_id)
+            except Exception as e:
+                logger.warning(f"cpu_ram__manual_button: placeholder send failed -> {e}")
+                edit_to = None
 
         # ===== все сервера =====
         if server_id == "ALL":
@@ -630,7 +1154,7 @@ async def cpu_ram__manual_button(server_id):
                 else:
                     logger.warning(f"[{sid}] ❌ Не удалось получить CPU/RAM для ручного запроса")
             if data_map:
-                await cpu_ram__send_message(data_map, edit_to=edit_to)
+                await cpu_ram__send_message(data_map, edit_to=edit_to, reply_to=reply_to)
             else:
                 logger.warning("❌ Ручной запрос CPU/RAM: ни по одному серверу данных нет")
             return
@@ -638,7 +1162,7 @@ async def cpu_ram__manual_button(server_id):
         # ===== один сервер =====
         data = await cpu_ram__fetch_data(server_id)
         if data:
-            await cpu_ram__send_message({server_id: data}, edit_to=edit_to)
+            await cpu_ram__send_message({server_id: data}, edit_to=edit_to, reply_to=reply_to)
         else:
             logger.warning(f"[{server_id}] ❌ Ручной запрос CPU/RAM: данных нет")
 
@@ -646,29 +1170,73 @@ async def cpu_ram__manual_button(server_id):
         logger.error(f"[{server_id}] cpu_ram__manual_button failed -> {e}")
 
 # ===== SSD =====
-# Глобальное состояние DISK для всех серверов
-DISK_STATE = {sid: {"alert": False} for sid in SERVERS}
+# Глобальное состояние DISK для всех серверов:
+#   alert  — есть ли проблема хотя бы по одной точке монтирования
+#   mounts — mount → {"alert", "reason", "eta", "history": deque[(ts, percent)]}
+#   gone   — точки монтирования с тревогой, пропавшие из последнего ответа агента
+DISK_STATE = LazyState(lambda: {"alert": False, "mounts": {}, "gone": []})
+
+# Точек в истории на окно history_hours: чаще одной точки в window/DISK_HISTORY_POINTS не пишем
+# (стрим и короткие интервалы не раздувают историю и O(n²) оценку наклона)
+DISK_HISTORY_POINTS = 120
+
+# Приведение ответа агента к виду {mount: {"percent", "inodes", "total_gb"}}.
+# Новый формат: {"mounts": [{"mount", "percent", "inodes_percent", "total_gb"}, ...]},
+# старый: {"disk_percent": N} → одна точка "/"
+def disk__normalize(server_id, payload) -> dict:
+    mounts = {}
+    for item in payload.get("mounts") or []:
+        mount = str(item.get("mount", "")).strip()
+        if not mount or item.get("percent") is None:
+            continue
+        inodes = item.get("inodes_percent")
+        mounts[mount] = {
+            "percent": float(item["percent"]),
+            "inodes": float(inodes) if inodes is not None else None,
+            "total_gb": item.get("total_gb"),
+        }
+    if not mounts and payload.get("disk_percent") is not None:
+        mounts["/"] = {
+            "percent": float(payload["disk_percent"]),
+            "inodes": None,
+            "total_gb": SERVERS[server_id]["disk"].get("total_gb"),
+        }
+    return mounts
 
 # Запрос данных о DISK с API сервера
 async def disk__fetch_data(server_id):
     logger = logging.getLogger(server_id)
-    srv = SERVERS[server_id]
-    url = f"http://{srv['ip']}:{srv['monitoring_port']}/disk?token={srv['token']}"
-    timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return float(data["disk_percent"])
-                else:
-                    logger.warning(f"[{server_id}] ❌ Неверный статус ответа для DISK: {resp.status}")
+        async with agent_api.session() as session:
+            status, data = await agent_api.get_json(session, server_id, "/disk")
+            if status == 200:
+                return disk__normalize(server_id, data) or None
+            else:
+                logger.warning(f"[{server_id}] ❌ Неверный статус ответа для DISK: {status}")
     except Exception as e:
         logger.error(f"[{server_id}] ❌ Ошибка при запросе DISK: {e}")
 
     return None
 
+# Робастная оценка скорости роста (Тейл — Сен: медиана попарных наклонов), %/сек.
+# Оценка только когда история покрывает не меньше min_span секунд: наклон за несколько
+# минут не экстраполируется на горизонт прогноза
+def disk__growth_rate(history, min_span: float = 0.0) -> float | None:
+    points = list(history)
+    if len(points) < 4 or points[-1][0] - points[0][0] < min_span:
+        return None
+    slopes = sorted(
+        (p2 - p1) / (t2 - t1)
+        for i, (t1, p1) in enumerate(points)
+        for (t2, p2) in points[i + 1:]
+        if t2 > t1
+    )
+    if not slopes:
+        return None
+    mid = len(slopes) // 2
+    return slopes[mid] if len(slopes) % 2 else (slopes[mid - 1] + slopes[mid]) / 2
+
 # Анализ полученных данных и обновление DISK_STATE
 async def disk__analyzer(server_id, data):
     logger = logging.getLogger(server_id)
@@ -676,65 +1244,116 @@ async def disk__analyzer(server_id, data):
         if data is None:
             return False
 
-        usage = float(data)
-
-        threshold = SERVERS[server_id]["disk"]["threshold"]
-        alert = DISK_STATE[server_id]["alert"]
-
-        if usage > threshold and not alert:
-            DISK_STATE[server_id]["alert"] = True
-            return True
-
-        if usage < threshold and alert:
-            DISK_STATE[server_id]["alert"] = False
-            return True
+        cfg = SERVERS[server_id]["disk"]
+        threshold = cfg["threshold"]
+        inodes_threshold = cfg.get("inodes_threshold", threshold)
+        horizon = float(cfg.get("predict_horizon_hours", 24)) * 3600
+        # окно истории — по времени, а не по числу сэмплов (не зависит от интервала опроса)
+        history_window = max(0.1, float(cfg.get("history_hours", 6))) * 3600
+        step = history_window / DISK_HISTORY_POINTS
+        now = time.time()
+
+        state = DISK_STATE[server_id]
+        mounts_state = state["mounts"]
+        state["gone"] = []
+        changed = False
 
-        return False
+        for mount, info in data.items():
+            mst = mounts_state.get(mount)
+            if mst is None:
+                mst = mounts_state[mount] = {"alert": False, "reason": "", "eta": None, "history": deque()}
+            usage = info["percent"]
+            inodes = info.get("inodes")
+            history = mst["history"]
+            if not history or now - history[-1][0] >= step:
+                history.append((now, usage))
+            while history and history[0][0] < now - history_window:
+                history.popleft()
+
+            rate = disk__growth_rate(history, min_span=history_window / 2)
+            mst["eta"] = (100.0 - usage) / rate if rate and rate > 0 and usage < 100 else None
+
+            # причины тревоги; прогноз гасится с запасом 25%, чтобы не дребезжать на границе горизонта
+            reasons = []
+            if usage > threshold or (mst["alert"] and "порог" in mst["reason"] and usage >= threshold):
+                reasons.append("порог")
+            if inodes is not None and inodes > inodes_threshold:
+                reasons.append("inodes")
+            eta_limit = horizon * (1.25 if "прогноз" in mst["reason"] else 1.0)
+            if mst["eta"] is not None and mst["eta"] < eta_limit:
+                reasons.append("прогноз")
+
+            alert = bool(reasons)
+            if alert != mst["alert"]:
+                changed = True
+            mst["alert"] = alert
+            mst["reason"] = ", ".join(reasons)
+
+        # точки монтирования, пропавшие из ответа агента; тревога по ним снимается с уведомлением
+        for mount in [m for m in mounts_state if m not in data]:
+            if mounts_state[mount]["alert"]:
+                state["gone"].append(mount)
+                changed = True
+            del mounts_state[mount]
+
+        state["alert"] = any(m["alert"] for m in mounts_state.values())
+        return changed
 
     except Exception as e:
         logger.error(f"[{server_id}] disk__analyzer failed -> {e}")
         return False
 
+def disk__format_eta(seconds: float) -> str:
+    hours, rem = divmod(int(seconds), 3600)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {rem // 60} мин"
+    return f"{rem // 60} мин"
+
+# Блок сервера: состояние и строки по точкам монтирования (данные последнего опроса)
+def disk__render_block(sid, mounts: dict, variant: str) -> str:
+    tpl = render.TEMPLATES["disk"]
+    mounts_state = DISK_STATE[sid]["mounts"]
+    lines = []
+    for mount, info in mounts.items():
+        usage = info["percent"]
+        total = info.get("total_gb")
+        usage_val = escape_markdown(f"{usage:.1f}%")
+        label = tpl["root"] if list(mounts) == ["/"] else tpl["mount"].format(mount=escape_markdown(mount))
+        if total:
+            used_val = escape_markdown(f"{total * usage / 100.0:.1f}/{total} ГБ")
+            line = tpl["usage_total"].format(label=label, used=used_val, usage=usage_val)
+        else:
+            line = tpl["usage"].format(label=label, usage=usage_val)
+        if info.get("inodes") is not None:
+            line += tpl["inodes"].format(inodes=escape_markdown(f"{info['inodes']:.1f}%"))
+        mst = mounts_state.get(mount) or {}
+        if mst.get("alert") and mst.get("reason"):
+            line += tpl["reason"].format(reason=escape_markdown(mst["reason"]))
+        if mst.get("eta") is not None:
+            line += tpl["eta"].format(eta=escape_markdown(disk__format_eta(mst["eta"])))
+        lines.append(line)
+    for mount in DISK_STATE[sid].get("gone", []):
+        lines.append(tpl["gone"].format(mount=escape_markdown(mount)))
+
+    return tpl[variant].format(
+        name=render.server_name(sid),
+        state=tpl["alert"] if DISK_STATE[sid]["alert"] else tpl["ok"],
+        lines="\n".join(lines),
+    )
+
 # Формирование и отправка сообщения в Telegram
-async def disk__send_message(data_by_server, edit_to: tuple[int, int] | None = None):
+async def disk__send_message(data_by_server, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring")
     try:
         if not data_by_server:
             logger.error("disk__send_message: empty data")
             return
 
-        parts = []
-        prepared = []
-
-        for sid, data in data_by_server.items():
-            srv   = SERVERS[sid]
-            name  = escape_markdown(srv["name"])
-            total = srv["disk"]["total_gb"]
-            usage = float(data)
-            used  = (total * usage) / 100.0
-            alert = DISK_STATE[sid]["alert"]
-
-            state = "⚠️ *ПРЕВЫШЕНИЕ*" if alert else "✅ *НОРМА*"
-            usage_val = escape_markdown(f"{usage:.1f}%")
-            used_val  = escape_markdown(f"{used:.1f}/{total} ГБ")
-
-            prepared.append((name, state, used_val, usage_val))
-
-        if len(prepared) == 1:
-            name, state, used_val, usage_val = prepared[0]
-            msg = (
-                f"*{name}*\n"
-                f"{state}\n\n"
-                f"💽 Диск: `{used_val}` — `{usage_val}`"
-            )
-        else:
-            for (name, state, used_val, usage_val) in prepared:
-                parts.append(
-                    f"*{name}*\n"
-                    f"{state}\n"
-                    f"💽 Диск: `{used_val}` — `{usage_val}`"
-                )
-            msg = "\n\n".join(parts)
+        variant = "single" if len(data_by_server) == 1 else "row"
+        msg = "\n\n".join(disk__render_block(sid, mounts, variant) for sid, mounts in data_by_server.items())
 
         b = bot
         if b is None:
@@ -753,11 +1372,34 @@ async def disk__send_message(data_by_server, edit_to: tuple[int, int] | None = N
             except Exception as e:
                 logger.warning(f"edit_message_text failed -> {e}; fallback to send")
 
-        await b.send_message(chat_id=TG_ID, text=msg, parse_mode="MarkdownV2")
+        severity = "critical" if any(DISK_STATE[sid]["alert"] for sid in data_by_server) else "info"
+        sid = next(iter(data_by_server)) if len(data_by_server) == 1 else None
+        await _deliver(msg, "disk", sid, severity, manual=bool(edit_to or reply_to), reply_to=reply_to)
 
     except Exception as e:
         logger.error(f"disk__send_message failed -> {e}")
 
+# Обработка одного сэмпла DISK (из опроса или из стрима)
+async def disk__process_sample(server_id, data):
+    logger = logging.getLogger(server_id)
+    notify = await disk__analyzer(server_id, data)
+    if notify:
+        await disk__send_message({server_id: data})
+
+    mounts_state = DISK_STATE[server_id]["mounts"]
+    items = []
+    for mount, info in data.items():
+        item = f"{mount}={info['percent']:.1f}%"
+        eta = (mounts_state.get(mount) or {}).get("eta")
+        if eta is not None:
+            item += f"(eta={eta / 3600:.1f}h)"
+        items.append(item)
+    log_line = "DISK: " + " ".join(items)
+    if DISK_STATE[server_id]["alert"]:
+        logger.warning(log_line)
+    else:
+        logger.info(log_line)
+
 # Автоматический мониторинг DISK (циклически)
 async def disk__auto_monitoring(server_id):
     logger = logging.getLogger(server_id)
@@ -765,41 +1407,39 @@ async def disk__auto_monitoring(server_id):
 
     while True:
         try:
+            # Пока живой стрим присылает сэмплы дисков — опрос не нужен
+            if stream__is_live(server_id, "disk"):
+                await asyncio.sleep(interval)
+                continue
+
             data = await disk__fetch_data(server_id)
             if data is None:
                 logger.warning("DISK: нет данных (fetch failed)")
                 await asyncio.sleep(interval)
                 continue
 
-            notify = await disk__analyzer(server_id, data)
-            if notify:
-                await disk__send_message({server_id: data})
-
-            log_line = f"DISK: usage={data:.1f}%"
-            if DISK_STATE[server_id]["alert"]:
-                logger.warning(log_line)
-            else:
-                logger.info(log_line)
+            await disk__process_sample(server_id, data)
 
         except Exception as e:
             logger.error(f"[{server_id}] disk__auto_monitoring failed -> {e}")
         await asyncio.sleep(interval)
 
 # Ручной запрос DISK по кнопке (одноразовый)
-async def disk__manual_button(server_id):
+async def disk__manual_button(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
         # плейсхолдер "ожидание"
-        try:
-            placeholder = await bot.send_message(
-                chat_id=TG_ID,
-                text="⏳ Ожидание данных",
-                parse_mode="MarkdownV2",
-            )
-            edit_to = (placeholder.chat.id, placeholder.message_id)
-        except Exception as e:
-            logger.warning(f"disk__manual_button: placeholder send failed -> {e}")
-            edit_to = None
+        if edit_to is None:
+            try:
+                placeholder = await bot.send_message(
+                    **_reply_chat(reply_to),
+                    text="⏳ Ожидание данных",
+                    parse_mode="MarkdownV2",
+                )
+                edit_to = (placeholder.chat.id, placeholder.message_id)
+            except Exception as e:
+                logger.warning(f"disk__manual_button: placeholder send failed -> {e}")
+                edit_to = None
 
         # ===== все сервера =====
         if server_id == "ALL":
@@ -811,7 +1451,7 @@ async def disk__manual_button(server_id):
                 else:
                     logger.warning(f"[{sid}] ❌ Не удалось получить данные о диске для ручного запроса")
             if data_map:
-                await disk__send_message(data_map, edit_to=edit_to)
+                await disk__send_message(data_map, edit_to=edit_to, reply_to=reply_to)
             else:
                 logger.warning("❌ Ручной запрос DISK: ни по одному серверу данных нет")
             return
@@ -819,62 +1459,267 @@ async def disk__manual_button(server_id):
         # ===== один сервер =====
         data = await disk__fetch_data(server_id)
         if data is not None:
-            await disk__send_message({server_id: data}, edit_to=edit_to)
+            await disk__send_message({server_id: data}, edit_to=edit_to, reply_to=reply_to)
         else:
             logger.warning(f"[{server_id}] ❌ Ручной запрос DISK: данных нет")
 
     except Exception as e:
         logger.error(f"[{server_id}] disk__manual_button failed -> {e}")
 
+# ===== STREAM (WebSocket) =====
+# Состояние стриминговых подключений к агентам
+# last_msg — время последнего сообщения с данными по каждому топику (ping не считается)
+STREAM_STATE = LazyState(lambda: {"live": False, "last_msg": {}, "samples": {}})
+
+# Живой ли стрим сервера по топику (подключён и недавно присылал данные этого топика)
+def stream__is_live(server_id, topic: str) -> bool:
+    cfg = SERVERS[server_id].get("stream") or {}
+    if not cfg.get("enabled"):
+        return False
+    st = STREAM_STATE[server_id]
+    stale_after = float(cfg.get("stale_after", 60))
+    last_msg = st["last_msg"].get(topic)
+    return st["live"] and last_msg is not None and (time.monotonic() - last_msg) < stale_after
+
+# Обработка одного сообщения стрима: дельта вливается в последний полный сэмпл
+async def stream__handle_message(server_id, payload):
+    logger = logging.getLogger(server_id)
+    st = STREAM_STATE[server_id]
+    if AGENTS_STATE[server_id]["down"]:
+        await agents__report(server_id, True)
+
+    topic = payload.get("topic")
+    data = payload.get("data") or {}
+    if topic not in ("cpu_ram", "disk"):
+        if topic != "ping":
+            logger.warning(f"[{server_id}] STREAM: неизвестный топик {topic!r}")
+        return
+
+    st["last_msg"][topic] = time.monotonic()
+    sample = st["samples"].setdefault(topic, {})
+    if not payload.get("delta"):
+        sample.clear()
+    sample.update(data)
+
+    if topic == "cpu_ram":
+        if "cpu" in sample and "ram" in sample:
+            await cpu_ram__process_sample(server_id, dict(sample))
+    else:
+        mounts = disk__normalize(server_id, sample)
+        if mounts:
+            await disk__process_sample(server_id, mounts)
+
+# Постоянное WebSocket-подключение к агенту с переподключением
+async def stream__auto_monitoring(server_id):
+    logger = logging.getLogger(server_id)
+    srv = SERVERS[server_id]
+    cfg = srv.get("stream") or {}
+    url = f"ws://{srv['ip']}:{srv['monitoring_port']}/stream?token={srv['token']}&topics=cpu_ram,disk"
+    heartbeat = float(cfg.get("heartbeat", 30))
+    backoff_max = float(cfg.get("reconnect_max", 300))
+    backoff = 1.0
+    st = STREAM_STATE[server_id]
+
+    while True:
+        try:
+            timeout = aiohttp.ClientTimeout(connect=10)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.ws_connect(url, heartbeat=heartbeat) as ws:
+                    logger.info(f"[{server_id}] STREAM: подключено")
+                    st["live"] = True
+                    # опрос по топику останавливается только после первых данных по нему
+                    st["last_msg"].clear()
+                    st["samples"].clear()
+                    backoff = 1.0
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            try:
+                                await stream__handle_message(server_id, msg.json())
+                            except Exception as e:
+                                logger.error(f"[{server_id}] STREAM: ошибка обработки сообщения -> {e}")
+                        elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                            break
+            logger.warning(f"[{server_id}] STREAM: соединение закрыто, переход на опрос")
+        except asyncio.CancelledError:
+            st["live"] = False
+            raise
+        except Exception as e:
+            logger.warning(f"[{server_id}] STREAM: ошибка подключения -> {e}; переход на опрос")
+        st["live"] = False
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, backoff_max)
+
+# ===== Детектор майнеров =====
+# Правила из MINERS компилируются один раз (и заново — только если список изменился):
+#   "xmrig"         → точное имя процесса или подстрока в имени/командной строке (xmrig-2, /opt/xmrig ...)
+#   "*miner*"       → glob (* и ? не выходят за пределы одного слова/пути)
+#   "re:^t-rex\d*$" → регулярное выражение
+class MinerMatcher:
+    def __init__(self, rules):
+        self.exact: set[str] = set()
+        self.labels: list[tuple[str, str]] = []
+        patterns = []
+        for rule in rules:
+            rule = str(rule).strip()
+            if not rule:
+                continue
+            if rule.lower().startswith("re:"):
+                kind, pattern = "regex", rule[3:]
+            elif any(ch in rule for ch in "*?["):
+                kind, pattern = "glob", self._glob_to_regex(rule.lower())
+            else:
+                kind, pattern = "substring", re.escape(rule.lower())
+                self.exact.add(rule.lower())
+            # правило проверяется в том виде, в каком попадёт в общее выражение
+            wrapped = f"(?P<r{len(self.labels)}>{pattern})"
+            try:
+                reason = self._unsafe(pattern) if kind == "regex" else None
+                if reason:
+                    raise re.error(reason)
+                re.compile(wrapped, re.IGNORECASE)
+            except re.error as e:
+                logging.getLogger("global_monitoring").error(f"MINERS: некорректное правило {rule!r} -> {e}")
+                continue
+            patterns.append(wrapped)
+            self.labels.append((kind, rule))
+
+        self.combined = None
+        self.separate: list[re.Pattern] = []
+        if patterns:
+            try:
+                self.combined = re.compile("|".join(patterns), re.IGNORECASE)
+            except re.error as e:
+                logging.getLogger("global_monitoring").error(f"MINERS: общее выражение не собралось ({e}), проверка по одному правилу")
+                self.separate = [re.compile(p, re.IGNORECASE) for p in patterns]
+
+    # Конструкции, которые ломают или искажают общее выражение
+    _INLINE_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+
+    @classmethod
+    def _unsafe(cls, pattern: str) -> str | None:
+        i = 0
+        while i < len(pattern):
+            ch = pattern[i]
+            if ch == "\\" and i + 1 < len(pattern):
+                nxt = pattern[i + 1]
+                if nxt in "123456789" or nxt == "g":
+                    return "обратные ссылки (\\1, \\g<...>) не поддерживаются"
+                i += 2
+                continue
+            if ch == "(":
+                if cls._INLINE_FLAGS.match(pattern, i):
+                    return "глобальные флаги вида (?i) не поддерживаются: регистр и так не учитывается, для части выражения — (?i:...)"
+                if pattern.startswith(("(?P<", "(?P="), i) or (pattern.startswith("(?<", i) and not pattern.startswith(("(?<=", "(?<!"), i)):
+                    return "именованные группы не поддерживаются"
+            i += 1
+        return None
+
+    @staticmethod
+    def _glob_to_regex(glob: str) -> str:
+        out, i = [], 0
+        while i < len(glob):
+            ch = glob[i]
+            if ch == "*":
+                out.append(r"[^\s/]*")
+            elif ch == "?":
+                out.append(r"[^\s/]")
+            elif ch == "[":
+                end = glob.find("]", i + 1)
+                if end == -1:
+                    out.append(re.escape(ch))
+                else:
+                    out.append("[" + glob[i + 1:end].replace("\\", "\\\\") + "]")
+                    i = end
+            else:
+                out.append(re.escape(ch))
+            i += 1
+        return "".join(out)
+
+    # Причина совпадения (для сообщения) или None
+    def match(self, name: str, cmdline: str = "") -> str | None:
+        low = name.lower()
+        if low in self.exact:
+            return f"имя = {name}"
+        if self.combined is None and not self.separate:
+            return None
+        for field, text in (("имя", name), ("cmdline", cmdline)):
+            if not text:
+                continue
+            for compiled in ([self.combined] if self.combined is not None else self.separate):
+                m = compiled.search(text)
+                if m:
+                    kind, rule = self.labels[int(m.lastgroup[1:])]
+                    return f"{field} ~ {rule} ({kind})"
+        return None
+
+_MINER_MATCHER: MinerMatcher | None = None
+_MINER_RULES: tuple = ()
+
+def miners__matcher() -> MinerMatcher:
+    global _MINER_MATCHER, _MINER_RULES
+    rules = tuple(MINERS)
+    if _MINER_MATCHER is None or rules != _MINER_RULES:
+        _MINER_MATCHER = MinerMatcher(rules)
+        _MINER_RULES = rules
+    return _MINER_MATCHER
+
+# Правила майнеров изменились (/reload): ETag списков процессов сбрасывается, иначе на стабильном
+# хосте ответы 304 не дадут анализатору проверить уже запущенные процессы по новым правилам
+def miners__invalidate():
+    for key in [key for key in agent_api.ETAG_CACHE if key[1] in ("/processes_systemctl", "/processes_pm2")]:
+        agent_api.ETAG_CACHE.pop(key, None)
+
 # ===== PROCESSES =====
 # Глобальное состояние PROCESSES для всех серверов
-PROCESSES_STATE = {sid: {"failed": [], "miners": []} for sid in SERVERS}
+PROCESSES_STATE = LazyState(lambda: {"failed": [], "miners": []})
 
 # Запрос списка запущенных сервисов с API сервера
-async def processes__fetch_data(server_id):
+# skip_unchanged=True → NOT_MODIFIED, если оба списка не изменились с прошлого опроса
+async def processes__fetch_data(server_id, skip_unchanged: bool = False):
     logger = logging.getLogger(server_id)
-    srv = SERVERS[server_id]
-    timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
     results = []
+    statuses = []
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with agent_api.session() as session:
             # ===== systemctl =====
-            url_sys = f"http://{srv['ip']}:{srv['monitoring_port']}/processes_systemctl?token={srv['token']}"
             try:
-                async with session.get(url_sys) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        for svc in data.get("services", []):
-                            name   = str(svc.get("name", "")).strip()
-                            active = str(svc.get("active")).lower()
-                            sub    = str(svc.get("sub")).lower()
-                            state  = "failed" if "failed" in (active, sub) else "ok"
-                            results.append({"name": name, "source": "SCT", "state": state})
-                    else:
-                        logger.warning(f"[{server_id}] ❌ Неверный статус ответа для systemctl: {resp.status}")
+                status, data = await agent_api.get_json(session, server_id, "/processes_systemctl", conditional=True)
+                statuses.append(status)
+                if status in (200, 304):
+                    for svc in data.get("services", []):
+                        name   = str(svc.get("name", "")).strip()
+                        active = str(svc.get("active")).lower()
+                        sub    = str(svc.get("sub")).lower()
+                        state  = "failed" if "failed" in (active, sub) else "ok"
+                        cmd    = str(svc.get("cmdline") or "").strip()
+                        results.append({"name": name, "source": "SCT", "state": state, "cmdline": cmd})
+                else:
+                    logger.warning(f"[{server_id}] ❌ Неверный статус ответа для systemctl: {status}")
             except Exception as e:
                 logger.error(f"[{server_id}] ❌ Ошибка при запросе systemctl -> {e}")
 
             # ===== pm2 =====
-            url_pm2 = f"http://{srv['ip']}:{srv['monitoring_port']}/processes_pm2?token={srv['token']}"
             try:
-                async with session.get(url_pm2) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        for proc in data.get("processes", []):
-                            name   = str(proc.get("name", "")).strip()
-                            status = str(proc.get("status")).lower()
-                            state  = "failed" if status == "failed" else "ok"
-                            results.append({"name": name, "source": "PM2", "state": state})
-                    else:
-                        logger.warning(f"[{server_id}] ❌ Неверный статус ответа для pm2: {resp.status}")
+                status, data = await agent_api.get_json(session, server_id, "/processes_pm2", conditional=True)
+                statuses.append(status)
+                if status in (200, 304):
+                    for proc in data.get("processes", []):
+                        name   = str(proc.get("name", "")).strip()
+                        pm2_st = str(proc.get("status")).lower()
+                        state  = "failed" if pm2_st == "failed" else "ok"
+                        cmd    = str(proc.get("cmdline") or "").strip()
+                        results.append({"name": name, "source": "PM2", "state": state, "cmdline": cmd})
+                else:
+                    logger.warning(f"[{server_id}] ❌ Неверный статус ответа для pm2: {status}")
             except Exception as e:
                 logger.error(f"[{server_id}] ❌ Ошибка при запросе pm2 -> {e}")
 
     except Exception as e:
         logger.error(f"[{server_id}] ❌ processes__fetch_data global error -> {e}")
 
+    if skip_unchanged and statuses == [304, 304]:
+        return agent_api.NOT_MODIFIED
     return results
 
 # Анализ полученных данных и обновление PROCESSES_STATE
@@ -887,26 +1732,19 @@ async def processes__analyzer(server_id, data):
         if not items:
             return False
 
-        # ==== упавшие процессы ====
-        failed = [
-            {
-                "name":   str(it.get("name", "")).strip(),
-                "source": str(it.get("source", "")).upper(),
-            }
-            for it in items
-            if str(it.get("state")).lower() == "failed"
-        ]
-
-        # ==== процессы-майнеры ====
-        miners = [
-            {
-                "name":   str(it.get("name", "")).strip(),
-                "source": str(it.get("source", "")).upper(),
-                "state":  str(it.get("state", "")).lower(),
-            }
-            for it in items
-            if str(it.get("name", "")).lower() in [m.lower() for m in MINERS]
-        ]
+        # ==== упавшие процессы и майнеры — за один проход ====
+        matcher = miners__matcher()
+        failed = []
+        miners = []
+        for it in items:
+            name   = str(it.get("name", "")).strip()
+            source = str(it.get("source", "")).upper()
+            pstate = str(it.get("state", "")).lower()
+            if pstate == "failed":
+                failed.append({"name": name, "source": source})
+            reason = matcher.match(name, str(it.get("cmdline") or ""))
+            if reason:
+                miners.append({"name": name, "source": source, "state": pstate, "reason": reason})
 
         changed = False
 
@@ -924,74 +1762,81 @@ async def processes__analyzer(server_id, data):
             state["miners"] = miners
             changed = True
 
+        if changed:
+            render.touch("processes", server_id)
         return changed
 
     except Exception as e:
         logger.error(f"[{server_id}] processes__analyzer failed -> {e}")
         return False
 
-# Формирование и отправка сообщения в Telegram
-async def processes__send_message(server_id, edit_to: tuple[int, int] | None = None):
-    logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
-    try:
-        targets = SERVERS.keys() if server_id == "ALL" else [server_id]
-        parts = []
+# Блок одного сервера (из PROCESSES_STATE; кэшируется по версии состояния)
+def processes__render_block(sid) -> str:
+    logger = logging.getLogger(sid)
+    tpl   = render.TEMPLATES["processes"]
+    name  = render.server_name(sid)
+    state = PROCESSES_STATE[sid]
+
+    # ---- failed (ожидаем список dict{name,source}) ----
+    failed_raw = state.get("failed", []) or []
+    failed_bkt = {"SCT": [], "PM2": []}
+    for item in failed_raw:
+        if isinstance(item, dict):
+            src   = str(item.get("source", "")).upper().strip()
+            fname = str(item.get("name", "")).strip()
+            if src in failed_bkt:
+                failed_bkt[src].append(f"`{escape_markdown(fname)}`")
+            else:
+                logger.error(f"[{sid}] processes__render_block: unknown failed source '{src}' for '{fname}'")
+        else:
+            logger.error(f"[{sid}] processes__render_block: failed item without source: {item!r}")
+
+    # ---- miners (ожидаем список dict{name,source}) ----
+    miners_raw = state.get("miners", []) or []
+    miners_bkt = {"SCT": [], "PM2": []}
+    for m in miners_raw:
+        src   = str(m.get("source", "")).upper().strip()
+        mname = f"`{escape_markdown(str(m.get('name', '')).strip())}`"
+        if m.get("reason"):
+            mname += f" — _{escape_markdown(m['reason'])}_"
+        if src in miners_bkt:
+            miners_bkt[src].append(mname)
+        else:
+            logger.error(f"[{sid}] processes__render_block: unknown miner source '{src}' for '{mname}'")
 
-        for sid in targets:
-            name  = escape_markdown(SERVERS[sid]["name"])
-            state = PROCESSES_STATE[sid]
-
-            # ---- failed (ожидаем список dict{name,source}) ----
-            failed_raw = state.get("failed", []) or []
-            failed_bkt = {"SCT": [], "PM2": []}
-            for item in failed_raw:
-                if isinstance(item, dict):
-                    src   = str(item.get("source", "")).upper().strip()
-                    fname = str(item.get("name", "")).strip()
-                    if src == "SCT":
-                        failed_bkt["SCT"].append(fname)
-                    elif src == "PM2":
-                        failed_bkt["PM2"].append(fname)
-                    else:
-                        logger.error(f"[{sid}] processes__send_message: unknown failed source '{src}' for '{fname}'")
-                else:
-                    logger.error(f"[{sid}] processes__send_message: failed item without source: {item!r}")
-
-            # ---- miners (ожидаем список dict{name,source}) ----
-            miners_raw = state.get("miners", []) or []
-            miners_bkt = {"SCT": [], "PM2": []}
-            for m in miners_raw:
-                src   = str(m.get("source", "")).upper().strip()
-                mname = escape_markdown(str(m.get("name", "")).strip())
-                if src == "SCT":
-                    miners_bkt["SCT"].append(mname)
-                elif src == "PM2":
-                    miners_bkt["PM2"].append(mname)
-                else:
-                    logger.error(f"[{sid}] processes__send_message: unknown miner source '{src}' for '{mname}'")
+    any_failed = bool(failed_bkt["SCT"] or failed_bkt["PM2"])
+    any_miners = bool(miners_bkt["SCT"] or miners_bkt["PM2"])
 
-            any_failed = bool(failed_bkt["SCT"] or failed_bkt["PM2"])
-            any_miners = bool(miners_bkt["SCT"] or miners_bkt["PM2"])
+    if not any_failed and not any_miners:
+        return tpl["ok"].format(name=name)
 
-            if not any_failed and not any_miners:
-                parts.append(f"*{name}*\n✅ Крашнутых сервисов нет\n⛏️ Майнеры не обнаружены")
-                continue
+    def sources(bkt):
+        return [
+            tpl["source"].format(source=src, items="\n".join(tpl["item"].format(item=i) for i in items))
+            if items else tpl["source_ok"].format(source=src)
+            for src, items in bkt.items()
+        ]
+
+    block = [tpl["header"].format(name=name)]
 
-            block = [f"*{name}*\n"]
+    # ---- Крашнутые ----
+    block.append(tpl["failed"] if any_failed else tpl["no_failed"])
+    if any_failed:
+        block.extend(sources(failed_bkt))
 
-            # ---- Крашнутые ----
-            block.append("❌ *Сервисы с ошибками:*" if any_failed else "✅ Ошибок сервисов не обнаружено")
-            if any_failed:
-                block.append("• SCT:\n" + "\n".join(f"  \\- `{escape_markdown(s)}`" for s in failed_bkt["SCT"]) if failed_bkt["SCT"] else "• SCT: ✅ ок")
-                block.append("• PM2:\n" + "\n".join(f"  \\- `{escape_markdown(s)}`" for s in failed_bkt["PM2"]) if failed_bkt["PM2"] else "• PM2: ✅ ок")
+    # ---- Майнеры ----
+    block.append(tpl["miners"] if any_miners else tpl["no_miners"])
+    if any_miners:
+        block.extend(sources(miners_bkt))
 
-            # ---- Майнеры ----
-            block.append("⛏️ *⚠️ВНИМАНИЕ⚠️: обнаружены майнеры\\!*" if any_miners else "⛏️ Майнеры не обнаружены")
-            if any_miners:
-                block.append("• SCT:\n" + "\n".join(f"  \\- `{s}`" for s in miners_bkt["SCT"]) if miners_bkt["SCT"] else "• SCT: ✅ ок")
-                block.append("• PM2:\n" + "\n".join(f"  \\- `{s}`" for s in miners_bkt["PM2"]) if miners_bkt["PM2"] else "• PM2: ✅ ок")
+    return "\n".join(block)
 
-            parts.append("\n".join(block))
+# Формирование и отправка сообщения в Telegram
+async def processes__send_message(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
+    logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
+    try:
+        targets = SERVERS.keys() if server_id == "ALL" else [server_id]
+        parts = [render.block("processes", sid, processes__render_block) for sid in targets]
 
         msg = "\n\n".join(parts)
         b = bot
@@ -1011,7 +1856,9 @@ async def processes__send_message(server_id, edit_to: tuple[int, int] | None = N
             except Exception as e:
                 logger.warning(f"edit_message_text failed -> {e}; fallback to send")
 
-        await b.send_message(chat_id=TG_ID, text=msg, parse_mode="MarkdownV2")
+        targets = SERVERS.keys() if server_id == "ALL" else [server_id]
+        bad = any(PROCESSES_STATE[sid]["failed"] or PROCESSES_STATE[sid]["miners"] for sid in targets)
+        await _deliver(msg, "processes", server_id, "critical" if bad else "info", manual=bool(edit_to or reply_to), reply_to=reply_to)
 
     except Exception as e:
         logger.error(f"[{server_id}] processes__send_message failed -> {e}")
@@ -1022,11 +1869,15 @@ async def processes__auto_monitoring(server_id):
     interval = int(SERVERS[server_id]["processes"]["interval"])
     while True:
         try:
-            data = await processes__fetch_data(server_id)
+            data = await processes__fetch_data(server_id, skip_unchanged=True)
             if data is None:
                 logger.warning("PROCESSES: нет данных (fetch failed)")
                 await asyncio.sleep(interval)
                 continue
+            if data is agent_api.NOT_MODIFIED:
+                logger.info("PROCESSES: без изменений (304)")
+                await asyncio.sleep(interval)
+                continue
 
             changed = await processes__analyzer(server_id, data)
             if changed:
@@ -1053,7 +1904,7 @@ async def processes__auto_monitoring(server_id):
                 for it in miners_raw:
                     name = str(it.get("name", "")).strip()
                     src  = str(it.get("source", "")).upper().strip()
-                    miners_list.append(f"{name}({src})")
+                    miners_list.append(f"{name}({src}) [{it.get('reason', '')}]")
                 logger.warning("PROCESSES MINERS: " + ", ".join(miners_list))
             else:
                 logger.info("PROCESSES MINERS: none")
@@ -1063,24 +1914,25 @@ async def processes__auto_monitoring(server_id):
         await asyncio.sleep(interval)
 
 # Ручной запрос PROCESSES по кнопке (одноразовый)
-async def processes__manual_button(server_id):
+async def processes__manual_button(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
-        try:
-            b = bot
-            if b is None:
-                logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+        if edit_to is None:
+            try:
+                b = bot
+                if b is None:
+                    logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+                    edit_to = None
+                else:
+                    placeholder = await b.send_message(
+                        **_reply_chat(reply_to),
+                        text="⏳ Ожидание данных",
+                        parse_mode="MarkdownV2",
+                    )
+                    edit_to = (placeholder.chat.id, placeholder.message_id)
+            except Exception as e:
+                logger.warning(f"processes__manual_button: placeholder send failed -> {e}")
                 edit_to = None
-            else:
-                placeholder = await b.send_message(
-                    chat_id=TG_ID,
-                    text="⏳ Ожидание данных",
-                    parse_mode="MarkdownV2",
-                )
-                edit_to = (placeholder.chat.id, placeholder.message_id)
-        except Exception as e:
-            logger.warning(f"processes__manual_button: placeholder send failed -> {e}")
-            edit_to = None
 
         # ===== все сервера =====
         if server_id == "ALL":
@@ -1093,7 +1945,7 @@ async def processes__manual_button(server_id):
                 else:
                     logger.warning(f"[{sid}] ❌ Не удалось получить данные о процессах для ручного запроса")
             if any_data:
-                await processes__send_message("ALL", edit_to=edit_to)
+                await processes__send_message("ALL", edit_to=edit_to, reply_to=reply_to)
             else:
                 logger.warning("❌ Ручной запрос PROCESS: ни по одному серверу данных нет")
             return
@@ -1102,7 +1954,7 @@ async def processes__manual_button(server_id):
         data = await processes__fetch_data(server_id)
         if data is not None:
             await processes__analyzer(server_id, data)
-            await processes__send_message(server_id, edit_to=edit_to)
+            await processes__send_message(server_id, edit_to=edit_to, reply_to=reply_to)
         else:
             logger.warning(f"[{server_id}] ❌ Ручной запрос PROCESS: данных нет")
 
@@ -1111,23 +1963,61 @@ async def processes__manual_button(server_id):
 
 # ===== UPDATES =====
 # Глобальное состояние UPDATES для всех серверов
-UPDATES_STATE = {sid: {"packages": []} for sid in SERVERS}
+#   packages — текущее множество пакетов, added/removed — разница с предыдущим опросом
+UPDATES_STATE = LazyState(lambda: {"packages": set(), "added": set(), "removed": set()})
+
+# Индекс по всему парку: пакет → множество server_id, где он ждёт обновления
+UPDATES_INDEX: dict[str, set[str]] = {}
+_UPDATES_INDEX_SORTED: list[str] | None = None
+
+def updates__index_apply(server_id, added, removed):
+    global _UPDATES_INDEX_SORTED
+    for pkg in added:
+        UPDATES_INDEX.setdefault(pkg, set()).add(server_id)
+    for pkg in removed:
+        servers = UPDATES_INDEX.get(pkg)
+        if servers is not None:
+            servers.discard(server_id)
+            if not servers:
+                del UPDATES_INDEX[pkg]
+    if added or removed:
+        _UPDATES_INDEX_SORTED = None
+
+def updates__forget_server(server_id):
+    state = UPDATES_STATE.pop(server_id, None)
+    if state:
+        updates__index_apply(server_id, (), state["packages"])
+
+# Поиск по индексу: точное совпадение или пакеты с данным префиксом → {пакет: [server_id, ...]}
+def updates__find_package(query: str, limit: int = 20) -> dict[str, list[str]]:
+    global _UPDATES_INDEX_SORTED
+    query = query.strip()
+    if query in UPDATES_INDEX:
+        return {query: sorted(UPDATES_INDEX[query])}
+    if _UPDATES_INDEX_SORTED is None:
+        _UPDATES_INDEX_SORTED = sorted(UPDATES_INDEX)
+    keys = _UPDATES_INDEX_SORTED
+    found = {}
+    i = bisect.bisect_left(keys, query)
+    while i < len(keys) and keys[i].startswith(query) and len(found) < limit:
+        found[keys[i]] = sorted(UPDATES_INDEX[keys[i]])
+        i += 1
+    return found
 
 # Запрос данных об обновлениях с API сервера
-async def updates__fetch_data(server_id):
+# skip_unchanged=True → NOT_MODIFIED, если список не изменился с прошлого опроса
+async def updates__fetch_data(server_id, skip_unchanged: bool = False):
     logger = logging.getLogger(server_id)
-    srv = SERVERS[server_id]
-    url = f"http://{srv['ip']}:{srv['monitoring_port']}/updates?token={srv['token']}"
-    timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data["updates"]
-                else:
-                    logger.warning(f"[{server_id}] ❌ Неверный статус ответа для UPDATES: {resp.status}")
+        async with agent_api.session() as session:
+            status, data = await agent_api.get_json(session, server_id, "/updates", conditional=True)
+            if status == 304 and skip_unchanged:
+                return agent_api.NOT_MODIFIED
+            if status in (200, 304):
+                return data["updates"]
+            else:
+                logger.warning(f"[{server_id}] ❌ Неверный статус ответа для UPDATES: {status}")
     except Exception as e:
         logger.error(f"[{server_id}] ❌ Ошибка при запросе UPDATES: {e}")
 
@@ -1143,8 +2033,15 @@ async def updates__analyzer(server_id, data):
         if not isinstance(packages, list):
             return False
 
-        if set(packages) != set(state["packages"]):
-            state["packages"] = packages
+        current = {str(pkg) for pkg in packages}
+        added = current - state["packages"]
+        removed = state["packages"] - current
+        if added or removed:
+            state["packages"] = current
+            state["added"] = added
+            state["removed"] = removed
+            updates__index_apply(server_id, added, removed)
+            render.touch("updates", server_id)
             return True
 
         return False
@@ -1153,23 +2050,42 @@ async def updates__analyzer(server_id, data):
         logger.error(f"[{server_id}] updates__analyzer failed -> {e}")
         return False
 
+# Блок одного сервера (из UPDATES_STATE; кэшируется по версии состояния)
+def updates__render_block(sid, diff_only: bool = False) -> str:
+    tpl      = render.TEMPLATES["updates"]
+    name     = render.server_name(sid)
+    state    = UPDATES_STATE[sid]
+    packages = state["packages"]
+
+    def items(pkgs):
+        return [tpl["item"].format(pkg=escape_markdown(pkg)) for pkg in sorted(pkgs)]
+
+    if diff_only:
+        block = [f"*{name}*"]
+        if state["added"]:
+            block.append(tpl["added"])
+            block.extend(items(state["added"]))
+        if state["removed"]:
+            block.append(tpl["removed"])
+            block.extend(items(state["removed"]))
+        block.append(tpl["total"].format(count=len(packages)) if packages else tpl["total_none"])
+        return "\n".join(block)
+
+    if not packages:
+        return tpl["none"].format(name=name)
+    return tpl["list"].format(name=name, items="\n".join(items(packages)))
+
 # Формирование и отправка сообщения в Telegram
-async def updates__send_message(server_id, edit_to: tuple[int, int] | None = None):
+# diff_only=True — только изменения с прошлого опроса (для автоуведомлений)
+async def updates__send_message(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None, diff_only: bool = False):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
         targets = SERVERS.keys() if server_id == "ALL" else [server_id]
-        parts = []
-
-        for sid in targets:
-            name     = escape_markdown(SERVERS[sid]["name"])
-            packages = UPDATES_STATE[sid].get("packages", [])
-
-            if not packages:
-                parts.append(f"*{name}*\n✅ Обновлений нет")
-                continue
-
-            pkg_lines = "\n".join(f"• `{escape_markdown(pkg)}`" for pkg in packages)
-            parts.append(f"*{name}*\n📦 Доступны обновления:\n{pkg_lines}")
+        variant = "diff" if diff_only else "full"
+        parts = [
+            render.block("updates", sid, lambda s: updates__render_block(s, diff_only), variant)
+            for sid in targets
+        ]
 
         msg = "\n\n".join(parts)
         b = bot
@@ -1189,25 +2105,40 @@ async def updates__send_message(server_id, edit_to: tuple[int, int] | None = Non
             except Exception as e:
                 logger.warning(f"edit_message_text failed -> {e}; fallback to send")
 
-        await b.send_message(chat_id=TG_ID, text=msg, parse_mode="MarkdownV2")
+        await _deliver(msg, "updates", server_id, "info", manual=bool(edit_to or reply_to), reply_to=reply_to)
 
     except Exception as e:
         logger.error(f"[{server_id}] updates__send_message failed -> {e}")
 
+# Отчёт «на каких серверах ждёт обновления пакет» — строится из индекса, без запросов к агентам
+def updates__render_package_report(query: str) -> str:
+    found = updates__find_package(query)
+    if not found:
+        return f"📦 Пакет `{escape_markdown(query)}` не найден среди ожидающих обновления"
+    blocks = []
+    for pkg, server_ids in found.items():
+        names = ", ".join(render.server_name(sid) for sid in server_ids if sid in SERVERS)
+        blocks.append(f"📦 `{escape_markdown(pkg)}` — {len(server_ids)}:\n{names}")
+    return "\n\n".join(blocks)
+
 # Автоматический мониторинг (циклически)
 async def updates__auto_monitoring(server_id):
     logger = logging.getLogger(server_id)
     interval = int(SERVERS[server_id]["updates"]["interval"])
     while True:
         try:
-            data = await updates__fetch_data(server_id)
+            data = await updates__fetch_data(server_id, skip_unchanged=True)
+            if data is agent_api.NOT_MODIFIED:
+                logger.info("UPDATES: без изменений (304)")
+                await asyncio.sleep(interval)
+                continue
             changed = await updates__analyzer(server_id, data)
             if changed:
-                await updates__send_message(server_id)
+                await updates__send_message(server_id, diff_only=True)
 
             packages = UPDATES_STATE[server_id]["packages"]
             if packages:
-                logger.warning("UPDATES: " + ", ".join(packages))
+                logger.warning("UPDATES: " + ", ".join(sorted(packages)))
             else:
                 logger.info("UPDATES: none")    
 
@@ -1216,25 +2147,26 @@ async def updates__auto_monitoring(server_id):
         await asyncio.sleep(interval)
 
 # Ручной запрос UPDATES по кнопке (одноразовый)
-async def updates__manual_button(server_id):
+async def updates__manual_button(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
         # плейсхолдер "ожидание"
-        try:
-            b = bot
-            if b is None:
-                logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+        if edit_to is None:
+            try:
+                b = bot
+                if b is None:
+                    logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+                    edit_to = None
+                else:
+                    placeholder = await b.send_message(
+                        **_reply_chat(reply_to),
+                        text="⏳ Ожидание данных",
+                        parse_mode="MarkdownV2",
+                    )
+                    edit_to = (placeholder.chat.id, placeholder.message_id)
+            except Exception as e:
+                logger.warning(f"updates__manual_button: placeholder send failed -> {e}")
                 edit_to = None
-            else:
-                placeholder = await b.send_message(
-                    chat_id=TG_ID,
-                    text="⏳ Ожидание данных",
-                    parse_mode="MarkdownV2",
-                )
-                edit_to = (placeholder.chat.id, placeholder.message_id)
-        except Exception as e:
-            logger.warning(f"updates__manual_button: placeholder send failed -> {e}")
-            edit_to = None
 
         # ===== все сервера =====
         if server_id == "ALL":
@@ -1247,7 +2179,7 @@ async def updates__manual_button(server_id):
                 else:
                     logger.warning(f"[{sid}] ❌ Не удалось получить данные об обновлениях для ручного запроса")
             if any_data:
-                await updates__send_message("ALL", edit_to=edit_to)
+                await updates__send_message("ALL", edit_to=edit_to, reply_to=reply_to)
             else:
                 logger.warning("❌ Ручной запрос UPDATES: ни по одному серверу данных нет")
             return
@@ -1256,34 +2188,196 @@ async def updates__manual_button(server_id):
         data = await updates__fetch_data(server_id)
         if data is not None:
             await updates__analyzer(server_id, data)
-            await updates__send_message(server_id, edit_to=edit_to)
+            await updates__send_message(server_id, edit_to=edit_to, reply_to=reply_to)
         else:
             logger.warning(f"[{server_id}] ❌ Ручной запрос UPDATES: данных нет")
 
     except Exception as e:
         logger.error(f"[{server_id}] updates__manual_button failed -> {e}")
 
+# ===== Еженедельный дайджест обновлений =====
+# UPDATES_DIGEST = {"cron": "0 9 * * 1", "tz": "Europe/Moscow"} — сводка по всем серверам по расписанию
+UPDATES_DIGEST = getattr(config, "UPDATES_DIGEST", {})
+
+async def updates__digest():
+    logger = logging.getLogger("global_monitoring")
+    for sid in SERVERS.keys():
+        data = await updates__fetch_data(sid)
+        if data is not None:
+            await updates__analyzer(sid, data)
+        else:
+            logger.warning(f"[{sid}] ❌ Дайджест UPDATES: данных нет, используется последнее состояние")
+    await updates__send_message("ALL")
+
+async def updates__digest_monitoring():
+    logger = logging.getLogger("global_monitoring")
+    try:
+        schedule = CronSchedule(UPDATES_DIGEST["cron"], UPDATES_DIGEST.get("tz"))
+    except Exception as e:
+        logger.error(f"updates__digest_monitoring: invalid schedule config -> {e}")
+        return
+    await run_schedule("updates_digest", schedule, updates__digest)
+
 # ===== BACKUPS =====
 #  Запрос данных о BACKUPS с API сервера
-async def backups__fetch_data(server_id):
+# skip_unchanged=True → NOT_MODIFIED, если отчёт не изменился с прошлого опроса
+async def backups__fetch_data(server_id, skip_unchanged: bool = False):
     logger = logging.getLogger(server_id)
-    srv = SERVERS[server_id]
-    url = f"http://{srv['ip']}:{srv['monitoring_port']}/backup_json?token={srv['token']}"
-    timeout = aiohttp.ClientTimeout(connect=10, sock_read=20)
 
     try:
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    logger.warning(f"[{server_id}] ❌ Неверный статус ответа для BACKUP: {resp.status}")
+        async with agent_api.session() as session:
+            status, data = await agent_api.get_json(session, server_id, "/backup_json", conditional=True)
+            if status == 304 and skip_unchanged:
+                return agent_api.NOT_MODIFIED
+            if status in (200, 304):
+                return data
+            else:
+                logger.warning(f"[{server_id}] ❌ Неверный статус ответа для BACKUP: {status}")
     except Exception as e:
         logger.error(f"[{server_id}] ❌ Ошибка при запросе BACKUP: {e}")
 
     return None
 
-# Анализ полученных данных
+# ===== История бэкапов =====
+# Компактная локальная история по каждому серверу: data/backups/<server_id>.json,
+# последние N запусков вида {"started", "ok", "duration", "upload", "parts": {part: [ok, size]}}
+BACKUPS_HISTORY_DIR = "data/backups"
+BACKUPS_HISTORY: dict[str, list[dict]] = {}
+BACKUPS_STATE = LazyState(lambda: {"anomalies": []})
+
+def backups__humanize_seconds(sec: int) -> str:
+    try:
+        sec = int(sec)
+    except Exception:
+        return "—"
+    if sec < 60:
+        return f"{sec} сек"
+    m, s = divmod(sec, 60)
+    return f"{m} мин {s} сек" if s else f"{m} мин"
+
+def backups__humanize_size(n: int | float | None) -> str:
+    try:
+        n = float(n or 0)
+    except Exception:
+        n = 0.0
+    units = ["Б", "КБ", "МБ", "ГБ", "ТБ"]
+    i = 0
+    while n >= 1024 and i < len(units) - 1:
+        n /= 1024.0
+        i += 1
+    return f"{n:.1f} {units[i]}"
+
+def backups__history(server_id) -> list[dict]:
+    history = BACKUPS_HISTORY.get(server_id)
+    if history is None:
+        history = []
+        path = os.path.join(BACKUPS_HISTORY_DIR, f"{server_id}.json")
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                history = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.getLogger(server_id).error(f"[{server_id}] не удалось прочитать историю бэкапов -> {e}")
+        BACKUPS_HISTORY[server_id] = history
+    return history
+
+# Сколько запусков хранить; хотя бы одна запись нужна для сравнения
+def backups__history_limit(server_id) -> int:
+    return max(1, int((SERVERS[server_id].get("backups") or {}).get("history", 30)))
+
+# Запись с объединением с файлом (по started): при шардировании историю сервера пополняют
+# и воркер (плановая проверка), и главный процесс (ручной запрос) — каждый из своей копии
+def backups__save_history(server_id):
+    path = os.path.join(BACKUPS_HISTORY_DIR, f"{server_id}.json")
+    try:
+        with file_lock(path):
+            try:
+                with open(path, "r", encoding="utf-8") as fh:
+                    on_disk = json.load(fh)
+            except FileNotFoundError:
+                on_disk = []
+            merged = {r.get("started"): r for r in on_disk}
+            merged.update((r.get("started"), r) for r in BACKUPS_HISTORY.get(server_id, []))
+            history = sorted(merged.values(), key=lambda r: r.get("started") or "")
+            del history[:-backups__history_limit(server_id)]
+            BACKUPS_HISTORY[server_id] = history
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(history, fh, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, path)
+    except Exception as e:
+        logging.getLogger(server_id).error(f"[{server_id}] не удалось сохранить историю бэкапов -> {e}")
+
+# Сжатие отчёта агента до записи истории
+def backups__make_record(data) -> dict:
+    started = str(data.get("started_at", "")).strip()
+    finished = str(data.get("finished_at", "")).strip()
+    duration = None
+    try:
+        t1 = datetime.datetime.strptime(started, "%Y-%m-%d %H:%M:%S")
+        t2 = datetime.datetime.strptime(finished, "%Y-%m-%d %H:%M:%S")
+        duration = max(0, int((t2 - t1).total_seconds()))
+    except Exception:
+        pass
+    parts = {}
+    for key, info in (data.get("parts") or {}).items():
+        info = info or {}
+        parts[str(key)] = [bool(info.get("ok")), int(info.get("size_bytes") or 0)]
+    return {
+        "started": started,
+        "ok": str(data.get("status", "")).lower() == "success",
+        "duration": duration,
+        "upload": str(data.get("upload", "")).lower() == "ok",
+        "parts": parts,
+    }
+
+def _median(values):
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    return ordered[mid] if len(ordered) % 2 else (ordered[mid - 1] + ordered[mid]) / 2
+
+# Сравнение запуска с предыдущими: резкое изменение размера, длительность, пропавшие части, сбои загрузки
+def backups__history_check(server_id, record, previous: list[dict]) -> list[str]:
+    cfg = SERVERS[server_id].get("backups") or {}
+    size_drop = float(cfg.get("size_drop", 0.3))
+    size_growth = float(cfg.get("size_growth", 1.0))
+    duration_factor = float(cfg.get("duration_factor", 3.0))
+    upload_failures = int(cfg.get("upload_failures", 2))
+    anomalies = []
+
+    ok_runs = [r for r in previous if r.get("ok")][-7:]
+    if len(ok_runs) >= 3:
+        total = sum(size for _, size in record["parts"].values())
+        base = _median([sum(size for _, size in r["parts"].values()) for r in ok_runs])
+        if base > 0:
+            ratio = total / base
+            if ratio < 1 - size_drop:
+                anomalies.append(f"размер упал до {ratio:.0%} от обычного ({backups__humanize_size(base)})")
+            elif ratio > 1 + size_growth:
+                anomalies.append(f"размер вырос в {ratio:.1f} раза ({backups__humanize_size(base)} обычно)")
+        durations = [r["duration"] for r in ok_runs if r.get("duration")]
+        if record.get("duration") and len(durations) >= 3:
+            base_dur = _median(durations)
+            if base_dur > 0 and record["duration"] > max(60, base_dur * duration_factor):
+                anomalies.append(
+                    f"длительность {backups__humanize_seconds(record['duration'])} "
+                    f"при обычных {backups__humanize_seconds(base_dur)}"
+                )
+
+    if previous:
+        missing = sorted(set(previous[-1]["parts"]) - set(record["parts"]))
+        if missing:
+            anomalies.append("пропали части: " + ", ".join(missing))
+
+    if upload_failures > 0:
+        recent = (previous + [record])[-upload_failures:]
+        if len(recent) == upload_failures and not any(r.get("upload") for r in recent):
+            anomalies.append(f"загрузка в облако не удалась {upload_failures} раза подряд")
+
+    return anomalies
+
+# Анализ полученных данных: запись в историю и сравнение с прошлыми запусками
 async def backups__analyzer(server_id, data):
     logger = logging.getLogger(server_id)
     try:
@@ -1292,37 +2386,147 @@ async def backups__analyzer(server_id, data):
             return False
 
         status_ok = str(data.get("status", "")).lower() == "success"
-        return not status_ok
+
+        record = backups__make_record(data)
+        history = backups__history(server_id)
+        # один и тот же отчёт (например, при ручном запросе) в историю повторно не пишем
+        if history and history[-1].get("started") == record["started"]:
+            previous = history[:-1]
+            history[-1] = record
+        else:
+            previous = list(history)
+            history.append(record)
+        # при limit == 0 срез [:-0] ничего не удалил бы — backups__history_limit не меньше 1
+        del history[:-backups__history_limit(server_id)]
+        backups__save_history(server_id)
+
+        anomalies = backups__history_check(server_id, record, previous)
+        BACKUPS_STATE[server_id]["anomalies"] = anomalies
+        if anomalies:
+            logger.warning("BACKUPS: отклонения: " + "; ".join(anomalies))
+
+        return (not status_ok) or bool(anomalies)
 
     except Exception as e:
         logger.error(f"[{server_id}] backups__analyzer failed -> {e}")
         return False
 
-# Формирование и отправка сообщения в Telegram
-async def backups__send_message(server_id, data, edit_to: tuple[int, int] | None = None):
+# Просмотр истории бэкапов (без запроса к агенту)
+async def backups__history_button(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
+    try:
+        targets = SERVERS.keys() if server_id == "ALL" else [server_id]
+        parts = []
+        for sid in targets:
+            cfg = SERVERS[sid].get("backups") or {}
+            history = backups__history(sid)[-int(cfg.get("history_view", 7)):]
+            lines = [f"*{render.server_name(sid)}* — последние запуски"]
+            if not history:
+                lines.append("Истории пока нет")
+            for r in reversed(history):
+                total = sum(size for _, size in r["parts"].values())
+                row = (
+                    f"{r['started'] or '—'} | "
+                    f"{backups__humanize_seconds(r['duration']) if r.get('duration') is not None else '—'} | "
+                    f"{backups__humanize_size(total)}"
+                )
+                status = "✅" if r.get("ok") else "❌"
+                upload = "☁️" if r.get("upload") else "🚫☁️"
+                lines.append(f"{status}{upload} `{escape_markdown(row)}`")
+            parts.append("\n".join(lines))
+        msg = "\n\n".join(parts)
 
-    def humanize_seconds(sec: int) -> str:
-        try:
-            sec = int(sec)
-        except Exception:
-            return "—"
-        if sec < 60:
-            return f"{sec} сек"
-        m, s = divmod(sec, 60)
-        return f"{m} мин {s} сек" if s else f"{m} мин"
+        b = bot
+        if b is None:
+            logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+            return
+
+        if edit_to:
+            try:
+                await b.edit_message_text(
+                    chat_id=edit_to[0],
+                    message_id=edit_to[1],
+                    text=msg,
+                    parse_mode="MarkdownV2",
+                )
+                return
+            except Exception as e:
+                logger.warning(f"edit_message_text failed -> {e}; fallback to send")
+
+        await _deliver(msg, "backups", server_id, "info", manual=True, reply_to=reply_to)
+    except Exception as e:
+        logger.error(f"[{server_id}] backups__history_button failed -> {e}")
+
+# Важность уведомления о бэкапах: сбой — critical, отклонения от истории — warning
+def backups__severity(server_id, data) -> str:
+    items = list(data.items()) if server_id == "ALL" else [(server_id, data)]
+    if any(str((payload or {}).get("status", "")).lower() != "success" for _, payload in items):
+        return "critical"
+    if any(BACKUPS_STATE[sid]["anomalies"] for sid, _ in items if sid in BACKUPS_STATE):
+        return "warning"
+    return "info"
+
+# Блок сервера по отчёту агента о бэкапе
+def backups__render_block(sid, payload) -> str:
+    tpl = render.TEMPLATES["backups"]
+    try:
+        srv_name = render.server_name(sid)
+    except Exception:
+        srv_name = escape_markdown(str(sid))
+
+    payload = payload or {}
 
-    def humanize_size(n: int | float | None) -> str:
+    # Статус
+    status_ok = str(payload.get("status", "")).lower() == "success"
+    block_lines = [tpl["header"].format(name=srv_name), tpl["ok"] if status_ok else tpl["failed"]]
+
+    # Время и длительность
+    started = str(payload.get("started_at", "")).strip()
+    finished = str(payload.get("finished_at", "")).strip()
+    if started and finished:
         try:
-            n = float(n or 0)
+            t1 = datetime.datetime.strptime(started, "%Y-%m-%d %H:%M:%S")
+            t2 = datetime.datetime.strptime(finished, "%Y-%m-%d %H:%M:%S")
+            duration = max(0, int((t2 - t1).total_seconds()))
+            block_lines.append(tpl["duration"].format(
+                started=escape_markdown(t1.strftime("%d.%m.%Y %H:%M:%S")),
+                duration=escape_markdown(backups__humanize_seconds(duration)),
+            ))
         except Exception:
-            n = 0.0
-        units = ["Б", "КБ", "МБ", "ГБ", "ТБ"]
-        i = 0
-        while n >= 1024 and i < len(units) - 1:
-            n /= 1024.0
-            i += 1
-        return f"{n:.1f} {units[i]}"
+            block_lines.append(tpl["times"].format(started=escape_markdown(started), finished=escape_markdown(finished)))
+
+    # Части (parts)
+    parts_dict = payload.get("parts") or {}
+    if isinstance(parts_dict, dict) and parts_dict:
+        total_size_b = 0
+        for key, info in parts_dict.items():
+            name = tpl["part_db"] if str(key).lower() == "database" else tpl["part_dir"].format(key=escape_markdown(str(key)))
+            size_b = (info or {}).get("size_bytes", 0)
+            total_size_b += size_b
+            block_lines.append(tpl["part"].format(
+                icon="✅" if (info or {}).get("ok") else "❌",
+                name=name,
+                size=escape_markdown(backups__humanize_size(size_b)),
+            ))
+        block_lines.append(tpl["total"].format(size=escape_markdown(backups__humanize_size(total_size_b))))
+    else:
+        block_lines.append(tpl["no_parts"])
+
+    # Загрузка (upload)
+    up = str(payload.get("upload", "")).lower()
+    block_lines.append(tpl["upload_ok"] if up == "ok" else tpl["upload_failed"])
+
+    # Отклонения от истории прошлых запусков
+    anomalies = BACKUPS_STATE[sid]["anomalies"] if sid in BACKUPS_STATE else []
+    if anomalies:
+        block_lines.append(tpl["anomalies"])
+        block_lines.extend(tpl["anomaly"].format(text=escape_markdown(a)) for a in anomalies)
+
+    return "\n".join(block_lines)
+
+# Формирование и отправка сообщения в Telegram
+async def backups__send_message(server_id, data, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
+    logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
 
     try:
         # Подготовим набор целей
@@ -1331,64 +2535,7 @@ async def backups__send_message(server_id, data, edit_to: tuple[int, int] | None
         else:
             items = [(server_id, data)]
 
-        parts_out = []
-
-        for sid, payload in items:
-            try:
-                srv_name = escape_markdown(SERVERS[sid]["name"])
-            except Exception:
-                srv_name = escape_markdown(str(sid))
-
-            payload = payload or {}
-
-            # Статус
-            status_ok = str(payload.get("status", "")).lower() == "success"
-            status_line = "✅ *Создание резервной копии данных завершилось успешно*" if status_ok else "❌ *Создание резервной копии данных завершилось неудачно*"
-
-            # Время и длительность
-            started = str(payload.get("started_at", "")).strip()
-            finished = str(payload.get("finished_at", "")).strip()
-
-            dur_line = None
-            if started and finished:
-                try:
-                    t1 = datetime.datetime.strptime(started, "%Y-%m-%d %H:%M:%S")
-                    t2 = datetime.datetime.strptime(finished, "%Y-%m-%d %H:%M:%S")
-                    duration = max(0, int((t2 - t1).total_seconds()))
-                    dur_line = f"🕒 `{escape_markdown(t1.strftime('%d.%m.%Y %H:%M:%S'))}` \\=\\> `{escape_markdown(humanize_seconds(duration))}`"
-                except Exception:
-                    dur_line = f"🕒 Старт: `{escape_markdown(started)}`, финиш: `{escape_markdown(finished)}`"
-
-            # Части (parts)
-            parts_block = []
-            parts_dict = payload.get("parts") or {}
-            total_size_b = 0
-            if isinstance(parts_dict, dict) and parts_dict:
-                for key, info in parts_dict.items():
-                    name = "База данных" if str(key).lower() == "database" else f"Папка {escape_markdown(str(key))}"
-                    ok = bool((info or {}).get("ok"))
-                    size_b = (info or {}).get("size_bytes", 0)
-                    total_size_b += size_b
-                    size_h = humanize_size(size_b)
-                    line = f"{'✅' if ok else '❌'} {name} \\=\\> {escape_markdown(size_h)}"
-                    parts_block.append(line)
-                total_size_h = humanize_size(total_size_b)
-                parts_block.append(f"📦 Общий размер бэкапа: {escape_markdown(total_size_h)}")
-            else:
-                parts_block.append("❌ Нет данных о частях бэкапа")
-
-            # Загрузка (upload)
-            up = str(payload.get("upload", "")).lower()
-            upload_line = "✅☁️ Загрузка копий в облако прошла успешно" if up == "ok" else "❌☁️ Загрузка копий в облако сорвалась"
-
-            # Собираем блок для одного сервера
-            block_lines = [f"*{srv_name}*", status_line]
-            if dur_line:
-                block_lines.append(dur_line)
-            block_lines.extend(parts_block)
-            block_lines.append(upload_line)
-
-            parts_out.append("\n".join(block_lines))
+        parts_out = [backups__render_block(sid, payload) for sid, payload in items]
 
         msg = "\n\n".join(parts_out)
         b = bot
@@ -1408,65 +2555,74 @@ async def backups__send_message(server_id, data, edit_to: tuple[int, int] | None
             except Exception as e:
                 logger.warning(f"edit_message_text failed -> {e}; fallback to send")
 
-        await b.send_message(chat_id=TG_ID, text=msg, parse_mode="MarkdownV2")
+        await _deliver(msg, "backups", server_id, backups__severity(server_id, data), manual=bool(edit_to or reply_to), reply_to=reply_to)
 
     except Exception as e:
         logger.error(f"[{server_id}] backups__send_message failed -> {e}")
 
-# Автоматический мониторинг (циклически)
+# Расписание проверки бэкапов: backups.cron (cron-выражение) или backups.time (HH:MM, ежедневно),
+# таймзона — backups.tz (по умолчанию локальная таймзона хоста)
+def backups__schedule(server_id) -> CronSchedule:
+    cfg = SERVERS[server_id]["backups"]
+    if cfg.get("cron"):
+        return CronSchedule(cfg["cron"], cfg.get("tz"))
+    return CronSchedule.daily(cfg["time"], cfg.get("tz"))
+
+async def backups__check(server_id):
+    logger = logging.getLogger(server_id)
+    data = await backups__fetch_data(server_id, skip_unchanged=True)
+    if data is None:
+        logger.warning("BACKUPS: нет данных (fetch failed)")
+        return
+    # тот же отчёт уже разобран (и при необходимости отправлен) прошлой проверкой
+    if data is agent_api.NOT_MODIFIED:
+        logger.info("BACKUPS: без изменений (304)")
+        return
+
+    notify = await backups__analyzer(server_id, data)
+    if notify:
+        await backups__send_message(server_id, data)
+
+    logger.info(f"BACKUPS: {data}")
+
+# Автоматический мониторинг (по расписанию, пропущенная проверка выполняется при старте)
 async def backups__auto_monitoring(server_id):
     logger = logging.getLogger(server_id)
     try:
-        time_str = SERVERS[server_id]["backups"]["time"]
-        hour, minute = map(int, time_str.split(":"))
+        schedule = backups__schedule(server_id)
     except Exception as e:
-        logger.error(f"[{server_id}] backups__auto_monitoring: invalid time config -> {e}")
+        logger.error(f"[{server_id}] backups__auto_monitoring: invalid schedule config -> {e}")
         return
 
-    while True:
-        now = datetime.datetime.now()
-        target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if now >= target:
-            target += datetime.timedelta(days=1)
-
-        sleep_seconds = (target - now).total_seconds()
-        await asyncio.sleep(sleep_seconds)
-
+    async def job():
         try:
-            data = await backups__fetch_data(server_id)
-            if data is None:
-                logger.warning("BACKUPS: нет данных (fetch failed)")
-                continue
-
-            notify = await backups__analyzer(server_id, data)
-            if notify:
-                await backups__send_message(server_id, data)
-
-            logger.info(f"BACKUPS: {data}")
-
+            await backups__check(server_id)
         except Exception as e:
             logger.error(f"[{server_id}] backups__auto_monitoring failed -> {e}")
 
+    await run_schedule(f"backups:{server_id}", schedule, job)
+
 # Ручной запрос по кнопке (одноразовый)
-async def backups__manual_button(server_id):
+async def backups__manual_button(server_id, edit_to: tuple[int, int] | None = None, reply_to: tuple[int, int | None] | None = None):
     logger = logging.getLogger("global_monitoring") if server_id == "ALL" else logging.getLogger(server_id)
     try:
         # плейсхолдер "ожидание"
-        try:
-            b = bot
-            if b is None:
-                logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+        if edit_to is None:
+            try:
+                b = bot
+                if b is None:
+                    logger.error("Bot instance is not set. Call set_bot() from bot.py first.")
+                    edit_to = None
+                else:
+                    placeholder = await b.send_message(
+                        **_reply_chat(reply_to),
+                        text="⏳ Ожидание данных",
+                        parse_mode="MarkdownV2",
+                    )
+                    edit_to = (placeholder.chat.id, placeholder.message_id)
+            except Exception as e:
+                logger.warning(f"backups__manual_button: placeholder send failed -> {e}")
                 edit_to = None
-            else:
-                placeholder = await b.send_message(
-                    chat_id=TG_ID,
-                    text="⏳ Ожидание данных",
-                    parse_mode="MarkdownV2",
-                )
-                edit_to = (placeholder.chat.id, placeholder.message_id)
-        except Exception as e:
-            logger.warning(f"backups__manual_button: placeholder send failed -> {e}")
-            edit_to = None
 
         # ===== все сервера =====
         if server_id == "ALL":
@@ -1482,7 +2638,7 @@ async def backups__manual_button(server_id):
                 else:
                     logger.warning(f"[{sid}] ❌ Не удалось получить данные о бэкапах для ручного запроса")
             if any_data:
-                await backups__send_message("ALL", data_map, edit_to=edit_to)
+                await backups__send_message("ALL", data_map, edit_to=edit_to, reply_to=reply_to)
             else:
                 logger.warning("❌ Ручной запрос BACKUPS: ни по одному серверу данных нет")
             return
@@ -1491,37 +2647,183 @@ async def backups__manual_button(server_id):
         data = await backups__fetch_data(server_id)
         if data is not None:
             await backups__analyzer(server_id, data)
-            await backups__send_message(server_id, data, edit_to=edit_to)
+            await backups__send_message(server_id, data, edit_to=edit_to, reply_to=reply_to)
         else:
             logger.warning(f"[{server_id}] ❌ Ручной запрос BACKUPS: данных нет")
 
     except Exception as e:
         logger.error(f"[{server_id}] backups__manual_button failed -> {e}")
 
+# ===== Состояние серверов (удаление при перезагрузке конфига) =====
+# Состояние новых серверов создаётся лениво при первом обращении (LazyState)
+def state__drop_server(server_id):
+    for state in (AGENTS_STATE, CPU_STATE, DISK_STATE, STREAM_STATE, PROCESSES_STATE, BACKUPS_STATE):
+        state.pop(server_id, None)
+    AGENTS_INCIDENTS.forget(server_id)
+    BACKUPS_HISTORY.pop(server_id, None)
+    updates__forget_server(server_id)
+    render.drop(server_id)
+    for key in [k for k in agent_api.ETAG_CACHE if k[0] == server_id]:
+        del agent_api.ETAG_CACHE[key]
+    for key in [k for k in agent_api.PAYLOAD_STATS if k[0] == server_id]:
+        del agent_api.PAYLOAD_STATS[key]
+    for key in [k for k in _SYNCED_VERSIONS if k[1] == server_id]:
+        del _SYNCED_VERSIONS[key]
+
+# ===== Снимок состояния серверов (передача между процессами) =====
+# Состояние, которое переносится вместе с сервером; STREAM_STATE привязан к живому соединению
+SNAPSHOT_STATES = {
+    "agents": AGENTS_STATE,
+    "cpu_ram": CPU_STATE,
+    "disk": DISK_STATE,
+    "processes": PROCESSES_STATE,
+    "updates": UPDATES_STATE,
+    "backups": BACKUPS_STATE,
+}
+
+# (категория, server_id) → (версия из снимка, локальная версия после применения)
+_SYNCED_VERSIONS: dict[tuple[str, str], tuple[int, int]] = {}
+
+# Снимок состояния серверов server_ids (по умолчанию — всех, вместе с сайтами) и их ботов;
+# результат сериализуем pickle
+def state__snapshot(server_ids=None) -> dict:
+    sids = set(SERVERS) if server_ids is None else set(server_ids)
+    bot_names = [name for sid in sids for name in BOTS_REGISTRY["server_to_bots"].get(sid, [])]
+    return {
+        "sites": dict(SITES_STATE) if server_ids is None else {},
+        "servers": {
+            category: {sid: st for sid, st in state.items() if sid in sids}
+            for category, state in SNAPSHOT_STATES.items()
+        },
+        "bots": {name: BOTS_STATE[name] for name in bot_names if name in BOTS_STATE},
+        "bots_history": {name: BOTS_HISTORY[name] for name in bot_names if name in BOTS_HISTORY},
+        "versions": {key: v for key, v in render.STATE_VERSIONS.items() if key[1] in sids},
+    }
+
+# Применение снимка: записи заменяются целиком, серверы не из конфига пропускаются
+def state__restore(snapshot: dict):
+    for category, states in snapshot.get("servers", {}).items():
+        target = SNAPSHOT_STATES.get(category)
+        if target is None:
+            continue
+        for sid, st in states.items():
+            if sid not in SERVERS:
+                continue
+            if category == "updates":
+                old = UPDATES_STATE[sid]["packages"]
+                updates__index_apply(sid, st["packages"] - old, old - st["packages"])
+            target[sid] = st
+
+    urls = set(SITES_MONITOR.get("urls", []))
+    for url, is_ok in snapshot.get("sites", {}).items():
+        if url in urls:
+            SITES_STATE[url] = is_ok
+
+    names = BOTS_REGISTRY["bot_to_server"]
+    for name, st in snapshot.get("bots", {}).items():
+        if name in names:
+            BOTS_STATE[name] = st
+    for name, history in snapshot.get("bots_history", {}).items():
+        if name in names:
+            BOTS_HISTORY[name] = history
+
+    # кэш отрисовки сбрасывается, только если состояние в снимке или локально изменилось
+    for key, remote in snapshot.get("versions", {}).items():
+        if key[1] not in SERVERS:
+            continue
+        if _SYNCED_VERSIONS.get(key) != (remote, render.STATE_VERSIONS.get(key, 0)):
+            render.touch(*key)
+            _SYNCED_VERSIONS[key] = (remote, render.STATE_VERSIONS[key])
+
 # ===== Основной код одного сервера =====
-async def monitor(server_id: str):
+# warmup_at — момент (сек. от старта) первого опроса сервера, warmup_slot — окно,
+# в котором разносятся первые опросы категорий, чтобы не бить агента всем сразу
+async def monitor(server_id: str, warmup_at: float = 0.0, warmup_slot: float = 0.0):
     logger = logging.getLogger(server_id)
     logger.info("=== START MONITORING ===")
 
     tasks = []
-
-    def start_task(coro, name):
+    loops = [
+        ("cpu_ram", cpu_ram__auto_monitoring),
+        ("disk", disk__auto_monitoring),
+        ("processes", processes__auto_monitoring),
+        ("updates", updates__auto_monitoring),
+        ("bots", bots__updates__auto_monitoring),
+        ("backups", backups__auto_monitoring),
+    ]
+    if (SERVERS[server_id].get("stream") or {}).get("enabled"):
+        loops.append(("stream", stream__auto_monitoring))
+
+    async def delayed(func, delay):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await func(server_id)
+
+    for i, (name, func) in enumerate(loops):
+        delay = warmup_at + warmup_slot * i / len(loops)
         try:
-            t = asyncio.create_task(coro)
+            t = asyncio.create_task(delayed(func, delay))
             tasks.append(t)
-            logger.info(f"✓ Task started: {name}")
+            logger.info(f"✓ Task started: {name} (через {delay:.1f} с)")
         except Exception as e:
             logger.error(f"❌ Failed to start task {name}: {e}")
 
-    start_task(bots__updates__auto_monitoring(server_id), "bots")
-    start_task(cpu_ram__auto_monitoring(server_id), "cpu_ram")
-    start_task(disk__auto_monitoring(server_id), "disk")
-    start_task(processes__auto_monitoring(server_id), "processes")
-    start_task(updates__auto_monitoring(server_id), "updates")
-    start_task(backups__auto_monitoring(server_id), "backups")
-
     await asyncio.gather(*tasks)
 
+# ===== Реестр фоновых задач мониторинга =====
+# server_id → задача monitor(server_id); "sites" → задача monitor_sites();
+# "updates_digest" → задача updates__digest_monitoring()
+MONITOR_TASKS: dict[str, asyncio.Task] = {}
+SITES_TASK_KEY = "sites"
+
+def start_server_monitor(server_id: str, warmup_at: float = 0.0, warmup_slot: float = 0.0) -> asyncio.Task:
+    task = MONITOR_TASKS.get(server_id)
+    if task is None or task.done():
+        task = asyncio.create_task(
+            monitor(server_id, warmup_at, warmup_slot),
+            name=f"monitor:{SERVERS[server_id]['name']}",
+        )
+        MONITOR_TASKS[server_id] = task
+    return task
+
+# Разнесённый старт серверов server_ids (по умолчанию — всех): первые опросы равномерно
+# распределяются по окну spread
+def start_all_monitors(spread: float = 0.0, server_ids=None):
+    server_ids = list(SERVERS.keys()) if server_ids is None else list(server_ids)
+    slot = spread / len(server_ids) if server_ids else 0.0
+    for i, sid in enumerate(server_ids):
+        start_server_monitor(sid, warmup_at=slot * i, warmup_slot=slot)
+
+def start_sites_monitor() -> asyncio.Task:
+    task = MONITOR_TASKS.get(SITES_TASK_KEY)
+    if task is None or task.done():
+        task = asyncio.create_task(monitor_sites(), name="monitor:sites")
+        MONITOR_TASKS[SITES_TASK_KEY] = task
+    return task
+
+DIGEST_TASK_KEY = "updates_digest"
+
+def start_digest_monitor() -> asyncio.Task | None:
+    if not UPDATES_DIGEST.get("cron"):
+        return None
+    task = MONITOR_TASKS.get(DIGEST_TASK_KEY)
+    if task is None or task.done():
+        task = asyncio.create_task(updates__digest_monitoring(), name="monitor:updates_digest")
+        MONITOR_TASKS[DIGEST_TASK_KEY] = task
+    return task
+
+# Остановка задачи (сервера или сайтов) с ожиданием отмены
+async def stop_monitor(key: str):
+    task = MONITOR_TASKS.pop(key, None)
+    if task is None:
+        return
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+async def stop_all_monitors():
+    for key in list(MONITOR_TASKS.keys()):
+        await stop_monitor(key)
+
 # ===== Запуск мониторинга =====
 async def main():
     print("🚀 Мониторинг запущен...")
@@ -1529,6 +2831,8 @@ async def main():
 
     tasks = [monitor(server_id) for server_id in SERVERS.keys()]
     tasks.append(monitor_sites())
+    if UPDATES_DIGEST.get("cron"):
+        tasks.append(updates__digest_monitoring())
     logging.getLogger("global_monitoring").info(f"Мониторинг запущен для серверов: {', '.join(SERVERS.keys())}")
 
     await asyncio.gather(*tasks)
@@ -0,0 +1,131 @@
+"""
+• Слой рендера отчётов MarkdownV2
+  - Шаблоны сообщений по категориям: статические подписи экранированы один раз, при импорте.
+  - Имена серверов, ботов и URL экранируются с мемоизацией (utils.escape_cached).
+  - Кэш отрендеренных блоков по серверам: ключ (категория, сервер, вариант), блок строится
+    заново, только если сменилась версия состояния (touch() из анализатора) или имя сервера.
+    Кэшируются блоки, целиком определяемые состоянием (процессы, обновления); CPU/RAM, диски
+    и бэкапы рендерятся из только что полученных данных, боты — с текущим аптаймом.
+  - Отчёты «Все» собираются из кэша — заново рендерятся только изменившиеся сервера.
+"""
+
+from config import SERVERS
+from utils import escape_cached
+
+# (категория, server_id) → версия состояния
+STATE_VERSIONS: dict[tuple[str, str], int] = {}
+
+# (категория, server_id, вариант) → (версия, текст блока)
+BLOCKS: dict[tuple[str, str, str], tuple[tuple, str]] = {}
+
+CACHE_STATS = {"hits": 0, "misses": 0}
+
+# ===== Шаблоны =====
+# {name} — экранированное имя сервера, остальные поля — уже экранированные фрагменты
+TEMPLATES = {
+    "processes": {
+        "ok": "*{name}*\n✅ Крашнутых сервисов нет\n⛏️ Майнеры не обнаружены",
+        "header": "*{name}*\n",
+        "failed": "❌ *Сервисы с ошибками:*",
+        "no_failed": "✅ Ошибок сервисов не обнаружено",
+        "miners": "⛏️ *⚠️ВНИМАНИЕ⚠️: обнаружены майнеры\\!*",
+        "no_miners": "⛏️ Майнеры не обнаружены",
+        "source": "• {source}:\n{items}",
+        "source_ok": "• {source}: ✅ ок",
+        "item": "  \\- {item}",
+    },
+    "sites": {
+        "problem": "🌐 *Проблема с сайтом:*\n\n{text}",
+        "request": "🌐 *Результат опроса сайтов:*\n\n{text}",
+        "recovered": "🌐 *Сайт восстановился:*\n\n{text}",
+        "flapping": "🌐 *Сайт флапает:*\n\n{text}\n\nУведомления по нему приостановлены до стабилизации",
+        "stable": "🌐 *Сайт стабилизировался:*\n\n{text}",
+    },
+    "agents": {
+        "up": "🔌 *Агент снова отвечает:*",
+        "down": "🔌 *Агент не отвечает:*",
+        "item": "• {name}",
+    },
+    "bots": {
+        "header": "*🤖 {bot} — {name}*",
+        "down": "❌ БОТ НЕДОСТУПЕН ❌",
+        "ok": "✅ НОРМА ✅",
+        "new_version": "⚠️ Версия изменена на `{version}`",
+        "version": "📦 Версия: `{version}`",
+        "restarted": "🆘 Бот был перезапущен\n🕒 Аптайм: `{uptime}`",
+        "uptime": "🕒 Аптайм: `{uptime}`",
+        "history": "📜 История:",
+        "history_item": "{icon} `{when}` — {detail}",
+        "no_history": "📜 История: событий нет",
+    },
+    "cpu_ram": {
+        "single": "*{name}*\n{label}\n\n🖥 *CPU*: `{cpu} %`\n💻 *RAM*: `{ram} %`\n📈 *Load Avg*: `{l1}`, `{l5}`, `{l15}`",
+        "row": "*{name}*\n{label}\n🖥 CPU: `{cpu} %` \\| 💻 RAM: `{ram} %` \\| 📈 Load: `{l1}`, `{l5}`, `{l15}`",
+    },
+    "disk": {
+        "single": "*{name}*\n{state}\n\n{lines}",
+        "row": "*{name}*\n{state}\n{lines}",
+        "alert": "⚠️ *ПРЕВЫШЕНИЕ*",
+        "ok": "✅ *НОРМА*",
+        "root": "💽 Диск",
+        "mount": "💽 `{mount}`",
+        "usage_total": "{label}: `{used}` — `{usage}`",
+        "usage": "{label}: `{usage}`",
+        "inodes": ", inodes `{inodes}`",
+        "reason": " ⚠️ _{reason}_",
+        "eta": "\n   ⏳ Заполнится через ~{eta}",
+        "gone": "💽 `{mount}`: пропала из ответа агента, тревога снята",
+    },
+    "backups": {
+        "header": "*{name}*",
+        "ok": "✅ *Создание резервной копии данных завершилось успешно*",
+        "failed": "❌ *Создание резервной копии данных завершилось неудачно*",
+        "duration": "🕒 `{started}` \\=\\> `{duration}`",
+        "times": "🕒 Старт: `{started}`, финиш: `{finished}`",
+        "part": "{icon} {name} \\=\\> {size}",
+        "part_db": "База данных",
+        "part_dir": "Папка {key}",
+        "total": "📦 Общий размер бэкапа: {size}",
+        "no_parts": "❌ Нет данных о частях бэкапа",
+        "upload_ok": "✅☁️ Загрузка копий в облако прошла успешно",
+        "upload_failed": "❌☁️ Загрузка копий в облако сорвалась",
+        "anomalies": "⚠️ *Отклонения от прошлых запусков:*",
+        "anomaly": "• {text}",
+    },
+    "updates": {
+        "none": "*{name}*\n✅ Обновлений нет",
+        "list": "*{name}*\n📦 Доступны обновления:\n{items}",
+        "item": "• `{pkg}`",
+        "added": "➕ Новые обновления:",
+        "removed": "➖ Больше не требуют обновления:",
+        "total": "📦 Всего ожидает: {count}",
+        "total_none": "✅ Обновлений нет",
+    },
+}
+
+# Изменение состояния категории по серверу — блоки с прошлой версией станут неактуальны
+def touch(category: str, server_id: str):
+    key = (category, server_id)
+    STATE_VERSIONS[key] = STATE_VERSIONS.get(key, 0) + 1
+
+def server_name(server_id: str) -> str:
+    return escape_cached(SERVERS[server_id]["name"])
+
+# Блок сервера из кэша или через build(server_id), если версия состояния изменилась
+def block(category: str, server_id: str, build, variant: str = "") -> str:
+    version = (STATE_VERSIONS.get((category, server_id), 0), SERVERS[server_id]["name"])
+    key = (category, server_id, variant)
+    cached = BLOCKS.get(key)
+    if cached is not None and cached[0] == version:
+        CACHE_STATS["hits"] += 1
+        return cached[1]
+    CACHE_STATS["misses"] += 1
+    text = build(server_id)
+    BLOCKS[key] = (version, text)
+    return text
+
+def drop(server_id: str):
+    for key in [k for k in BLOCKS if k[1] == server_id]:
+        del BLOCKS[key]
+    for key in [k for k in STATE_VERSIONS if k[1] == server_id]:
+        del STATE_VERSIONS[key]
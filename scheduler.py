@@ -0,0 +1,192 @@
+"""
+• Планировщик по cron-выражениям
+  - Стандартный 5-польный cron: минута, час, день месяца, месяц, день недели (0/7 — воскресенье),
+    поддерживаются *, списки, диапазоны и шаги (*/15, 1-5, 0,30).
+  - Явная таймзона (zoneinfo), по умолчанию — локальная таймзона хоста.
+  - Ожидание короткими отрезками asyncio.sleep (монотонные часы event loop) с перепроверкой
+    настенного времени: сон, suspend и переходы на летнее время не дают накопиться дрейфу.
+  - Догон пропущенного запуска: если с момента последнего запуска наступал слот расписания,
+    задача выполняется сразу (один раз). Время последних запусков хранится в data/schedules.json;
+    файл общий для процессов-воркеров, поэтому обновляется под блокировкой (utils.file_lock).
+  - Годится для любой периодической проверки: бэкапы, еженедельный дайджест обновлений и т.д.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import datetime
+from zoneinfo import ZoneInfo
+from utils import file_lock
+
+logger = logging.getLogger("global_monitoring")
+
+SCHEDULES_FILE = "data/schedules.json"
+# Максимальный отрезок одного сна, сек.
+MAX_SLEEP_SLICE = 60.0
+
+_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 7),
+)
+
+def _parse_field(expr: str, lo: int, hi: int) -> set[int]:
+    values = set()
+    for part in expr.split(","):
+        step = 1
+        if "/" in part:
+            part, step_s = part.split("/", 1)
+            step = int(step_s)
+            if step <= 0:
+                raise ValueError(f"bad step in {expr!r}")
+        if part == "*":
+            start, end = lo, hi
+        elif "-" in part:
+            start_s, end_s = part.split("-", 1)
+            start, end = int(start_s), int(end_s)
+        else:
+            start = int(part)
+            end = hi if step > 1 else start
+        if start < lo or end > hi or start > end:
+            raise ValueError(f"value out of range in {expr!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    def __init__(self, expr: str, tz: str | None = None):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression must have 5 fields: {expr!r}")
+        self.expr = expr
+        parsed = [_parse_field(f, lo, hi) for f, (_, lo, hi) in zip(fields, _FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # cron: 0 и 7 — воскресенье; в Python воскресенье — 6
+        self.weekdays = {(d - 1) % 7 for d in weekdays}
+        self.day_any = fields[2] == "*"
+        self.weekday_any = fields[4] == "*"
+        # None — локальное время хоста: смещение определяется заново при каждом расчёте,
+        # а не фиксируется при старте (иначе после перехода на зимнее/летнее время слот сдвинется)
+        self.tz = ZoneInfo(tz) if tz else None
+
+    # Расписание «каждый день в HH:MM»
+    @classmethod
+    def daily(cls, time_str: str, tz: str | None = None) -> "CronSchedule":
+        hour, minute = map(int, time_str.split(":"))
+        return cls(f"{minute} {hour} * * *", tz)
+
+    def _day_matches(self, d: datetime.date) -> bool:
+        day_ok = d.day in self.days
+        weekday_ok = d.weekday() in self.weekdays
+        # как в cron: если ограничены оба поля, достаточно совпадения любого
+        if self.day_any:
+            return weekday_ok
+        if self.weekday_any:
+            return day_ok
+        return day_ok or weekday_ok
+
+    # Ближайший момент срабатывания строго после after (aware datetime)
+    def next_after(self, after: datetime.datetime) -> datetime.datetime:
+        local = after.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0)
+        t = local + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                year, month = (t.year + 1, 1) if t.month == 12 else (t.year, t.month + 1)
+                t = datetime.datetime(year, month, 1)
+                continue
+            if not self._day_matches(t.date()):
+                t = datetime.datetime(t.year, t.month, t.day) + datetime.timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+                continue
+            if t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+                continue
+            # наивное локальное время: astimezone() берёт смещение хоста на эту дату
+            return t.replace(tzinfo=self.tz) if self.tz is not None else t.astimezone()
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+# ===== Хранение времени последних запусков =====
+def _load_last_runs() -> dict:
+    try:
+        with open(SCHEDULES_FILE, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"scheduler: не удалось прочитать {SCHEDULES_FILE} -> {e}")
+        return {}
+
+def _write_last_runs(runs: dict):
+    try:
+        os.makedirs(os.path.dirname(SCHEDULES_FILE), exist_ok=True)
+        tmp = SCHEDULES_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(runs, fh)
+        os.replace(tmp, SCHEDULES_FILE)
+    except Exception as e:
+        logger.error(f"scheduler: не удалось сохранить {SCHEDULES_FILE} -> {e}")
+
+def _save_last_run(name: str, when: datetime.datetime):
+    with file_lock(SCHEDULES_FILE):
+        runs = _load_last_runs()
+        runs[name] = when.timestamp()
+        _write_last_runs(runs)
+
+def last_runs() -> dict:
+    return _load_last_runs()
+
+# Слияние с временем запусков другого экземпляра (снимок HA): по каждому расписанию — более позднее
+def merge_last_runs(runs: dict):
+    with file_lock(SCHEDULES_FILE):
+        current = _load_last_runs()
+        merged = {name: max(ts, current.get(name, 0)) for name, ts in runs.items()}
+        if any(current.get(name) != ts for name, ts in merged.items()):
+            current.update(merged)
+            _write_last_runs(current)
+
+# Ожидание до момента target отрезками не длиннее MAX_SLEEP_SLICE
+async def sleep_until(target: datetime.datetime):
+    while True:
+        remaining = (target - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, MAX_SLEEP_SLICE))
+
+# Бесконечный цикл запуска job() по расписанию.
+# catch_up=True — выполнить пропущенный слот сразу после старта/пробуждения.
+async def run_schedule(name: str, schedule: CronSchedule, job, catch_up: bool = True):
+    last_ts = _load_last_runs().get(name)
+    last_run = datetime.datetime.fromtimestamp(last_ts, datetime.timezone.utc) if last_ts else None
+
+    while True:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if last_run is None:
+            # первый запуск: отсчёт от текущего момента
+            last_run = now
+            _save_last_run(name, last_run)
+
+        slot = schedule.next_after(last_run)
+        if slot > now:
+            await sleep_until(slot)
+        elif not catch_up:
+            # пропущенные слоты не догоняем — переходим к следующему после текущего момента
+            last_run = now
+            continue
+        else:
+            logger.warning(f"scheduler[{name}]: пропущен запуск {slot.isoformat()}, выполняем сейчас")
+
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"scheduler[{name}]: job failed -> {e}")
+
+        # все пропущенные слоты покрываются одним запуском
+        last_run = max(slot, datetime.datetime.now(datetime.timezone.utc))
+        _save_last_run(name, last_run)
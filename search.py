@@ -0,0 +1,59 @@
+"""
+• Поиск серверов, ботов и сайтов для inline-режима (@bot srv-na…)
+  - In-memory префиксный индекс: отсортированный список токенов, поиск — bisect по префиксу.
+  - Токены: полное имя и его части (по пробелам, -, _, ., /, :), для серверов — ещё и server_id,
+    для сайтов — адрес без схемы.
+  - Индекс пересобирается лениво, когда меняется поколение реестра callback-кнопок
+    (после перезагрузки конфига с изменёнными списками).
+"""
+
+import re
+import bisect
+import callbacks
+from config import SERVERS
+
+_SPLIT = re.compile(r"[\s\-_./:]+")
+
+# generation — поколение реестра, по которому построен индекс; keys — токены; entries — (токен, вид, ключ)
+_INDEX = {"generation": None, "keys": [], "entries": []}
+
+def _tokens(text: str) -> set[str]:
+    text = str(text).lower()
+    return {text} | {part for part in _SPLIT.split(text) if part}
+
+def _build():
+    entries = []
+    for sid in callbacks.targets("server"):
+        for token in _tokens(SERVERS[sid]["name"]) | _tokens(sid):
+            entries.append((token, "server", sid))
+    for bot_name in callbacks.targets("bot"):
+        for token in _tokens(bot_name):
+            entries.append((token, "bot", bot_name))
+    for url in callbacks.targets("site"):
+        for token in _tokens(url.split("://", 1)[-1]):
+            entries.append((token, "site", url))
+    entries.sort()
+    _INDEX.update(generation=callbacks.generation(), keys=[e[0] for e in entries], entries=entries)
+
+# Поиск по префиксу. Возвращает [(вид, ключ)] без повторов; пустой запрос — первые цели реестра
+def find(query: str, limit: int = 20) -> list[tuple[str, str]]:
+    if _INDEX["generation"] != callbacks.generation():
+        _build()
+
+    query = query.strip().lower()
+    if not query:
+        found = [(kind, key) for kind in ("server", "bot", "site") for key in callbacks.targets(kind)]
+        return found[:limit]
+
+    keys, entries = _INDEX["keys"], _INDEX["entries"]
+    found, seen = [], set()
+    for i in range(bisect.bisect_left(keys, query), len(keys)):
+        if not keys[i].startswith(query):
+            break
+        _, kind, key = entries[i]
+        if (kind, key) not in seen:
+            seen.add((kind, key))
+            found.append((kind, key))
+            if len(found) >= limit:
+                break
+    return found
@@ -0,0 +1,350 @@
+"""
+• Шардирование мониторинга серверов по процессам
+  - Включается SHARDING["workers"] > 1: SERVERS делятся между N процессами-воркерами
+    консистентным хешированием server_id (при добавлении сервера переезжает только он сам).
+  - Воркер крутит циклы мониторинга и анализаторы своих серверов; соединение с Telegram
+    остаётся в главном процессе. Вызовы бота из воркера (send_message, edit_message_text, …)
+    передаются в главный процесс через multiprocessing-очередь и выполняются там.
+  - Раз в SHARDING["sync_interval"] сек. воркер отправляет снимок состояния своих серверов:
+    ручные запросы, дашборд и дайджест в главном процессе видят актуальные данные.
+  - Упавший воркер перезапускается; при старте и перезапуске (в том числе после /reload)
+    воркер получает последний снимок — повторных уведомлений «с нуля» нет.
+  - События сбоя/восстановления агентов и ботов воркер передаёт корреляторам главного процесса:
+    массовый сбой виден целиком, даже если его цели разошлись по разным шардам.
+  - Записи логов воркеров пишет в файлы главный процесс (у каждого файла один писатель).
+  - Общие файлы состояния (data/schedules.json, data/backups/<server_id>.json) воркеры и главный
+    процесс обновляют под блокировкой файла; история бэкапов при записи объединяется с файлом.
+  - Пример: SHARDING = {"workers": 4, "vnodes": 64, "sync_interval": 5}
+"""
+
+import time
+import asyncio
+import bisect
+import hashlib
+import logging
+import logging.handlers
+import threading
+import itertools
+import multiprocessing
+from types import SimpleNamespace
+from contextlib import suppress
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+import config
+from config import SERVERS
+import monitoring
+
+logger = logging.getLogger("global_monitoring")
+
+SHARDING = getattr(config, "SHARDING", {})
+CALL_TIMEOUT = 60.0
+
+def enabled() -> bool:
+    return int(SHARDING.get("workers", 0)) > 1
+
+# ===== Консистентное хеширование =====
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+class HashRing:
+    def __init__(self, nodes: int, vnodes: int = 64):
+        ring = sorted((_hash(f"worker-{node}#{i}"), node) for node in range(nodes) for i in range(vnodes))
+        self._keys = [h for h, _ in ring]
+        self._nodes = [node for _, node in ring]
+
+    def node(self, key: str) -> int:
+        i = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[i]
+
+# Разбиение серверов на шарды: [[server_id, ...], ...] по числу воркеров
+def shards(server_ids, workers: int) -> list[list[str]]:
+    ring = HashRing(workers, int(SHARDING.get("vnodes", 64)))
+    result = [[] for _ in range(workers)]
+    for sid in server_ids:
+        result[ring.node(sid)].append(sid)
+    return result
+
+# ===== Воркер =====
+class ShardCallError(Exception):
+    pass
+
+# Заменяет Bot в воркере: вызовы методов уходят в главный процесс, ответ ждём по call_id
+class BotProxy:
+    def __init__(self, worker: int, outbox):
+        self._worker = worker
+        self._outbox = outbox
+        self._calls: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+
+    def __getattr__(self, method: str):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(**kwargs):
+            return await self._request("call", method, kwargs)
+        return call
+
+    # Запрос в главный процесс: (kind, worker, call_id, *payload), ответ — через resolve
+    async def _request(self, kind: str, *payload):
+        call_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = future
+        self._outbox.put((kind, self._worker, call_id, *payload))
+        try:
+            return await asyncio.wait_for(future, CALL_TIMEOUT)
+        finally:
+            self._calls.pop(call_id, None)
+
+    def resolve(self, call_id: int, ok: bool, value):
+        future = self._calls.get(call_id)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(ShardCallError(value))
+
+# Заменяет IncidentCorrelator агентов/ботов в воркере: события уходят корреляторам главного
+# процесса. tracks() отвечает по целям, о сбое которых воркер сообщал и не сообщил о восстановлении
+class IncidentProxy:
+    def __init__(self, group: str, proxy: BotProxy, tracked=(), context=None):
+        self.group = group
+        self._proxy = proxy
+        self._tracked = set(tracked)
+        self._context = context     # цель → доп. данные для главного процесса (или None)
+
+    def tracks(self, target: str) -> bool:
+        return target in self._tracked
+
+    async def failed(self, target: str, segment: str = "all"):
+        self._tracked.add(target)
+        context = self._context(target) if self._context else None
+        await self._proxy._request("incident", self.group, "failed", target, segment, context)
+
+    async def recovered(self, target: str) -> bool:
+        self._tracked.discard(target)
+        return bool(await self._proxy._request("incident", self.group, "recovered", target, None, None))
+
+    def forget(self, target: str):
+        self._tracked.discard(target)
+
+# Логи воркера уходят в главный процесс: при spawn воркер заново импортирует bot.py и получает
+# те же файловые обработчики — без этого в один файл писали бы несколько процессов
+def _route_logs(log_queue, names):
+    handler = logging.handlers.QueueHandler(log_queue)
+    for name in [*names, *logging.root.manager.loggerDict]:
+        log = logging.getLogger(name)
+        log.handlers = [handler]
+        log.propagate = False
+        if log.level == logging.NOTSET:
+            log.setLevel(logging.INFO)
+
+def _worker_main(index: int, server_ids: list[str], snapshot: dict, tracked: dict, spread: float, outbox, inbox, log_queue):
+    _route_logs(log_queue, ["global_monitoring", *server_ids])
+    with suppress(KeyboardInterrupt):
+        asyncio.run(_worker(index, server_ids, snapshot, tracked, spread, outbox, inbox))
+
+async def _worker(index: int, server_ids: list[str], snapshot: dict, tracked: dict, spread: float, outbox, inbox):
+    loop = asyncio.get_running_loop()
+    proxy = BotProxy(index, outbox)
+    monitoring.set_bot(proxy)
+    monitoring.state__restore(snapshot)
+    monitoring.AGENTS_INCIDENTS = IncidentProxy("agents", proxy, tracked.get("agents", ()))
+    # вердикт флаппинга нужен главному процессу, когда он разошлёт алерты по итогам окна
+    monitoring.BOTS_INCIDENTS = IncidentProxy(
+        "bots", proxy, tracked.get("bots", ()),
+        lambda name: {"flap": monitoring.BOTS_STATE[name].get("flap")},
+    )
+    monitoring.start_all_monitors(spread, server_ids)
+    logger.info(f"shard {index}: мониторинг запущен для {', '.join(server_ids) or '—'}")
+
+    async def sync():
+        interval = max(1.0, float(SHARDING.get("sync_interval", 5)))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                outbox.put(("state", index, monitoring.state__snapshot(server_ids)))
+            except Exception as e:
+                logger.error(f"shard {index}: state sync failed -> {e}")
+
+    sync_task = asyncio.create_task(sync(), name=f"shard:{index}:sync")
+    try:
+        while True:
+            message = await loop.run_in_executor(None, inbox.get)
+            if message[0] == "result":
+                _, call_id, ok, value = message
+                proxy.resolve(call_id, ok, value)
+            elif message[0] == "stop":
+                break
+    finally:
+        sync_task.cancel()
+        await monitoring.stop_all_monitors()
+        # последний снимок — чтобы следующий запуск продолжил с того же места
+        with suppress(Exception):
+            outbox.put(("state", index, monitoring.state__snapshot(server_ids)))
+        logger.info(f"shard {index}: остановлен")
+
+# ===== Главный процесс =====
+_CTX = multiprocessing.get_context("spawn")
+
+# index → {"process": Process, "inbox": Queue, "servers": [server_id, ...]}
+WORKERS: dict[int, dict] = {}
+_SHARDS = {"outbox": None, "logs": None, "log_thread": None, "pump": None, "stopping": False}
+
+def running() -> bool:
+    return _SHARDS["pump"] is not None
+
+# Корреляторы главного процесса, которым воркеры передают события
+def _correlators() -> dict:
+    return {"agents": monitoring.AGENTS_INCIDENTS, "bots": monitoring.BOTS_INCIDENTS}
+
+# Цели шарда, которые коррелятор ещё отслеживает: перезапущенный воркер сообщит об их восстановлении
+def _tracked(server_ids: list[str]) -> dict:
+    bot_names = [name for sid in server_ids for name in monitoring.BOTS_REGISTRY["server_to_bots"].get(sid, [])]
+    return {
+        "agents": [sid for sid in server_ids if monitoring.AGENTS_INCIDENTS.tracks(sid)],
+        "bots": [name for name in bot_names if monitoring.BOTS_INCIDENTS.tracks(name)],
+    }
+
+def _spawn(index: int, server_ids: list[str], spread: float = 0.0):
+    inbox = _CTX.Queue()
+    process = _CTX.Process(
+        target=_worker_main,
+        args=(
+            index, server_ids, monitoring.state__snapshot(server_ids), _tracked(server_ids), spread,
+            _SHARDS["outbox"], inbox, _SHARDS["logs"],
+        ),
+        name=f"shard-{index}",
+        daemon=True,
+    )
+    process.start()
+    WORKERS[index] = {"process": process, "inbox": inbox, "servers": server_ids}
+    logger.info(f"shard {index}: pid {process.pid}, серверов {len(server_ids)}")
+
+# Вызов метода настоящего бота по запросу воркера; Message сводится к (chat.id, message_id)
+async def _call(bot: Bot, index: int, call_id: int, method: str, kwargs: dict):
+    ok, value = True, None
+    for attempt in range(2):
+        try:
+            result = await getattr(bot, method)(**kwargs)
+            if hasattr(result, "message_id"):
+                value = SimpleNamespace(chat=SimpleNamespace(id=result.chat.id), message_id=result.message_id)
+            elif isinstance(result, (bool, int, str)):
+                value = result
+            break
+        except TelegramRetryAfter as e:
+            if attempt:
+                ok, value = False, f"{type(e).__name__}: {e}"
+                break
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            ok, value = False, f"{type(e).__name__}: {e}"
+            break
+    worker = WORKERS.get(index)
+    if worker is not None:
+        with suppress(Exception):
+            worker["inbox"].put(("result", call_id, ok, value))
+
+# Событие коррелятора из воркера; ответ recovered() нужен воркеру для обычного алерта
+async def _incident(index: int, call_id: int, group: str, op: str, target: str, segment, context):
+    ok, value = True, None
+    try:
+        correlator = _correlators()[group]
+        if op == "failed":
+            if context and target in monitoring.BOTS_STATE:
+                monitoring.BOTS_STATE[target].update(context)
+            await correlator.failed(target, segment)
+        else:
+            value = await correlator.recovered(target)
+    except Exception as e:
+        ok, value = False, f"{type(e).__name__}: {e}"
+    worker = WORKERS.get(index)
+    if worker is not None:
+        with suppress(Exception):
+            worker["inbox"].put(("result", call_id, ok, value))
+
+# Запись логов воркеров обработчиками логгеров главного процесса
+def _write_logs(log_queue):
+    while True:
+        record = log_queue.get()
+        if record is None:
+            return
+        with suppress(Exception):
+            logging.getLogger(record.name).handle(record)
+
+async def _pump(bot: Bot):
+    loop = asyncio.get_running_loop()
+    outbox = _SHARDS["outbox"]
+    while True:
+        message = await loop.run_in_executor(None, outbox.get)
+        kind = message[0]
+        if kind == "call":
+            _, index, call_id, method, kwargs = message
+            asyncio.create_task(_call(bot, index, call_id, method, kwargs))
+        elif kind == "incident":
+            asyncio.create_task(_incident(*message[1:]))
+        elif kind == "state":
+            try:
+                monitoring.state__restore(message[2])
+            except Exception as e:
+                logger.error(f"shard {message[1]}: state restore failed -> {e}")
+        elif kind == "stop":
+            return
+
+# Перезапуск упавших воркеров
+async def _supervise():
+    while True:
+        await asyncio.sleep(5)
+        if _SHARDS["stopping"]:
+            continue
+        for index, worker in list(WORKERS.items()):
+            if not worker["process"].is_alive():
+                logger.error(f"shard {index}: процесс завершился (code {worker['process'].exitcode}), перезапуск")
+                _spawn(index, worker["servers"])
+
+# Запуск воркеров и приёма сообщений от них; вызывается вместо start_all_monitors
+def start(bot: Bot, spread: float = 0.0):
+    workers = int(SHARDING["workers"])
+    _SHARDS.update(outbox=_CTX.Queue(), logs=_CTX.Queue(), stopping=False)
+    _SHARDS["log_thread"] = threading.Thread(target=_write_logs, args=(_SHARDS["logs"],), name="shards:logs", daemon=True)
+    _SHARDS["log_thread"].start()
+    for index, server_ids in enumerate(shards(SERVERS.keys(), workers)):
+        _spawn(index, server_ids, spread)
+    _SHARDS["pump"] = [
+        asyncio.create_task(_pump(bot), name="shards:pump"),
+        asyncio.create_task(_supervise(), name="shards:supervise"),
+    ]
+
+async def _stop_workers(timeout: float = 10.0):
+    _SHARDS["stopping"] = True
+    for worker in WORKERS.values():
+        with suppress(Exception):
+            worker["inbox"].put(("stop",))
+    deadline = time.monotonic() + timeout
+    for worker in WORKERS.values():
+        process = worker["process"]
+        await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.terminate()
+    WORKERS.clear()
+    # снимки, отправленные воркерами при остановке, ещё в очереди — даём их разобрать
+    await asyncio.sleep(0.5)
+
+# Перезапуск всех воркеров: после /reload воркеры заново читают config.py
+async def restart():
+    await _stop_workers()
+    for index, server_ids in enumerate(shards(SERVERS.keys(), int(SHARDING["workers"]))):
+        _spawn(index, server_ids)
+    _SHARDS["stopping"] = False
+
+async def stop():
+    if not running():
+        return
+    await _stop_workers()
+    _SHARDS["outbox"].put(("stop",))
+    for task in _SHARDS["pump"]:
+        task.cancel()
+    await asyncio.gather(*_SHARDS["pump"], return_exceptions=True)
+    _SHARDS["pump"] = None
+    _SHARDS["logs"].put(None)
+    await asyncio.to_thread(_SHARDS["log_thread"].join, 5.0)
@@ -1,4 +1,100 @@
+import os
 import re
+import fcntl
+import logging
+from contextlib import contextmanager
+from array import array
+from functools import lru_cache
+from logging.handlers import TimedRotatingFileHandler
+
+_MARKDOWN_SPECIAL = re.compile(r'([_*[\]()~`>#+=|{}.!-])')
 
 def escape_markdown(text: str) -> str:
-    return re.sub(r'([_*[\]()~`>#+=|{}.!-])', r'\\\1', str(text))
\ No newline at end of file
+    return _MARKDOWN_SPECIAL.sub(r'\\\1', str(text))
+
+# Экранирование статических строк (имена серверов и ботов, URL, подписи) с мемоизацией;
+# для текста, меняющегося от опроса к опросу (пакеты, процессы, причины), — escape_markdown
+@lru_cache(maxsize=4096)
+def escape_cached(text: str) -> str:
+    return escape_markdown(text)
+
+# Словарь состояния: запись создаётся фабрикой при первом обращении по ключу
+class LazyState(dict):
+    def __init__(self, factory):
+        super().__init__()
+        self._factory = factory
+
+    def __missing__(self, key):
+        value = self[key] = self._factory()
+        return value
+
+# Кольцевой буфер фиксированного размера на array('d') — компактное окно последних значений
+class RingBuffer:
+    __slots__ = ("data", "size", "pos", "count")
+
+    def __init__(self, size: int):
+        self.size = max(1, int(size))
+        self.data = array("d", [0.0]) * self.size
+        self.pos = 0
+        self.count = 0
+
+    def push(self, value: float):
+        self.data[self.pos] = value
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    # Значения от самого старого к самому новому
+    def values(self) -> list[float]:
+        if self.count < self.size:
+            return list(self.data[:self.count])
+        return list(self.data[self.pos:]) + list(self.data[:self.pos])
+
+    def __len__(self):
+        return self.count
+
+# ===== Файлы состояния =====
+# Межпроцессная блокировка файла состояния: чтение-изменение-запись целиком под flock на
+# соседнем .lock-файле (воркеры шардирования и главный процесс пишут одни и те же файлы)
+@contextmanager
+def file_lock(path: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+# ===== Логирование =====
+log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+
+# Общий консольный вывод
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(log_formatter)
+
+# Логгер с ежедневной ротацией файла (хранение 7 дней) и выводом в консоль.
+# Файл открывается при первой записи (delay=True), повторный вызов не дублирует хэндлеры.
+def setup_file_logger(name: str, path: str, level: int = logging.INFO) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    abs_path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+    if not any(getattr(h, "baseFilename", None) == abs_path for h in logger.handlers):
+        file_handler = TimedRotatingFileHandler(
+            filename=abs_path,
+            when="midnight",
+            interval=1,
+            backupCount=7,
+            encoding="utf-8",
+            delay=True,
+        )
+        file_handler.setFormatter(log_formatter)
+        logger.addHandler(file_handler)
+    if console_handler not in logger.handlers:
+        logger.addHandler(console_handler)
+    return logger
+
+# Логгер сервера из конфига
+def setup_server_logger(server_id: str) -> logging.Logger:
+    return setup_file_logger(server_id, f"logs/monitoring/{server_id}.log")
@@ -0,0 +1,66 @@
+"""
+• Режим webhook вместо long polling
+  - Включается WEBHOOK["enabled"]; в том же процессе поднимается aiohttp-приложение,
+    которое принимает апдейты от Telegram и передаёт их в Dispatcher.
+  - Запросы без верного X-Telegram-Bot-Api-Secret-Token отбрасываются (секрет из
+    WEBHOOK["secret"], иначе генерируется при старте).
+  - Настраиваются host, port и path; за reverse proxy слушаем обычный HTTP, без прокси —
+    HTTPS прямо здесь (ssl_cert/ssl_key), самоподписанный сертификат передаётся в setWebhook.
+  - Пример: WEBHOOK = {"enabled": True, "url": "https://mon.example.com/tg", "host": "127.0.0.1",
+    "port": 8080, "path": "/tg", "secret": "..."}
+"""
+
+import ssl
+import asyncio
+import logging
+import secrets
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import FSInputFile
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import config
+
+logger = logging.getLogger("bot")
+
+WEBHOOK = getattr(config, "WEBHOOK", {})
+
+def enabled() -> bool:
+    return bool(WEBHOOK.get("enabled"))
+
+def _ssl_context() -> ssl.SSLContext | None:
+    cert, key = WEBHOOK.get("ssl_cert"), WEBHOOK.get("ssl_key")
+    if not cert:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+# Запуск приёма апдейтов через webhook; работает до отмены задачи
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    path = WEBHOOK.get("path", "/telegram")
+    host = WEBHOOK.get("host", "127.0.0.1")
+    port = int(WEBHOOK.get("port", 8080))
+    secret = WEBHOOK.get("secret") or secrets.token_urlsafe(32)
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    # startup/shutdown Dispatcher вызываются вместе с приложением
+    setup_application(app, dp, bot=bot)
+
+    certificate = FSInputFile(WEBHOOK["ssl_cert"]) if WEBHOOK.get("self_signed") and WEBHOOK.get("ssl_cert") else None
+    await bot.set_webhook(
+        url=WEBHOOK["url"],
+        secret_token=secret,
+        certificate=certificate,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port, ssl_context=_ssl_context())
+    await site.start()
+    logger.info(f"Webhook listening on {host}:{port}{path} → {WEBHOOK['url']}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()